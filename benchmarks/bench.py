@@ -0,0 +1,250 @@
+import argparse
+import base64
+import json
+import logging
+import os
+import shutil
+import tempfile
+import timeit
+from os.path import join
+
+from ruamel.yaml import YAML
+from tabulate import tabulate
+
+from source.config import Config
+from source.http_server import create_app, Dashboard
+from source.utils import Nodes, natural_keys, parse_tag, convert_price, parse_price, print_state, template_task, \
+    template_bid
+from source.worknode import WorkNode, State, get_css_class
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = join(ROOT, "benchmarks", "baseline.json")
+FLEET_SIZES = [100, 1000, 10000]
+BENCHMARKS = []
+
+
+def benchmark(name, sizes=(None,)):
+    def decorator(setup):
+        for size in sizes:
+            BENCHMARKS.append(("{}[{}]".format(name, size) if size else name, setup, size))
+        return setup
+
+    return decorator
+
+
+class Fleet(object):
+    size = None
+
+    @staticmethod
+    def prepare(workdir):
+        # Copy of repository conf with one task file per fleet size
+        shutil.copytree(join(ROOT, "conf"), join(workdir, "conf"))
+        os.chdir(workdir)
+        task = Config.load_cfg("config_task_claymore.yaml")
+        yaml_ = YAML()
+        for nodes in FLEET_SIZES:
+            with open(join("conf", "fleet_{}.yaml".format(nodes)), "w") as f:
+                yaml_.dump(dict(task, numberofnodes=nodes, tag="BENCH{}".format(nodes)), f)
+        Config.load_base_config()
+        Config.base_config["dump_files"] = False
+        Config.base_config["http_server"] = {"user": "bench", "password": "bench"}
+
+    @staticmethod
+    def load_configs(nodes):
+        Config.base_config["tasks"] = ["fleet_{}.yaml".format(nodes)]
+        Config.load_task_configs()
+
+    @staticmethod
+    def get(nodes):
+        # Nodes registry filled with nodes in every state
+        if Fleet.size != nodes:
+            Fleet.load_configs(nodes)
+            for node_tag in Nodes.get_nodes_keys():
+                Nodes.remove_node(node_tag)
+            states = list(State)
+            for num, node_tag in enumerate(sorted(Config.node_configs, key=natural_keys)):
+                node = WorkNode.create_empty(None, node_tag)
+                node.status = states[num % len(states)]
+                Nodes.add_node(node)
+            Fleet.size = nodes
+        return Nodes.get_nodes_arr()
+
+
+@benchmark("natural_keys_sort", FLEET_SIZES)
+def natural_keys_sort(nodes):
+    tags = [node.node_tag for node in Fleet.get(nodes)][::-1]
+    return lambda: sorted(tags, key=natural_keys)
+
+
+@benchmark("nodes_get_arr", FLEET_SIZES)
+def nodes_get_arr(nodes):
+    Fleet.get(nodes)
+    return Nodes.get_nodes_arr
+
+
+@benchmark("as_table_item", [1000])
+def as_table_item(nodes):
+    nodes_ = Fleet.get(nodes)
+    return lambda: [node.as_table_item for node in nodes_]
+
+
+@benchmark("get_css_class", [1000])
+def css_class(nodes):
+    nodes_ = Fleet.get(nodes)
+    return lambda: [get_css_class(node.status, 0) for node in nodes_]
+
+
+def index_client(nodes):
+    Fleet.get(nodes)
+    client = create_app().test_client()
+    headers = {"Authorization": "Basic " + base64.b64encode(b"bench:bench").decode()}
+    return lambda: client.get("/", headers=headers)
+
+
+@benchmark("index_render", [100, 1000])
+def index_render(nodes):
+    get = index_client(nodes)
+
+    def render():
+        Dashboard.key = None
+        get()
+
+    return render
+
+
+@benchmark("index_cached", [1000])
+def index_cached(nodes):
+    return index_client(nodes)
+
+
+@benchmark("load_task_configs", [10000])
+def load_task_configs(nodes):
+    def load():
+        Config.files = {}
+        Config.tasks = {}
+        Fleet.load_configs(nodes)
+
+    Fleet.size = None
+    return load
+
+
+@benchmark("load_task_configs_unchanged", [10000])
+def load_task_configs_unchanged(nodes):
+    Fleet.size = None
+    Fleet.load_configs(nodes)
+    return lambda: Fleet.load_configs(nodes)
+
+
+@benchmark("template_task")
+def template_task_(_):
+    return lambda: template_task(join(Config.config_folder, "claymore.yaml"), {"node_tag": "BENCH_1"})
+
+
+@benchmark("template_bid")
+def template_bid_(_):
+    task = Config.load_cfg("config_task_claymore.yaml")
+    return lambda: template_bid(task, "BENCH_1")
+
+
+@benchmark("parse_tag")
+def parse_tag_(_):
+    tag = base64.b64encode(b"BENCH_1\0\0\0").decode()
+    return lambda: parse_tag(tag)
+
+
+@benchmark("convert_price")
+def convert_price_(_):
+    return lambda: convert_price("5555555555555")
+
+
+@benchmark("parse_price")
+def parse_price_(_):
+    return lambda: parse_price("0.0200USD/h")
+
+
+@benchmark("print_state", FLEET_SIZES)
+def print_state_(nodes):
+    Fleet.get(nodes)
+    return print_state
+
+
+def measure(fn, repeat):
+    # Best time of one call out of several runs, each run lasting at least 0.2 sec
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_time(seconds):
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= scale:
+            return "{:.2f} {}".format(seconds / scale, unit)
+    return "{:.0f} ns".format(seconds / 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of monitor hot paths")
+    parser.add_argument("filter", nargs="*", help="run benchmarks with names containing any of these")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark, best is taken (default 5)")
+    parser.add_argument("--compare", nargs="?", const=BASELINE, metavar="FILE",
+                        help="compare with baseline results saved on this machine, benchmarks/baseline.json by "
+                             "default, and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=25,
+                        help="slowdown against baseline counted as regression, percent (default 25)")
+    parser.add_argument("--save", nargs="?", const=BASELINE, metavar="FILE",
+                        help="save results as baseline, benchmarks/baseline.json by default")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("monitor").setLevel(logging.WARNING)
+    baseline = {}
+    if args.compare:
+        if not os.path.exists(args.compare):
+            parser.error("No baseline {}, run with --save to record one".format(args.compare))
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    results = {}
+    rows = []
+    regressions = []
+    try:
+        Fleet.prepare(workdir)
+        for name, setup, size in BENCHMARKS:
+            if args.filter and not any(filter_ in name for filter_ in args.filter):
+                continue
+            results[name] = measure(setup(size), args.repeat)
+            change = ""
+            if name in baseline:
+                ratio = results[name] / baseline[name]
+                change = "{:+.1f}%".format((ratio - 1) * 100)
+                if ratio > 1 + args.tolerance / 100:
+                    regressions.append(name)
+                    change += " REGRESSION"
+            rows.append([name, format_time(results[name]),
+                         format_time(baseline[name]) if name in baseline else "", change])
+            print("{} {}".format(name, format_time(results[name])))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(tabulate(rows, ["Benchmark", "Time", "Baseline", "Change"], tablefmt="grid"))
+    if args.save:
+        # Benchmarks left out by filter keep their saved results
+        saved = {}
+        if os.path.exists(args.save):
+            with open(args.save) as f:
+                saved = json.load(f)
+        saved.update(results)
+        with open(args.save, "w") as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Baseline saved to {}".format(args.save))
+    if regressions:
+        print("{} benchmarks are slower than baseline by more than {}%: {}"
+              .format(len(regressions), args.tolerance, ", ".join(regressions)))
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+
+from source.bulk import BulkRunner, blacklist_list, blacklist_remove, cancel_orders, close_deals, reprice, \
+    stale_orders, orders_by_tag, deals_by_tag
+from source.config import Config
+from source.init import init_accounts, refresh_prices
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fleet-wide operations on orders, deals and blacklist")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent requests (default 16)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    blacklist = commands.add_parser("blacklist", help="show or clear blacklist")
+    blacklist.add_argument("action", choices=["list", "clear", "remove"])
+    blacklist.add_argument("addresses", nargs="*", help="addresses to remove")
+    for name, help_ in [("cancel-orders", "cancel active orders"), ("close-deals", "close open deals"),
+                        ("reprice", "cancel orders placed at outdated price, running bot places new ones")]:
+        command = commands.add_parser(name, help=help_)
+        command.add_argument("--tag", help="task tag or node tag, all when omitted")
+        command.add_argument("--dry-run", action="store_true", help="only show what would be done")
+        if name == "close-deals":
+            command.add_argument("--blacklist", action="store_true", help="blacklist workers of closed deals")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    Config.load_config()
+    runner = BulkRunner(args.workers)
+    if args.command == "blacklist":
+        # sonmcli manages blacklist of the account it's configured with, other keys aren't decrypted
+        failures = blacklist_command(args, runner, init_accounts(1).primary)
+    else:
+        accounts = init_accounts()
+        if args.command == "reprice":
+            refresh_prices(accounts.primary)
+        failures = []
+        for sonm_api in accounts.apis:
+            if len(accounts.apis) > 1:
+                print("Account {}".format(sonm_api.account))
+            failures += fleet_command(args, runner, sonm_api)
+    exit(1 if failures else 0)
+
+
+def blacklist_command(args, runner, sonm_api):
+    failures = []
+    if args.action == "remove":
+        _, failures = blacklist_remove(runner, sonm_api, args.addresses)
+    else:
+        addresses = blacklist_list(sonm_api)
+        if args.action == "list" or not addresses:
+            print("Blacklist contains {} addresses{}".format(len(addresses), ":" if addresses else "."))
+            for address in addresses:
+                print(address)
+        else:
+            _, failures = blacklist_remove(runner, sonm_api, addresses)
+    return failures
+
+
+def fleet_command(args, runner, sonm_api):
+    failures = []
+    if args.dry_run:
+        if args.command == "close-deals":
+            items = deals_by_tag(runner, sonm_api, args.tag)
+        elif args.command == "reprice":
+            items = ["{} {}".format(order_["id"], order_["tag"]) for order_ in stale_orders(sonm_api, args.tag)]
+        else:
+            items = ["{} {}".format(order_["id"], order_["tag"]) for order_ in orders_by_tag(sonm_api, args.tag)]
+        print("Would {} {} items:".format(args.command.replace("-", " "), len(items)))
+        for item in items:
+            print(item)
+    elif args.command == "cancel-orders":
+        _, failures = cancel_orders(runner, sonm_api, args.tag)
+    elif args.command == "close-deals":
+        _, failures = close_deals(runner, sonm_api, args.tag, args.blacklist)
+    elif args.command == "reprice":
+        _, failures = reprice(runner, sonm_api, args.tag)
+    return failures
+
+
+if __name__ == "__main__":
+    main()
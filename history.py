@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import time
+
+from tabulate import tabulate
+
+from source.history import QUERIES, query
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query history of orders, deals, tasks and prices")
+    parser.add_argument("query", choices=sorted(QUERIES.keys()))
+    parser.add_argument("--days", type=float, default=30, help="look back this many days (default 30)")
+    parser.add_argument("--db", default="out/history.db", help="history database (default out/history.db)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print("History database {} not found".format(args.db))
+        exit(1)
+    title, columns, rows = query(args.db, args.query, time.time() - args.days * 24 * 3600)
+    print(title)
+    print(tabulate(rows, columns, tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    main()
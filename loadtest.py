@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ruamel.yaml import YAML
+from tabulate import tabulate
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+TASK = {"tag": "LOAD", "price_coefficient": 10, "max_price": "0.05", "ets": 180, "task_start_timeout": 600,
+        "template_file": "task_template.yaml", "duration": "0h", "counterparty": "", "identity": "anonymous",
+        "ramsize": 2000, "storagesize": 1, "cpucores": 1, "sysbenchsingle": 500, "sysbenchmulti": 1000,
+        "netdownload": 10, "netupload": 10, "overlay": False, "incoming": False, "gpucount": 0, "gpumem": 0,
+        "ethhashrate": 0}
+
+
+def write_conf(workdir, nodes, args):
+    conf = os.path.join(workdir, "conf")
+    os.makedirs(conf)
+    config = {"node_address": ["fake://{}".format(num) for num in range(args.accounts)],
+              "ethereum": {"key_path": "", "password": ""},
+              "tasks": ["task.yaml"],
+              "http_server": {"run": False},
+              "restart_timeout": 600,
+              "dump_files": False,
+              "startup_rate": args.startup_rate,
+              "journal": {"enabled": False},
+              "history": {"enabled": False},
+              "fake_node": {"latency": args.latency,
+                            "error_rate": args.error_rate,
+                            "deal_delay": args.deal_delay,
+                            "task_failure_rate": args.task_failure_rate}}
+    yaml_ = YAML()
+    with open(os.path.join(conf, "config.yaml"), "w") as f:
+        yaml_.dump(config, f)
+    with open(os.path.join(conf, "task.yaml"), "w") as f:
+        yaml_.dump(dict(TASK, numberofnodes=nodes), f)
+    shutil.copy(os.path.join(ROOT, "conf", "claymore.yaml"), os.path.join(conf, "task_template.yaml"))
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def run_worker(nodes, duration, steady_share):
+    # Runs monitor in this process against fake node, prints one json line with results
+    sys.path.insert(0, ROOT)
+    import new_monitor
+    from source.metrics import Metrics
+    from source.utils import Nodes
+    from source.worknode import State
+
+    logging.getLogger("monitor").setLevel(logging.WARNING)
+    logging.getLogger("monitor_http").setLevel(logging.WARNING)
+    threading.Thread(target=new_monitor.main, daemon=True).start()
+    started = time.time()
+    cpu_started = time.process_time()
+    steady = None
+    steady_calls = 0
+    max_rss = 0
+    while time.time() - started < duration:
+        time.sleep(1)
+        max_rss = max(max_rss, rss_mb())
+        if steady is None and Metrics.apis:
+            running = Nodes.count_by_state().get(State.TASK_RUNNING, 0)
+            if running >= nodes * steady_share:
+                steady = time.time() - started
+                steady_calls = sum(sonm_api.get_node().calls for sonm_api in Metrics.apis)
+    elapsed = time.time() - started
+    calls = sum(sonm_api.get_node().calls for sonm_api in Metrics.apis)
+    steady_rate = None
+    if steady is not None and elapsed - steady >= 1:
+        steady_rate = round((calls - steady_calls) / (elapsed - steady) * 60)
+    print(json.dumps({"nodes": nodes,
+                      "calls_per_min": round(calls / elapsed * 60),
+                      "steady_calls_per_min": steady_rate,
+                      "cpu_pct": round((time.process_time() - cpu_started) / elapsed * 100, 1),
+                      "max_rss_mb": round(max_rss, 1),
+                      "steady_sec": round(steady) if steady is not None else None,
+                      "accounts": len(Metrics.apis)}))
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def run(nodes, args):
+    workdir = tempfile.mkdtemp(prefix="loadtest-{}-".format(nodes))
+    try:
+        write_conf(workdir, nodes, args)
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", str(nodes),
+                                 "--duration", str(args.duration), "--steady", str(args.steady)],
+                                cwd=workdir, stdout=subprocess.PIPE, timeout=args.duration + 300)
+        lines = result.stdout.decode("utf-8").strip().splitlines()
+        if result.returncode != 0 or not lines:
+            print("Run with {} nodes failed".format(nodes))
+            return None
+        return json.loads(lines[-1])
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run monitor against local fake sonm node at several fleet sizes")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--duration", type=int, default=600, help="sec per fleet size (default 600)")
+    parser.add_argument("--steady", type=float, default=0.95,
+                        help="share of nodes running tasks that counts as steady state (default 0.95)")
+    parser.add_argument("--startup-rate", type=float, default=10, help="nodes started per second (default 10)")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake node request latency, sec")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of failed fake node requests")
+    parser.add_argument("--deal-delay", type=float, nargs=2, default=[5, 30], help="min and max sec to match order")
+    parser.add_argument("--task-failure-rate", type=float, default=0, help="share of tasks that break")
+    parser.add_argument("--accounts", type=int, default=1, help="accounts nodes are sharded across (default 1)")
+    parser.add_argument("--keep", action="store_true", help="keep work directories")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.duration, args.steady)
+        return
+    rows = []
+    for nodes in args.nodes:
+        print("Running {} nodes for {} sec...".format(nodes, args.duration))
+        result = run(nodes, args)
+        if result:
+            rows.append([result["nodes"], result["calls_per_min"], result["steady_calls_per_min"],
+                         result["cpu_pct"], result["max_rss_mb"], result["steady_sec"]])
+    print(tabulate(rows, ["Nodes", "Calls/min", "Steady calls/min", "CPU %", "Max RSS MB", "Time to steady, sec"],
+                   tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    main()
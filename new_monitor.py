@@ -1,72 +1,131 @@
 #!/usr/bin/env python3.7
 import concurrent
+import copy
 import logging
+import multiprocessing
 import os
-import time
+import threading
+from datetime import datetime
 from logging.config import dictConfig
 from os.path import join
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
+from source.history import HistoryStore
+from source.journal import Journal
+from source.repricer import Repricer
+from source.cluster import Coordinator, Worker
 from source.http_server import run_http_server, SonmHttpServer
+from source.scheduler import NodeScheduler
+from source.supervisor import Supervisor
 from source.utils import Nodes, print_state, create_dir
 from source.config import Config
-from source.init import init_nodes_state, reload_config, init_sonm_api, check_balance
+from source.init import init_nodes_state, reload_config, init_accounts, check_balance, poll_orders_and_deals, \
+    poll_interval, print_api_stats, refresh_prices, price_refresh_interval, restore_nodes_state, verify_nodes_state, \
+    scan_market, market_interval, market_enabled, reload_prices
 
 
-def setup_logging(default_config='logging.yaml', default_level=logging.INFO):
+def setup_logging(default_config='logging.yaml', default_level=logging.INFO, worker=None):
     if os.path.exists(join(Config.config_folder, default_config)):
         config = Config.load_cfg(default_config)
+        if worker is not None:
+            config = worker_logging(config, worker)
         dictConfig(config)
     else:
         logging.basicConfig(level=default_level)
 
 
-def watch(executor, futures):
-    for node in Nodes.get_nodes_arr():
-        futures[node.node_tag] = executor.submit(node.watch_node)
-        time.sleep(1)
-    while len(futures) > 0:
-        # Clear finished futures
-        for item in [{"tag": node_tag, "future": future} for node_tag, future in futures.items()]:
-            if item["future"].done():
-                exception_ = item["future"].exception()
-                logger.info("Removing Node {} from execution list.".format(item["tag"]))
-                del futures[item["tag"]]
-                if exception_:
-                    logger.exception("Node {} failed with exception".format(item["tag"]), exception_)
-                    Nodes.get_node(item["tag"]).RUNNING = False
-        for node_tag in Nodes.get_nodes_keys():
-            # Destroy nodes, if they aren't exist in reloaded config
-            if node_tag not in Config.node_configs.keys():
-                logger.info("Stopping Node {}. It doesn't exist in configuration".format(node_tag))
-                Nodes.get_node(node_tag).finish_work()
-                logger.info("Removing Node {} from active nodes list.".format(node_tag))
-                Nodes.remove_node(node_tag)
-        for node_tag in Nodes.get_nodes_keys():
-            # Add new nodes to executor:
-            if not Nodes.get_node(node_tag).is_running:
-                logger.info("Adding Node {} to executor".format(node_tag))
-                futures[node_tag] = executor.submit(Nodes.get_node(node_tag).watch_node)
-        time.sleep(1)
+def worker_logging(config, index):
+    # Every worker process writes its own log files, a file shared by processes would be rotated by each of them
+    config = copy.deepcopy(config)
+    for handler in config.get("handlers", {}).values():
+        if "filename" in handler:
+            base, ext = os.path.splitext(handler["filename"])
+            handler["filename"] = "{}.worker-{}{}".format(base, index, ext)
+            # Files of handlers worker doesn't use, like http log, aren't created
+            handler["delay"] = True
+    for formatter in config.get("formatters", {}).values():
+        if "format" in formatter:
+            formatter["format"] = "%(processName)s - " + formatter["format"]
+    return config
+
+
+def scheduler_workers():
+    return int(Config.base_config["scheduler_workers"]) if "scheduler_workers" in Config.base_config else 8
+
+
+def startup_rate():
+    return float(Config.base_config["startup_rate"]) if "startup_rate" in Config.base_config else 10
+
+
+def restart_delay():
+    return float(Config.base_config["restart_delay"]) if "restart_delay" in Config.base_config else 10
+
+
+def workers():
+    return int(Config.base_config["workers"]) if "workers" in Config.base_config else 1
 
 
 def main():
     Config.load_config()
-    sonm_api = init_sonm_api()
-    check_balance(sonm_api)
-    Config.load_prices(sonm_api)
-    init_nodes_state(sonm_api)
+    if workers() > 1:
+        run_coordinator(workers())
+    else:
+        run_monitor()
+
+
+def run_worker(index, count, inbox, outbox):
+    # Entry point of worker process started by coordinator
+    setup_logging(worker=index)
+    Config.set_partition(index, count)
+    Config.load_config()
+    run_monitor(Worker(index, inbox, outbox))
+
+
+def run_monitor(worker=None):
+    # Worker process gets prices and market snapshot from coordinator, which also serves dashboard and balance
+    accounts = init_accounts()
+    if worker:
+        worker.wait_prices()
+    else:
+        check_balance(accounts)
+        refresh_prices(accounts.primary)
+    journal = Journal.from_config(Config.base_config.get("journal"))
+    restored = journal and restore_nodes_state(accounts, journal)
+    if not restored:
+        init_nodes_state(accounts)
+    if journal:
+        Nodes.add_listener(journal.node_changed)
+        journal.record_nodes(Nodes.get_nodes_arr())
+        journal.start()
+    history = HistoryStore.from_config(Config.base_config.get("history"))
+    if history:
+        Nodes.add_listener(history.node_changed)
+        history.start()
+    if restored:
+        threading.Thread(target=verify_nodes_state, kwargs={"accounts": accounts}, daemon=True).start()
     scheduler = BackgroundScheduler()
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=100)
-    futures_ = dict()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    node_scheduler = NodeScheduler(scheduler_workers())
+    supervisor = Supervisor(node_scheduler, startup_rate(), restart_delay())
+    repricer = Repricer.from_config(Config.base_config.get("repricing"), node_scheduler.wake)
     try:
         scheduler.start()
         scheduler.add_job(print_state, 'interval', seconds=60, id='print_state')
-        scheduler.add_job(reload_config, 'interval', kwargs={"sonm_api": sonm_api}, seconds=60, id='reload_config')
-        scheduler.add_job(check_balance, 'interval', kwargs={"sonm_api": sonm_api}, seconds=600, id='check_balance')
-        executor.submit(run_http_server)
-        watch(executor, futures_)
+        scheduler.add_job(print_api_stats, 'interval', kwargs={"accounts": accounts}, seconds=60, id='print_api_stats')
+        scheduler.add_job(reload_config, 'interval', kwargs={"accounts": accounts, "predict": worker is None},
+                          seconds=60, id='reload_config')
+        scheduler.add_job(poll_orders_and_deals, 'interval', kwargs={"accounts": accounts},
+                          seconds=poll_interval(), id='poll_orders_and_deals', next_run_time=datetime.now())
+        if repricer:
+            scheduler.add_job(repricer.run, 'interval', seconds=repricer.interval, id='reprice')
+        if worker:
+            worker.start()
+        else:
+            add_price_jobs(scheduler, accounts, history)
+            executor.submit(run_http_server)
+        node_scheduler.start()
+        supervisor.run()
         print_state()
         logger.info("Work completed")
     except KeyboardInterrupt:
@@ -75,15 +134,72 @@ def main():
         logger.exception("System Exit", e)
     finally:
         logger.info("Script exiting. Sonm node will continue work")
-        for n in Nodes.get_nodes_arr():
-            n.stop_work()
+        if worker:
+            worker.stop()
+        node_scheduler.stop_all(Nodes.get_nodes_arr())
+        SonmHttpServer.KEEP_RUNNING = False
+        node_scheduler.shutdown()
+        executor.shutdown(wait=False)
+        scheduler.shutdown(wait=False)
+        accounts.shutdown()
+        if journal:
+            journal.stop()
+        if history:
+            history.stop()
+
+
+def add_price_jobs(scheduler, accounts, history):
+    scheduler.add_job(check_balance, 'interval', kwargs={"accounts": accounts}, seconds=600, id='check_balance')
+    scheduler.add_job(refresh_prices, 'interval', kwargs={"sonm_api": accounts.primary, "history": history},
+                      seconds=price_refresh_interval(), id='refresh_prices')
+    if market_enabled():
+        scheduler.add_job(scan_market, 'interval', kwargs={"sonm_api": accounts.primary},
+                          seconds=market_interval(), id='scan_market', next_run_time=datetime.now())
+
+
+def run_coordinator(count):
+    # Nodes are run by worker processes, coordinator requests prices and balance once for all of them
+    # and serves dashboard from node states workers report
+    accounts = init_accounts()
+    check_balance(accounts)
+    refresh_prices(accounts.primary)
+    if market_enabled():
+        scan_market(accounts.primary)
+    history = HistoryStore.from_config(Config.base_config.get("history"))
+    if history:
+        history.start()
+    scheduler = BackgroundScheduler()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    coordinator = Coordinator(run_worker, count, restart_delay())
+    try:
+        coordinator.start()
+        scheduler.start()
+        scheduler.add_job(print_state, 'interval', seconds=60, id='print_state')
+        scheduler.add_job(reload_prices, 'interval', kwargs={"sonm_api": accounts.primary}, seconds=60,
+                          id='reload_config')
+        scheduler.add_job(coordinator.share_prices, 'interval', seconds=10, id='share_prices')
+        add_price_jobs(scheduler, accounts, history)
+        executor.submit(run_http_server)
+        coordinator.run()
+        print_state()
+        logger.info("Work completed")
+    except KeyboardInterrupt:
+        logger.info("Keyboard interrupt, script exiting")
+    finally:
+        logger.info("Script exiting. Sonm node will continue work")
+        coordinator.stop()
         SonmHttpServer.KEEP_RUNNING = False
         executor.shutdown(wait=False)
         scheduler.shutdown(wait=False)
+        accounts.shutdown()
+        if history:
+            history.stop()
 
 
 create_dir("out/logs", "out/orders", "out/tasks")
-setup_logging()
+# Worker processes import this module too, they set up logging with their own files in run_worker
+if multiprocessing.current_process().name == "MainProcess":
+    setup_logging()
 logging.getLogger('apscheduler').setLevel(logging.FATAL)
 logger = logging.getLogger('monitor')
 
@@ -0,0 +1,46 @@
+import hashlib
+from bisect import bisect
+
+
+def ring_hash(key):
+    return int(hashlib.sha1(key.encode()).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    # Consistent hash of node tags to accounts: adding or removing an account moves only the nodes
+    # that hash next to its points, the rest keep their account
+    def __init__(self, keys, replicas=100):
+        points = sorted((ring_hash("{}#{}".format(key, num)), key) for key in keys for num in range(replicas))
+        self.hashes = [hash_ for hash_, _ in points]
+        self.keys = [key for _, key in points]
+
+    def get(self, item):
+        return self.keys[bisect(self.hashes, ring_hash(item)) % len(self.keys)]
+
+
+class Accounts(object):
+    # Sonm api instances, one per ethereum account, with node tags sharded across them
+    def __init__(self, apis):
+        if not apis:
+            raise Exception("At least one account is required")
+        self.apis = apis
+        self.by_account = {sonm_api.account: sonm_api for sonm_api in apis}
+        if len(self.by_account) != len(apis):
+            raise Exception("Accounts must have different keys")
+        self.ring = HashRing(self.by_account.keys())
+
+    @property
+    def primary(self):
+        # Account for requests that don't depend on account, like price prediction
+        return self.apis[0]
+
+    def for_node(self, node_tag):
+        return self.by_account[self.ring.get(node_tag)]
+
+    def get(self, account):
+        return self.by_account.get(account)
+
+    def shutdown(self):
+        # Log fetchers may be shared by accounts
+        for log_fetcher in {id(sonm_api.log_fetcher): sonm_api.log_fetcher for sonm_api in self.apis}.values():
+            log_fetcher.shutdown()
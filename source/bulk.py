@@ -0,0 +1,120 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from source.config import Config
+from source.retry import CIRCUIT_OPEN
+from source.utils import parse_price, task_tag
+from source.worknode import WorkNode, order_price
+
+
+def matches(node_tag, tag):
+    return tag is None or node_tag == tag or task_tag(node_tag) == tag
+
+
+class BulkRunner(object):
+    # Runs one operation over many items on a bounded pool, prints progress and collects failures.
+    # Requests still go through SonmApi, so transport limits and retries apply.
+    def __init__(self, workers=16, progress_interval=1, out=sys.stdout):
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.out = out
+        self.lock = threading.Lock()
+
+    def run(self, title, items, fn):
+        items = list(items)
+        results = {}
+        failures = []
+        if not items:
+            self.print("{}: nothing to do".format(title))
+            return results, failures
+        started = time.time()
+        reported = started
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bulk") as executor:
+            futures = {executor.submit(fn, item): item for item in items}
+            for done, future in enumerate(as_completed(futures), 1):
+                item = futures[future]
+                try:
+                    result = future.result()
+                    if result is CIRCUIT_OPEN:
+                        failures.append((item, "circuit breaker is open"))
+                    elif result is None:
+                        failures.append((item, "request failed"))
+                    else:
+                        results[item] = result
+                except Exception as e:
+                    failures.append((item, str(e)))
+                if time.time() - reported >= self.progress_interval or done == len(items):
+                    reported = time.time()
+                    self.print("{}: {}/{} done, {} failed".format(title, done, len(items), len(failures)))
+        self.print("{}: {} succeeded, {} failed in {:.1f} sec"
+                   .format(title, len(results), len(failures), time.time() - started))
+        for item, error in sorted(failures):
+            self.print("  [ERR] {}: {}".format(item, error))
+        return results, failures
+
+    def print(self, line):
+        with self.lock:
+            print(line, file=self.out)
+            self.out.flush()
+
+
+def blacklist_list(sonm_api):
+    return sonm_api.blacklist_list()
+
+
+def blacklist_remove(runner, sonm_api, addresses):
+    return runner.run("Remove from blacklist", addresses, sonm_api.blacklist_remove)
+
+
+def orders_by_tag(sonm_api, tag):
+    orders_ = sonm_api.order_list(Config.fleet_size or 1000)["orders"]
+    if orders_ is None:
+        raise Exception("Cannot retrieve orders list")
+    return [order_ for order_ in orders_ if matches(order_["tag"], tag)]
+
+
+def cancel_orders(runner, sonm_api, tag=None, orders_=None):
+    orders_ = orders_by_tag(sonm_api, tag) if orders_ is None else orders_
+    return runner.run("Cancel orders", [order_["id"] for order_ in orders_], sonm_api.order_cancel)
+
+
+def deals_by_tag(runner, sonm_api, tag):
+    deals_ = sonm_api.deal_list(Config.fleet_size or 1000)
+    if deals_ is None:
+        raise Exception("Cannot retrieve deals list")
+    if tag is None:
+        return [deal["id"] for deal in deals_]
+    # Deal doesn't carry node tag, it's taken from the order deal was opened for
+    bids = {deal["bid_id"]: deal["id"] for deal in deals_}
+    orders_, _ = runner.run("Resolve deal tags", bids.keys(), sonm_api.order_status)
+    return [bids[bid_id] for bid_id, order_ in orders_.items() if matches(order_["tag"], tag)]
+
+
+def close_deals(runner, sonm_api, tag=None, blacklist=False):
+    return runner.run("Close deals", deals_by_tag(runner, sonm_api, tag),
+                      lambda deal_id: sonm_api.deal_close(deal_id, blacklist))
+
+
+def target_price(tag):
+    configs = [config for node_tag, config in Config.node_configs.items() if task_tag(node_tag) == tag]
+    if not configs:
+        return None
+    price_, _, _ = order_price(configs[0], tag)
+    return parse_price(WorkNode.format_price(price_))
+
+
+def stale_orders(sonm_api, tag=None):
+    # Orders placed at a price different from the one bot would place now
+    stale = []
+    for order_ in orders_by_tag(sonm_api, tag):
+        price_ = target_price(task_tag(order_["tag"]))
+        if price_ is not None and int(order_["price"]) != price_:
+            stale.append(order_)
+    return stale
+
+
+def reprice(runner, sonm_api, tag=None):
+    # Running bot replaces cancelled order with a new one at current price
+    return cancel_orders(runner, sonm_api, tag, stale_orders(sonm_api, tag))
@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    # Size-bounded LRU cache whose entries expire ttl seconds after they were stored
+    def __init__(self, ttl=5, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(ttl=float(config.get("ttl", 5)), max_size=int(config.get("size", 10000)))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.ttl <= 0 or value is None:
+            return
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, endpoint, id_):
+        # Drop every entry of endpoint whose key starts with id_
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == endpoint and key[1] == id_]:
+                del self.entries[key]
+                self.stats["invalidations"] += 1
+
+    def metrics(self):
+        with self.lock:
+            return dict(size=len(self.entries), **self.stats)
@@ -0,0 +1,221 @@
+import _thread
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from source.config import Config
+from source.market import MarketScanner
+from source.utils import Nodes, task_tag
+from source.worknode import WorkNode, State
+
+logger = logging.getLogger("monitor")
+
+STATE_FIELDS = ["status", "bid_id", "deal_id", "task_id", "price", "task_uptime", "supplier_id", "RUNNING"]
+
+
+def node_state(node):
+    state = {field: getattr(node, field) for field in STATE_FIELDS}
+    state["status"] = node.status.name
+    state["last_heartbeat"] = node.last_heartbeat
+    state["account"] = node.sonm_api.account
+    return state
+
+
+def prices_message():
+    return "prices", Config.prices, MarketScanner.prices, MarketScanner.updated
+
+
+class AccountView(object):
+    def __init__(self, account):
+        self.account = account
+
+
+class NodeView(object):
+    # Coordinator copy of a node run by worker process, with the fields dashboard, api and metrics read
+    as_dict = WorkNode.as_dict
+    as_table_item = WorkNode.as_table_item
+
+    def __init__(self, node_tag, worker, state):
+        self.node_tag = node_tag
+        self.tag = task_tag(node_tag)
+        self.worker = worker
+        for field in STATE_FIELDS:
+            setattr(self, field, state[field])
+        self.status = State[state["status"]]
+        self.last_heartbeat = state["last_heartbeat"]
+        self.sonm_api = AccountView(state["account"])
+
+    @property
+    def is_running(self):
+        return self.RUNNING
+
+    def update(self, worker, state):
+        self.worker = worker
+        self.last_heartbeat = state["last_heartbeat"]
+        self.sonm_api = AccountView(state["account"])
+        for field in STATE_FIELDS:
+            old, new = getattr(self, field), State[state[field]] if field == "status" else state[field]
+            if old != new:
+                setattr(self, field, new)
+                Nodes.node_changed(self, field, old, new)
+
+
+class Worker(object):
+    # Worker process side: runs nodes of its partition, sends their states to coordinator in batches
+    # and takes prices from coordinator instead of requesting them itself. Running flag isn't a node event,
+    # it reaches coordinator with the next heartbeat.
+    def __init__(self, index, inbox, outbox, report_interval=1, heartbeat_interval=10):
+        self.index = index
+        self.inbox = inbox
+        self.outbox = outbox
+        self.report_interval = report_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.changed = set()
+        self.removed = set()
+        self.lock = threading.Lock()
+        self.running = False
+        Nodes.add_listener(self.node_changed)
+
+    def node_changed(self, node, field, old, new):
+        with self.lock:
+            if field == "node" and not new:
+                self.changed.discard(old)
+                self.removed.add(old)
+            else:
+                self.changed.add(node.node_tag)
+
+    def wait_prices(self):
+        self.apply(self.inbox.get())
+
+    def apply(self, message):
+        if message[0] == "prices":
+            _, prices, market_prices, market_updated = message
+            Config.set_prices(prices)
+            with MarketScanner.lock:
+                MarketScanner.prices = market_prices
+                MarketScanner.updated = market_updated
+        elif message[0] == "stop" and self.running:
+            logger.info("Worker {} stopped by coordinator".format(self.index))
+            _thread.interrupt_main()
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.report_loop, name="worker-report", daemon=True).start()
+        threading.Thread(target=self.inbox_loop, name="worker-inbox", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.report(list(Nodes.get_nodes_keys()))
+
+    def inbox_loop(self):
+        while self.running:
+            try:
+                self.apply(self.inbox.get(timeout=1))
+            except queue.Empty:
+                pass
+
+    def report_loop(self):
+        # Changed nodes are sent every report_interval, all nodes every heartbeat_interval to refresh heartbeats
+        reported = 0
+        while self.running:
+            time.sleep(self.report_interval)
+            if time.time() - reported > self.heartbeat_interval:
+                reported = time.time()
+                self.report(Nodes.get_nodes_keys())
+            else:
+                self.report()
+
+    def report(self, node_tags=()):
+        with self.lock:
+            changed, removed = self.changed.union(node_tags), self.removed
+            self.changed, self.removed = set(), set()
+        states = {}
+        for node_tag in changed:
+            if Nodes.has_node(node_tag):
+                states[node_tag] = node_state(Nodes.get_node(node_tag))
+        if states or removed:
+            self.outbox.put(("nodes", self.index, states, list(removed)))
+
+
+class Coordinator(object):
+    # Runs workers as separate processes, each with its own share of node configs, and keeps node views
+    # of all of them for dashboard and metrics. Worker that failed is restarted after restart_delay.
+    def __init__(self, target, count, restart_delay=10):
+        self.target = target
+        self.count = count
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context("spawn")
+        self.outbox = self.context.Queue()
+        self.inboxes = [self.context.Queue() for _ in range(count)]
+        self.processes = [None] * count
+        self.restarts = {}
+        self.prices_key = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for index in range(self.count):
+            self.start_worker(index)
+        logger.info("Started {} worker processes".format(self.count))
+
+    def start_worker(self, index):
+        self.inboxes[index].put(prices_message())
+        process = self.context.Process(target=self.target, args=(index, self.count, self.inboxes[index], self.outbox),
+                                       name="worker-{}".format(index))
+        process.start()
+        self.processes[index] = process
+
+    def share_prices(self):
+        # Sent only when prices or market snapshot were refreshed since last time
+        key = (Config.prices_version, MarketScanner.updated)
+        if key == self.prices_key:
+            return
+        self.prices_key = key
+        message = prices_message()
+        for inbox in self.inboxes:
+            inbox.put(message)
+
+    def run(self):
+        while self.running and any(process.exitcode != 0 for process in self.processes):
+            try:
+                self.apply(self.outbox.get(timeout=1))
+            except queue.Empty:
+                pass
+            self.check_workers()
+
+    def apply(self, message):
+        _, index, states, removed = message
+        for node_tag, state in states.items():
+            if Nodes.has_node(node_tag):
+                Nodes.get_node(node_tag).update(index, state)
+            else:
+                Nodes.add_node(NodeView(node_tag, index, state))
+        for node_tag in removed:
+            if Nodes.has_node(node_tag) and Nodes.get_node(node_tag).worker == index:
+                Nodes.remove_node(node_tag)
+
+    def check_workers(self):
+        now = time.time()
+        for index, process in enumerate(self.processes):
+            if process.exitcode is None or process.exitcode == 0:
+                continue
+            if index not in self.restarts:
+                logger.error("Worker {} exited with code {}, restarting in {} sec"
+                             .format(index, process.exitcode, self.restart_delay))
+                self.restarts[index] = now + self.restart_delay
+            elif now >= self.restarts[index]:
+                del self.restarts[index]
+                self.start_worker(index)
+
+    def stop(self, timeout=30):
+        self.running = False
+        for inbox in self.inboxes:
+            inbox.put(("stop",))
+        deadline = time.time() + timeout
+        for process in self.processes:
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                logger.error("Worker {} didn't stop in {} sec, terminating".format(process.name, timeout))
+                process.terminate()
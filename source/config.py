@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 from os.path import join
@@ -5,6 +6,7 @@ from os.path import join
 from pathlib2 import Path
 from ruamel.yaml import YAML
 
+from source.accounts import HashRing
 from source.utils import logger, validate_eth_addr, template_bid
 
 
@@ -16,6 +18,20 @@ class Config(object):
     bids = {}
     prices = {}
     balance = {}
+    balances = {}
+    # Bumped on every assignment of prices or balance, readers use them to tell a new value from the cached one
+    prices_version = 0
+    balance_version = 0
+
+    files = {}
+    tasks = {}
+    node_diff = {"added": [], "removed": [], "changed": []}
+    listeners = []
+    # (index, count) of worker process, it runs only nodes whose tags hash to it
+    partition = None
+    partition_ring = None
+    # Nodes of all partitions, orders and deals of an account are listed for the whole fleet
+    fleet_size = 0
 
     @staticmethod
     def price_for_tag(tag):
@@ -24,6 +40,17 @@ class Config(object):
         else:
             return None
 
+    @staticmethod
+    def set_prices(prices):
+        Config.prices = prices
+        Config.prices_version += 1
+
+    @staticmethod
+    def set_balance(balance, balances):
+        Config.balance = balance
+        Config.balances = balances
+        Config.balance_version += 1
+
     @staticmethod
     def formatted_price_for_tag(tag):
         if tag in Config.prices.keys() and Config.prices[tag] and "perHourUSD" in Config.prices[tag]:
@@ -41,11 +68,6 @@ class Config(object):
                     continue
                 Config.bids[tag] = bids_[tag]
 
-    @staticmethod
-    def load_prices(sonm_api):
-        for tag, bid in Config.bids.items():
-            Config.prices[tag] = sonm_api.predict_bid(bid["resources"])
-
     @staticmethod
     def get_node_config(node_tag):
         return Config.node_configs.get(node_tag)
@@ -59,30 +81,72 @@ class Config(object):
     def load_task_configs():
         temp_node_configs = {}
         temp_bids = {}
+        temp_tasks = {}
         logger.debug("Try to parse configs:")
         if not Config.base_config["tasks"]:
             raise Exception("Configuration must have at least one task")
         else:
-            loaded_tasks = [Config.load_cfg(task) for task in Config.base_config["tasks"]]
-            tags = [task["tag"] for task in loaded_tasks if "tag" in task]
+            loaded_tasks = [(task, Config.load_cfg(task)) for task in Config.base_config["tasks"]]
+            tags = [task["tag"] for _, task in loaded_tasks if "tag" in task]
             if len(tags) != len(set(tags)):
                 raise Exception("Config has tasks with same tag")
 
-        for task_config in loaded_tasks:
+        for task_file, task_config in loaded_tasks:
+            # Unchanged task file returns the very same object, reuse its processed configs
+            cached = Config.tasks.get(task_file)
+            if cached and cached["config"] is task_config:
+                temp_tasks[task_file] = cached
+                temp_bids[task_config["tag"]] = cached["bid"]
+                temp_node_configs.update(cached["nodes"])
+                continue
             Config.validate_config_keys(["numberofnodes", "tag", "price_coefficient", "max_price", "ets",
                                          "task_start_timeout", "template_file", "duration", "counterparty",
                                          "identity", "ramsize", "storagesize", "cpucores", "sysbenchsingle",
                                          "sysbenchmulti", "netdownload", "netupload", "overlay", "incoming",
                                          "gpucount", "gpumem", "ethhashrate"], task_config)
-            temp_bids[task_config["tag"]] = template_bid(task_config)
+            bid = template_bid(task_config)
+            nodes = {}
+            task_config["counterparty"] = validate_eth_addr(task_config["counterparty"])
             for num in range(1, task_config["numberofnodes"] + 1):
-                task_config["counterparty"] = validate_eth_addr(task_config["counterparty"])
                 ntag = "{}_{}".format(task_config["tag"], num)
-                temp_node_configs[ntag] = task_config
+                nodes[ntag] = task_config
                 logger.debug("Config for node {} was created successfully".format(ntag))
-                logger.debug("Config: {}".format(json.dumps(task_config, sort_keys=True, indent=4)))
+            logger.debug("Config: {}".format(json.dumps(task_config, sort_keys=True, indent=4)))
+            temp_tasks[task_file] = {"config": task_config, "bid": bid, "nodes": nodes}
+            temp_bids[task_config["tag"]] = bid
+            temp_node_configs.update(nodes)
+        Config.fleet_size = len(temp_node_configs)
+        if Config.partition:
+            temp_node_configs = {tag: config for tag, config in temp_node_configs.items() if Config.in_partition(tag)}
+        Config.node_diff = Config.diff_node_configs(Config.node_configs, temp_node_configs)
+        if any(Config.node_diff.values()):
+            logger.info("Node configs changed: {} added, {} removed, {} changed"
+                        .format(*[len(Config.node_diff[key]) for key in ["added", "removed", "changed"]]))
+        Config.tasks = temp_tasks
         Config.node_configs = temp_node_configs
         Config.load_bid_configs(temp_bids)
+        if any(Config.node_diff.values()):
+            for listener in Config.listeners:
+                listener(Config.node_diff)
+
+    @staticmethod
+    def set_partition(index, count):
+        Config.partition = (index, count)
+        Config.partition_ring = HashRing([str(num) for num in range(count)])
+
+    @staticmethod
+    def in_partition(node_tag):
+        return Config.partition_ring.get(node_tag) == str(Config.partition[0])
+
+    @staticmethod
+    def add_listener(listener):
+        Config.listeners.append(listener)
+
+    @staticmethod
+    def diff_node_configs(old, new):
+        return {"added": [tag for tag in new if tag not in old],
+                "removed": [tag for tag in old if tag not in new],
+                "changed": [tag for tag in new if tag in old and new[tag] is not old[tag] and new[tag] != old[tag]]}
 
     @staticmethod
     def load_base_config():
@@ -98,20 +162,24 @@ class Config(object):
         if len(missed_keys) > 0:
             raise Exception("Missed keys: '{}'".format("', '".join(missed_keys)))
 
-    @staticmethod
-    def reload_node_config(node_tag):
-        Config.base_config = Config.load_cfg()
-        for task in Config.base_config["tasks"]:
-            task_config = Config.load_cfg(task)
-            if node_tag.startswith(task_config["tag"] + "_"):
-                Config.node_configs[node_tag] = task_config
-
     @staticmethod
     def load_cfg(filename='config.yaml', folder=config_folder):
+        # Parsed files are cached by mtime and content hash, an unchanged file returns the cached object
         path = join(folder, filename)
         if os.path.exists(path):
-            p = Path(path)
+            stat = os.stat(path)
+            cached = Config.files.get(path)
+            if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                return cached["data"]
+            content = Path(path).read_bytes()
+            hash_ = hashlib.sha1(content).hexdigest()
+            if cached and cached["hash"] == hash_:
+                cached["mtime"], cached["size"] = stat.st_mtime_ns, stat.st_size
+                return cached["data"]
+            logger.debug("Parsing {}".format(path))
             yaml_ = YAML(typ='safe')
-            return yaml_.load(p)
+            data = yaml_.load(content)
+            Config.files[path] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": hash_, "data": data}
+            return data
         else:
             raise Exception("File {} not found".format(filename))
@@ -0,0 +1,266 @@
+import base64
+import gzip
+import heapq
+import random
+import threading
+import time
+import uuid
+
+from source.logfetcher import LogFetcher
+from source.market import AskIndex, requirements
+from source.utils import TaskStatus
+
+ORDER_BID = 1
+ORDER_ASK = 2
+ORDER_ACTIVE = 2
+ORDER_INACTIVE = 1
+DEAL_ACCEPTED = 1
+DEAL_CLOSED = 2
+
+
+def usd_per_hour(per_second):
+    return int(per_second) / 1e18 * 3600
+
+
+def per_second(usd_per_hour_):
+    return str(int(usd_per_hour_ * 1e18 / 3600))
+
+
+class Service(object):
+    def __init__(self, **methods):
+        self.__dict__.update(methods)
+
+
+class FakeNode(object):
+    # In-process stand-in for sonm node with the same interface as sonm_pynode Node. Orders are matched
+    # after a random delay if there is an ask they can take, tasks run until deal is closed or they break.
+    # Every request sleeps for latency and fails with error_rate probability.
+    def __init__(self, latency=0.05, error_rate=0, deal_delay=(5, 30), deal_probability=1, price_floor=0.9,
+                 predicted_price=0.01, task_failure_rate=0, task_duration=0, asks=1000, seed=None, account=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.deal_delay = deal_delay
+        self.deal_probability = deal_probability
+        self.price_floor = price_floor
+        self.predicted_price = predicted_price
+        self.task_failure_rate = task_failure_rate
+        self.task_duration = task_duration
+        self.random = random.Random(seed)
+        self.eth_addr = "0x{:040x}".format(account + 1)
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.deals = {}
+        self.pending = []
+        self.asks = [self.random_ask(num) for num in range(asks)]
+        self.ask_index = AskIndex([{"price": usd_per_hour(ask["price"]), "author": ask["authorID"],
+                                    "netflags": ask["netflags"]["flags"],
+                                    "benchmarks": tuple(int(value) for value in ask["benchmarks"]["values"])}
+                                   for ask in self.asks])
+        self.calls = 0
+        self.calls_by_endpoint = {}
+        self.token = Service(balance=self.wrap("token.balance", self.token_balance))
+        self.predictor = Service(predict=self.wrap("predictor.predict", self.predict))
+        self.order = Service(create=self.wrap("order.create", self.order_create),
+                             list=self.wrap("order.list", self.order_list),
+                             status=self.wrap("order.status", self.order_status),
+                             cancel=self.wrap("order.cancel", self.order_cancel))
+        self.deal = Service(list=self.wrap("deal.list", self.deal_list),
+                            status=self.wrap("deal.status", self.deal_status),
+                            close=self.wrap("deal.close", self.deal_close))
+        self.task = Service(start=self.wrap("task.start", self.task_start),
+                            status=self.wrap("task.status", self.task_status))
+
+    @classmethod
+    def from_config(cls, config, account=0):
+        config = config or {}
+        return cls(latency=float(config.get("latency", 0.05)),
+                   error_rate=float(config.get("error_rate", 0)),
+                   deal_delay=tuple(config.get("deal_delay", (5, 30))),
+                   deal_probability=float(config.get("deal_probability", 1)),
+                   price_floor=float(config.get("price_floor", 0.9)),
+                   predicted_price=float(config.get("predicted_price", 0.01)),
+                   task_failure_rate=float(config.get("task_failure_rate", 0)),
+                   task_duration=int(config.get("task_duration", 0)),
+                   asks=int(config.get("asks", 1000)),
+                   seed=config.get("seed"),
+                   account=account)
+
+    def share_market(self, node):
+        # Market is the same whichever sonm node is asked, so fake nodes of several accounts use the same asks
+        self.asks = node.asks
+        self.ask_index = node.ask_index
+
+    def wrap(self, endpoint, fn):
+        def call(*args, timeout=None):
+            time.sleep(self.random.uniform(0.5, 1.5) * self.latency)
+            with self.lock:
+                self.calls += 1
+                self.calls_by_endpoint[endpoint] = self.calls_by_endpoint.get(endpoint, 0) + 1
+                if self.random.random() < self.error_rate:
+                    return {"status_code": 500, "error": "fake node error"}
+                self.match(time.time())
+                result = fn(*args)
+            if "error" in result:
+                result["status_code"] = 400
+            else:
+                result["status_code"] = 200
+            return result
+
+        return call
+
+    def match(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            _, order_id = heapq.heappop(self.pending)
+            order_ = self.orders[order_id]
+            if order_["orderStatus"] != ORDER_ACTIVE:
+                continue
+            deal_id = str(len(self.deals) + 1)
+            self.deals[deal_id] = {"id": deal_id, "bidID": order_id, "price": order_["price"],
+                                   "supplierID": "0x{:040x}".format(self.random.getrandbits(160)),
+                                   "status": DEAL_ACCEPTED, "tasks": {}}
+            order_["orderStatus"] = ORDER_INACTIVE
+            order_["dealID"] = deal_id
+
+    def random_ask(self, num):
+        gpu_count = self.random.choice([0, 0, 1, 2, 4, 8])
+        gb, mbit = 1024 ** 3, 1024 ** 2
+        benchmarks = [self.random.randint(500, 20000),
+                      self.random.randint(200, 2000),
+                      self.random.choice([1, 2, 4, 8, 16, 32]),
+                      self.random.choice([1, 2, 4, 8, 16, 64]) * gb,
+                      self.random.randint(10, 1000) * gb,
+                      self.random.randint(10, 1000) * mbit,
+                      self.random.randint(10, 1000) * mbit,
+                      gpu_count,
+                      gpu_count and self.random.choice([2, 4, 8, 11]) * gb,
+                      gpu_count and self.random.randint(20, 200) * 1000000,
+                      0,
+                      0]
+        return {"id": "ask-{}".format(num), "orderType": ORDER_ASK, "orderStatus": ORDER_ACTIVE,
+                "authorID": "0x{:040x}".format(self.random.getrandbits(160)),
+                "price": per_second(self.predicted_price * self.random.uniform(0.5, 1.5)),
+                "netflags": {"flags": self.random.choice([2, 3, 7])},
+                "benchmarks": {"values": [str(value) for value in benchmarks]}}
+
+    def token_balance(self):
+        return {"liveBalance": 1000.0, "sideBalance": 1000.0, "liveEthBalance": 1.0}
+
+    def predict(self, bid_):
+        return {"perSecond": per_second(self.predicted_price * self.random.uniform(0.95, 1.05))}
+
+    def order_create(self, order_):
+        order_id = str(uuid.uuid4())
+        price_ = order_["price"]["perSecond"]
+        self.orders[order_id] = {"id": order_id, "tag": base64.b64encode(order_["tag"].encode()).decode(),
+                                 "price": price_, "orderStatus": ORDER_ACTIVE, "dealID": "0"}
+        if self.matchable(order_) and self.random.random() < self.deal_probability:
+            heapq.heappush(self.pending, (time.time() + self.random.uniform(*self.deal_delay), order_id))
+        return {"id": order_id}
+
+    def matchable(self, order_):
+        # Order needs an ask it satisfies when market has asks, otherwise a price close to prediction
+        price_ = usd_per_hour(order_["price"]["perSecond"])
+        if not self.asks:
+            return price_ >= self.predicted_price * self.price_floor
+        benchmarks, netflags = requirements(order_.get("resources", {}))
+        asks = self.ask_index.cheapest(benchmarks, netflags, order_.get("counterparty"))
+        return bool(asks) and asks[0]["price"] <= price_
+
+    def order_list(self, eth_addr, limit):
+        # Own active bids, and asks as well when author isn't set
+        orders_ = [{"id": order_["id"], "orderType": ORDER_BID, "orderStatus": ORDER_ACTIVE, "tag": order_["tag"],
+                    "price": order_["price"]}
+                   for order_ in self.orders.values() if order_["orderStatus"] == ORDER_ACTIVE]
+        if not eth_addr:
+            orders_ = self.asks + orders_
+        return {"orders": [{"order": order_} for order_ in orders_[:limit]]}
+
+    def order_status(self, order_id):
+        if order_id not in self.orders:
+            return {"error": "order not found"}
+        order_ = self.orders[order_id]
+        return {"orderStatus": order_["orderStatus"], "tag": order_["tag"], "dealID": order_["dealID"]}
+
+    def order_cancel(self, order_ids):
+        for order_id in order_ids:
+            if order_id not in self.orders or self.orders[order_id]["orderStatus"] != ORDER_ACTIVE:
+                return {"error": "order {} is not active".format(order_id)}
+        for order_id in order_ids:
+            self.orders[order_id]["orderStatus"] = ORDER_INACTIVE
+        return {}
+
+    def deal_list(self, filters):
+        deals_ = [deal for deal in self.deals.values() if deal["status"] == DEAL_ACCEPTED][:filters["limit"]]
+        return {"deals": [{"deal": self.deal_fields(deal)} for deal in deals_]}
+
+    @staticmethod
+    def deal_fields(deal):
+        return {key: deal[key] for key in ["id", "bidID", "price", "supplierID", "status"]}
+
+    def deal_status(self, deal_id):
+        if deal_id not in self.deals:
+            return {"error": "deal not found"}
+        deal = self.deals[deal_id]
+        result = {"deal": self.deal_fields(deal)}
+        if deal["status"] == DEAL_ACCEPTED:
+            result["resources"] = {}
+            running = {task_id: {} for task_id, task in deal["tasks"].items()
+                       if self.task_state(task) == TaskStatus.running}
+            if running:
+                result["running"] = running
+        return result
+
+    def deal_close(self, deal_id, blacklist):
+        if deal_id not in self.deals or self.deals[deal_id]["status"] != DEAL_ACCEPTED:
+            return {"error": "deal {} is not active".format(deal_id)}
+        self.deals[deal_id]["status"] = DEAL_CLOSED
+        return {}
+
+    def task_start(self, deal_id, task):
+        if deal_id not in self.deals or self.deals[deal_id]["status"] != DEAL_ACCEPTED:
+            return {"error": "deal {} is not active".format(deal_id)}
+        task_id = str(uuid.uuid4())
+        now = time.time()
+        broken = None
+        if self.random.random() < self.task_failure_rate:
+            broken = now + self.random.uniform(10, 600)
+        self.deals[deal_id]["tasks"][task_id] = {"started": now, "broken": broken}
+        return {"id": task_id}
+
+    def task_state(self, task):
+        now = time.time()
+        if task["broken"] and now >= task["broken"]:
+            return TaskStatus.broken
+        if self.task_duration and now - task["started"] >= self.task_duration:
+            return TaskStatus.finished
+        return TaskStatus.running
+
+    def task_status(self, deal_id, task_id):
+        deal = self.deals.get(deal_id)
+        if not deal or task_id not in deal["tasks"] or deal["status"] != DEAL_ACCEPTED:
+            return {"error": "task {} not found".format(task_id)}
+        task = deal["tasks"][task_id]
+        uptime = int((time.time() - task["started"]) * 1e9)
+        return {"status": self.task_state(task).value, "uptime": str(uptime)}
+
+    def task_logs(self, deal_id, task_id):
+        with self.lock:
+            task = self.deals.get(deal_id, {}).get("tasks", {}).get(task_id)
+        if not task:
+            return []
+        return ["{:.0f} fake task {} log line {}\n".format(task["started"] + num, task_id, num).encode()
+                for num in range(10)]
+
+
+class FakeLogFetcher(LogFetcher):
+    # Writes task logs served by FakeNode instead of running sonmcli
+    def __init__(self, node, **kwargs):
+        super().__init__(**kwargs)
+        self.node = node
+
+    def stream(self, deal_id, task_id, filename):
+        path = filename + ".gz"
+        with gzip.open(path, "wb") as outfile:
+            for line in self.node.task_logs(deal_id, task_id):
+                outfile.write(line)
+        return path
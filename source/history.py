@@ -0,0 +1,135 @@
+import logging
+import sqlite3
+import time
+
+from source.sqlitewriter import SQLiteWriter
+from source.utils import parse_readable_price
+
+logger = logging.getLogger("monitor")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS orders (order_id TEXT PRIMARY KEY, node TEXT, tag TEXT, price REAL, "
+    "created REAL, dealt REAL, deal_id TEXT, closed REAL)",
+    "CREATE TABLE IF NOT EXISTS deals (deal_id TEXT PRIMARY KEY, node TEXT, tag TEXT, order_id TEXT, "
+    "supplier_id TEXT, price REAL, opened REAL, closed REAL, close_reason TEXT)",
+    "CREATE TABLE IF NOT EXISTS tasks (task_id TEXT, deal_id TEXT, node TEXT, tag TEXT, started REAL, "
+    "ended REAL, uptime INTEGER, result TEXT, PRIMARY KEY (deal_id, task_id))",
+    "CREATE TABLE IF NOT EXISTS events (ts REAL, node TEXT, tag TEXT, kind TEXT, detail TEXT)",
+    "CREATE TABLE IF NOT EXISTS prices (ts REAL, tag TEXT, price REAL)",
+    "CREATE INDEX IF NOT EXISTS orders_tag ON orders (tag, created)",
+    "CREATE INDEX IF NOT EXISTS deals_tag ON deals (tag, opened)",
+    "CREATE INDEX IF NOT EXISTS deals_supplier ON deals (supplier_id, opened)",
+    "CREATE INDEX IF NOT EXISTS tasks_tag ON tasks (tag, started)",
+    "CREATE INDEX IF NOT EXISTS events_tag ON events (tag, kind, ts)",
+    "CREATE INDEX IF NOT EXISTS prices_tag ON prices (tag, ts)",
+]
+
+FAILED_STATES = ["TASK_FAILED", "TASK_FAILED_TO_START", "TASK_BROKEN"]
+
+
+class HistoryStore(object):
+    # Long-term SQLite history of orders, deals, tasks, failures and prices, fed by node change
+    # listener and written by a single background thread
+    def __init__(self, path="out/history.db"):
+        self.path = path
+        self.writer = SQLiteWriter(path, "history")
+        with self.connect() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        if not config.get("enabled", True):
+            return None
+        return cls(path=config.get("path", "out/history.db"))
+
+    def connect(self):
+        return self.writer.connect()
+
+    def start(self):
+        self.writer.start()
+
+    def stop(self):
+        self.writer.stop()
+
+    def execute(self, statement, params):
+        self.writer.execute(statement, params)
+
+    def record_prices(self, prices):
+        now = time.time()
+        for tag, price in prices.items():
+            if price and "perHourUSD" in price:
+                self.execute("INSERT INTO prices (ts, tag, price) VALUES (?, ?, ?)", (now, tag, price["perHourUSD"]))
+
+    def node_changed(self, node, field, old, new):
+        now = time.time()
+        if field == "bid_id" and new:
+            self.execute("INSERT OR REPLACE INTO orders (order_id, node, tag, price, created) VALUES (?, ?, ?, ?, ?)",
+                         (new, node.node_tag, node.tag, parse_readable_price(node.price), now))
+        elif field == "bid_id" and old and not node.deal_id:
+            self.execute("UPDATE orders SET closed = ? WHERE order_id = ? AND closed IS NULL", (now, old))
+        elif field == "deal_id" and new:
+            self.execute("UPDATE orders SET dealt = ?, deal_id = ? WHERE order_id = ?", (now, new, node.bid_id))
+            self.execute("INSERT OR IGNORE INTO deals (deal_id, node, tag, order_id, supplier_id, price, opened) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (new, node.node_tag, node.tag, node.bid_id, node.supplier_id, parse_readable_price(node.price),
+                          now))
+        elif field == "deal_id" and old:
+            self.execute("UPDATE deals SET closed = ?, close_reason = ? WHERE deal_id = ? AND closed IS NULL",
+                         (now, node.status.name, old))
+        elif field == "blacklisted":
+            self.execute("INSERT INTO events (ts, node, tag, kind, detail) VALUES (?, ?, ?, ?, ?)",
+                         (now, node.node_tag, node.tag, "blacklist", new))
+        elif field == "supplier_id" and new and node.deal_id:
+            self.execute("UPDATE deals SET supplier_id = ? WHERE deal_id = ?", (new, node.deal_id))
+        elif field == "task_id" and new:
+            self.execute("INSERT OR IGNORE INTO tasks (task_id, deal_id, node, tag, started, uptime) "
+                         "VALUES (?, ?, ?, ?, ?, 0)", (new, node.deal_id, node.node_tag, node.tag, now))
+        elif field == "task_uptime" and new and node.task_id:
+            self.execute("UPDATE tasks SET uptime = ? WHERE deal_id = ? AND task_id = ?",
+                         (int(new), node.deal_id, node.task_id))
+        elif field == "status" and new.name in FAILED_STATES + ["TASK_FINISHED"]:
+            if node.task_id:
+                self.execute("UPDATE tasks SET ended = ?, result = ? WHERE deal_id = ? AND task_id = ?",
+                             (now, new.name, node.deal_id, node.task_id))
+            if new.name in FAILED_STATES:
+                self.execute("INSERT INTO events (ts, node, tag, kind, detail) VALUES (?, ?, ?, ?, ?)",
+                             (now, node.node_tag, node.tag, "failure", "{} deal {} worker {}"
+                              .format(new.name, node.deal_id, node.supplier_id)))
+
+
+QUERIES = {
+    "cost": ("Spend per tag per day, USD (deal price by hours open, attributed to opening day)",
+             "SELECT tag, date(opened, 'unixepoch') AS day, COUNT(*) AS deals, "
+             "ROUND(SUM(price * ((COALESCE(closed, strftime('%s', 'now')) - opened) / 3600.0)), 4) AS cost_usd "
+             "FROM deals WHERE opened >= ? AND price IS NOT NULL GROUP BY tag, day ORDER BY day, tag"),
+    "time-to-deal": ("Time from order to deal per tag, sec",
+                     "SELECT tag, COUNT(*) AS deals, ROUND(AVG(dealt - created)) AS mean_sec, "
+                     "ROUND(MIN(dealt - created)) AS min_sec, ROUND(MAX(dealt - created)) AS max_sec "
+                     "FROM orders WHERE created >= ? AND dealt IS NOT NULL GROUP BY tag ORDER BY tag"),
+    "failures": ("Failure rate per worker address",
+                 "SELECT supplier_id AS worker, COUNT(*) AS deals, "
+                 "SUM(close_reason IN ('TASK_FAILED', 'TASK_FAILED_TO_START', 'TASK_BROKEN')) AS failed, "
+                 "ROUND(100.0 * SUM(close_reason IN ('TASK_FAILED', 'TASK_FAILED_TO_START', 'TASK_BROKEN')) "
+                 "/ COUNT(*), 1) AS failed_pct "
+                 "FROM deals WHERE opened >= ? AND supplier_id IS NOT NULL AND supplier_id != '' "
+                 "GROUP BY supplier_id ORDER BY failed DESC, deals DESC"),
+    "uptime": ("Task uptime per tag, sec",
+               "SELECT tag, COUNT(*) AS tasks, ROUND(AVG(uptime)) AS mean_sec, MAX(uptime) AS max_sec, "
+               "SUM(result = 'TASK_FINISHED') AS finished "
+               "FROM tasks WHERE started >= ? GROUP BY tag ORDER BY tag"),
+    "blacklist": ("Blacklisted workers",
+                  "SELECT detail AS worker, COUNT(*) AS times, datetime(MAX(ts), 'unixepoch') AS last "
+                  "FROM events WHERE ts >= ? AND kind = 'blacklist' GROUP BY detail ORDER BY times DESC"),
+    "prices": ("Predicted price per tag per day, USD/h",
+               "SELECT tag, date(ts, 'unixepoch') AS day, ROUND(MIN(price), 4) AS min, ROUND(AVG(price), 4) AS mean, "
+               "ROUND(MAX(price), 4) AS max FROM prices WHERE ts >= ? GROUP BY tag, day ORDER BY day, tag"),
+}
+
+
+def query(path, name, since):
+    title, statement = QUERIES[name]
+    with sqlite3.connect(path) as connection:
+        cursor = connection.execute(statement, (since,))
+        return title, [column[0] for column in cursor.description], cursor.fetchall()
@@ -1,18 +1,28 @@
+import hashlib
+import json
 import logging
+import queue
 import threading
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
 from flask_table import Table, Col
-from flask import Flask, render_template, request, Response
+from flask import Flask, render_template, request, Response, jsonify, stream_with_context, g
 from flask_appconfig import AppConfig
 from flask_bootstrap import Bootstrap
+from werkzeug.serving import BaseWSGIServer
 
 from source.utils import Nodes
+from source.worknode import State
 from source.config import Config
+from source.market import MarketScanner
+from source.metrics import Metrics
+from source.prices import PriceService
 
 logger = logging.getLogger("monitor")
+http_logger = logging.getLogger("monitor_http")
 
 
 class SonmHttpServer:
@@ -64,49 +74,260 @@ def create_app(configfile=None):
     AppConfig(app, configfile)
     Bootstrap(app)
 
+    @app.before_request
+    def start_timer():
+        g.request_started = time.time()
+
+    @app.after_request
+    def log_request(response):
+        elapsed = time.time() - g.get("request_started", time.time())
+        response.headers['X-Response-Time'] = "{:.1f}ms".format(elapsed * 1000)
+        http_logger.info("{} {} {} {:.1f}ms".format(request.method, request.full_path.rstrip("?"),
+                                                    response.status_code, elapsed * 1000))
+        return response
+
     @app.route('/', methods=('GET', 'POST'))
     @requires_auth
     def index():
-        nodes_content = []
-        groups = defaultdict(list)
-        for obj in Nodes.get_nodes_arr():
-            groups[obj.tag].append(obj)
+        etag, body = Dashboard.render()
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': '"{}"'.format(etag)})
+        return Response(body, headers={'ETag': '"{}"'.format(etag), 'Cache-Control': 'no-cache'})
+
+    @app.route('/metrics')
+    @requires_auth
+    def metrics():
+        return Response(Metrics.expose(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/api/nodes')
+    @requires_auth
+    def api_nodes():
+        if request.args.get('status'):
+            statuses = [State[name] for name in request.args['status'].upper().split(',') if name in State.__members__]
+            nodes = Nodes.get_nodes_by_state(*statuses)
+            if request.args.get('tag'):
+                nodes = [node for node in nodes if node.tag == request.args['tag']]
+        elif request.args.get('tag'):
+            nodes = Nodes.get_nodes_by_tag(request.args['tag'])
+        else:
+            nodes = Nodes.get_nodes_arr()
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+        return jsonify(total=len(nodes), page=page, per_page=per_page,
+                       nodes=[node.as_dict for node in nodes[(page - 1) * per_page:page * per_page]])
+
+    @app.route('/api/nodes/<node_tag>')
+    @requires_auth
+    def api_node(node_tag):
+        if not Nodes.has_node(node_tag):
+            return jsonify(error="Node {} not found".format(node_tag)), 404
+        return jsonify(Nodes.get_node(node_tag).as_dict)
 
-            nodes_content = [{
-                'node_tag': tag,
-                'predicted_price': Config.formatted_price_for_tag(tag),
-                'nodes_table': NodesTable([node.as_table_item for node in nodes],
-                                          classes=['table', 'table-striped', 'table-bordered'])
-            }
-                for tag, nodes in groups.items()]
+    @app.route('/api/prices')
+    @requires_auth
+    def api_prices():
+        history = request.args.get('history', 0, type=int)
+        prices = {}
+        for tag, price in Config.prices.items():
+            prices[tag] = {"perHourUSD": price["perHourUSD"] if price else None,
+                           "marketUSD": MarketScanner.price_for_tag(tag)}
+            if history:
+                prices[tag]["history"] = PriceService.price_history(tag)
+        return jsonify(prices)
 
-        return render_template('index.html', nodes=nodes_content, token_balance=Config.balance)
+    @app.route('/api/balance')
+    @requires_auth
+    def api_balance():
+        return jsonify(dict(Config.balance, accounts=Config.balances))
+
+    @app.route('/api/stream')
+    @requires_auth
+    def api_stream():
+        # Every stream holds a request thread while open, streams beyond the limit are turned away
+        subscriber = NodeEvents.subscribe()
+        if not subscriber:
+            return Response("Too many event streams", 503, {'Retry-After': str(NodeEvents.keepalive)})
+        return Response(stream_with_context(NodeEvents.stream(subscriber)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
     return app
 
 
+class NodeEvents(object):
+    # Fan-out of node changes to server-sent events subscribers, each subscriber has its own bounded queue
+    subscribers = set()
+    lock = threading.Lock()
+    queue_size = 1000
+    keepalive = 15
+    max_streams = 4
+
+    @staticmethod
+    def publish(node, field, old, new):
+        if field == "node":
+            event = ("node", node.as_dict) if new else ("removed", {"node": old})
+        else:
+            event = ("update", {"node": node.node_tag, field: new.name if field == "status" else new})
+        with NodeEvents.lock:
+            subscribers = list(NodeEvents.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Slow consumer, drop it and let the client reconnect
+                with NodeEvents.lock:
+                    NodeEvents.subscribers.discard(subscriber)
+
+    @staticmethod
+    def subscribe():
+        with NodeEvents.lock:
+            if len(NodeEvents.subscribers) >= NodeEvents.max_streams:
+                return None
+            subscriber = queue.Queue(maxsize=NodeEvents.queue_size)
+            NodeEvents.subscribers.add(subscriber)
+            return subscriber
+
+    @staticmethod
+    def stream(subscriber):
+        try:
+            yield "retry: 3000\n\n"
+            while SonmHttpServer.KEEP_RUNNING:
+                with NodeEvents.lock:
+                    if subscriber not in NodeEvents.subscribers:
+                        return
+                try:
+                    event, data = subscriber.get(timeout=NodeEvents.keepalive)
+                    yield "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            with NodeEvents.lock:
+                NodeEvents.subscribers.discard(subscriber)
+
+
+Nodes.add_listener(NodeEvents.publish)
+
+
+class Dashboard(object):
+    # Rendered page is reused until shown node fields, prices or balance change, or cache_ttl passes
+    # (uptime and heartbeat columns)
+    key = None
+    rendered_at = 0
+    etag = None
+    body = None
+    lock = threading.Lock()
+
+    @staticmethod
+    def cache_ttl():
+        return Config.base_config.get("http_server", {}).get("cache_ttl", 5)
+
+    @staticmethod
+    def render():
+        key = (Nodes.version, Config.prices_version, Config.balance_version)
+        with Dashboard.lock:
+            if Dashboard.key != key or time.time() - Dashboard.rendered_at > Dashboard.cache_ttl():
+                Dashboard.body = render_template('index.html', nodes=Dashboard.nodes_content(),
+                                                 token_balance=Config.balance)
+                Dashboard.etag = hashlib.sha1(Dashboard.body.encode()).hexdigest()
+                Dashboard.key = key
+                Dashboard.rendered_at = time.time()
+            return Dashboard.etag, Dashboard.body
+
+    @staticmethod
+    def nodes_content():
+        groups = defaultdict(list)
+        for obj in Nodes.get_nodes_arr():
+            groups[obj.tag].append(obj)
+        return [{
+            'node_tag': tag,
+            'predicted_price': Config.formatted_price_for_tag(tag),
+            'nodes_table': NodesTable([node.as_table_item for node in nodes],
+                                      classes=['table', 'table-striped', 'table-bordered'])
+        }
+            for tag, nodes in groups.items()]
+
+
 def run_http_server():
     if "http_server" in Config.base_config and "run" in Config.base_config["http_server"]:
-        if not Config.base_config["http_server"]["run"]:
+        http_config = Config.base_config["http_server"]
+        if not http_config["run"]:
             return
-        if not ("password" in Config.base_config["http_server"] and "user" in Config.base_config["http_server"]):
+        if not ("password" in http_config and "user" in http_config):
             logger.error("Login and password are mandatory parameters for http server.")
             logger.error("Http server stopped")
             return
         logger.info('Starting HTTP server...')
+        workers = int(http_config.get("workers", 16))
+        NodeEvents.max_streams = int(http_config.get("max_streams", max(workers // 4, 1)))
 
-        thread = get_http_thread(create_app())
-        logger.info("Agent started on port: {}".format(Config.base_config["http_server"]["port"]))
+        server = create_http_server(http_config)
+        thread = get_http_thread(server)
+        logger.info("Agent started on {}:{} with {} workers".format(server.host, server.port, workers))
 
         while SonmHttpServer.KEEP_RUNNING:
             if not thread.is_alive():
-                thread = get_http_thread(create_app())
+                # Serving loop of dead thread may have left its socket closed, replacement gets a new one
+                logger.error("HTTP server thread died, restarting")
+                close_http_server(server)
+                server = create_http_server(http_config)
+                thread = get_http_thread(server)
             time.sleep(1)
+        server.shutdown()
+        close_http_server(server)
         logger.info("Http server stopped")
 
 
-def get_http_thread(app, host='0.0.0.0', port=8081):
-    thread = threading.Thread(target=app.run, kwargs={'host': host, 'port': port})
+def create_http_server(http_config):
+    host = http_config.get("host", "0.0.0.0")
+    port = int(http_config.get("port", 8081))
+    workers = int(http_config.get("workers", 16))
+    return PooledWSGIServer(host, port, create_app(), workers, int(http_config.get("max_queued", 4 * workers)))
+
+
+def close_http_server(server):
+    server.server_close()
+    server.pool.shutdown(wait=False)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    # Werkzeug server handling requests on a bounded thread pool instead of a thread per request.
+    # At most max_queued requests wait for a free thread, the rest are answered with 503 right away.
+    multithread = True
+
+    def __init__(self, host, port, app, workers=16, max_queued=64):
+        super().__init__(host, port, app)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self.max_pending = workers + max_queued
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def process_request(self, request_, client_address):
+        with self.lock:
+            overloaded = self.pending >= self.max_pending
+            if not overloaded:
+                self.pending += 1
+        if overloaded:
+            http_logger.warning("Too many requests, rejecting request from {}".format(client_address[0]))
+            try:
+                request_.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request_)
+            return
+        self.pool.submit(self.process_request_thread, request_, client_address)
+
+    def process_request_thread(self, request_, client_address):
+        try:
+            self.finish_request(request_, client_address)
+        except Exception:
+            self.handle_error(request_, client_address)
+        finally:
+            self.shutdown_request(request_)
+            with self.lock:
+                self.pending -= 1
+
+
+def get_http_thread(server):
+    thread = threading.Thread(target=server.serve_forever, name="http-server")
     thread.daemon = True
     thread.start()
     return thread
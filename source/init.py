@@ -1,80 +1,339 @@
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from genericpath import isfile
 from os import listdir
 from os.path import join
 
+from tabulate import tabulate
+
+from source.accounts import Accounts
 from source.sonmapi import SonmApi
-from source.utils import Nodes
+from source.cache import TTLCache
+from source.logfetcher import LogFetcher
+from source.market import MarketScanner
+from source.metrics import Metrics
+from source.prices import PriceService
+from source.retry import CircuitBreakers
+from source.transport import Transport
+from source.utils import Nodes, convert_price
 from source.config import Config
 from source.worknode import WorkNode, State
 
 logger = logging.getLogger("monitor")
 
 
-def reload_config(sonm_api: SonmApi):
+def reload_config(accounts: Accounts, predict=True):
+    # New or changed specs are predicted in background, worker process gets prices from coordinator
+    Config.load_config()
+    if predict:
+        PriceService.refresh_missing(accounts.primary)
+    append_missed_nodes(accounts, Config.node_configs)
+
+
+def reload_prices(sonm_api: SonmApi):
     Config.load_config()
-    Config.load_prices(sonm_api)
-    append_missed_nodes(sonm_api, Config.node_configs)
+    PriceService.refresh_missing(sonm_api)
+
+
+def refresh_prices(sonm_api: SonmApi, history=None):
+    PriceService.workers = int(Config.base_config.get("predict_concurrency", 4))
+    PriceService.refresh(sonm_api)
+    if history:
+        history.record_prices(Config.prices)
+
+
+def price_refresh_interval():
+    return int(Config.base_config["price_refresh_interval"]) if "price_refresh_interval" in Config.base_config \
+        else 60
+
+
+def poll_orders_and_deals(accounts: Accounts):
+    for sonm_api in accounts.apis:
+        sonm_api.poller.refresh(Config.fleet_size)
+
+
+def scan_market(sonm_api: SonmApi):
+    config = Config.base_config.get("market") or {}
+    MarketScanner.depth = int(config.get("depth", 1))
+    MarketScanner.max_age = 3 * market_interval()
+    MarketScanner.refresh(sonm_api, int(config.get("limit", 10000)))
+
 
+def market_interval():
+    config = Config.base_config.get("market") or {}
+    return int(config.get("interval", 60))
 
-def check_balance(sonm_api: SonmApi):
-    Config.balance = sonm_api.token_balance()
 
+def market_enabled():
+    config = Config.base_config.get("market") or {}
+    return config.get("enabled", True)
 
-def append_missed_nodes(sonm_api, node_configs):
+
+def poll_interval():
+    return int(Config.base_config["poll_interval"]) if "poll_interval" in Config.base_config else 30
+
+
+def print_api_stats(accounts: Accounts):
+    # Breakers are shared by accounts using the same sonm node
+    keys = ["endpoint", "state", "calls", "successes", "errors", "failures", "retries", "rejected", "opened"]
+    for node_addr, breakers in sorted({sonm_api.endpoint: sonm_api.breakers for sonm_api in accounts.apis}.items()):
+        logger.info("Sonm api requests ({}):\n".format(node_addr) +
+                    tabulate([[m[key] for key in keys] for m in breakers.metrics()],
+                             [key.capitalize() for key in keys], tablefmt="grid"))
+    for sonm_api in accounts.apis:
+        logger.info("Sonm api cache ({}): {}".format(sonm_api.account, ", ".join(
+            "{} {}".format(key, value) for key, value in sorted(sonm_api.cache.metrics().items()))))
+
+
+def check_balance(accounts: Accounts):
+    balances = {sonm_api.account: sonm_api.token_balance() for sonm_api in accounts.apis}
+    total = {}
+    for key in ["liveBalance", "sideBalance", "liveEthBalance"]:
+        values = [float(balance[key]) for balance in balances.values() if balance[key] != "n/a"]
+        total[key] = "{:.4f}".format(sum(values)) if values else "n/a"
+    Config.set_balance(total, balances)
+
+
+def append_missed_nodes(accounts, node_configs):
     for node_tag, node_config in node_configs.items():
-        if node_tag not in Nodes.get_nodes_keys():
-            Nodes.add_node(WorkNode.create_empty(sonm_api, node_tag))
-
-
-def init_nodes_state(sonm_api):
-    nodes_num_ = len(Config.node_configs)
-    # get deals
-    deals_ = sonm_api.deal_list(nodes_num_)
-    if deals_:
-        for deal in deals_:
-            status = State.DEAL_OPENED
-            deal_status = sonm_api.deal_status(deal["id"])
-            order_ = sonm_api.order_status(deal_status["bid_id"])
-            for node_tag, node_config in Config.node_configs.items():
-                if node_tag == order_["tag"]:
-                    task_id = ""
-                    if deal_status["worker_offline"]:
-                        logger.info(
-                            "Seems like worker is offline: no respond for the resources and tasks request."
-                            " Deal will be closed")
-                        status = State.TASK_FAILED
-                    if deal_status["running"]:
-                        task_id = deal_status["running"][0]
-                        status = State.TASK_RUNNING
-                    bid_id_ = deal_status["bid_id"]
-                    price = deal_status["price"]
-                    node_ = WorkNode(status, sonm_api, order_["tag"], deal["id"], task_id, bid_id_, price)
-                    logger.info("Found deal, id {} (Node {})".format(deal["id"], order_["tag"]))
-                    Nodes.add_node(node_)
-
-    # get orders
-    orders_ = sonm_api.order_list(nodes_num_)
-    if orders_ and orders_["orders"]:
-        for order_ in list(orders_["orders"]):
-            status = State.AWAITING_DEAL
-            for node_tag, node_config in Config.node_configs.items():
-                if node_tag == order_["tag"]:
-                    price = order_["price"]
-                    node_ = WorkNode(status, sonm_api, order_["tag"], "", "", order_["id"], price)
-                    logger.info("Found order, id {} (Node {})".format(order_["id"], order_["tag"]))
-                    Nodes.add_node(node_)
-    append_missed_nodes(sonm_api, Config.node_configs)
-
-
-def init_sonm_api():
-    timeout = int(Config.base_config["timeout"]) if "timeout" in Config.base_config else 60
+        if not Nodes.has_node(node_tag):
+            Nodes.add_node(WorkNode.create_empty(accounts.for_node(node_tag), node_tag))
+
+
+def init_concurrency():
+    return int(Config.base_config["init_concurrency"]) if "init_concurrency" in Config.base_config else 16
+
+
+def fetch_deal(sonm_api, deal_id):
+    deal_status = sonm_api.deal_status(deal_id)
+    if not deal_status:
+        logger.error("Cannot retrieve status of deal {}".format(deal_id))
+        return None
+    order_ = sonm_api.order_status(deal_status["bid_id"])
+    if not order_:
+        logger.error("Cannot retrieve order {} of deal {}".format(deal_status["bid_id"], deal_id))
+        return None
+    return deal_id, deal_status, order_
 
-    key_file_path = Config.base_config["ethereum"]["key_path"]
-    keys = [f for f in listdir(key_file_path) if isfile(join(key_file_path, f))]
+
+def deal_state(deal_status):
+    status = State.DEAL_OPENED
+    task_id = ""
+    if deal_status["worker_offline"]:
+        logger.info(
+            "Seems like worker is offline: no respond for the resources and tasks request."
+            " Deal will be closed")
+        status = State.TASK_FAILED
+    if deal_status["running"]:
+        task_id = deal_status["running"][0]
+        status = State.TASK_RUNNING
+    return status, task_id
+
+
+def restore_deal(sonm_api, deal_id, deal_status, order_):
+    status, task_id = deal_state(deal_status)
+    bid_id_ = deal_status["bid_id"]
+    price = deal_status["price"]
+    node_ = WorkNode(status, sonm_api, order_["tag"], deal_id, task_id, bid_id_, price)
+    node_.supplier_id = deal_status["supplier_id"]
+    logger.info("Found deal, id {} (Node {})".format(deal_id, order_["tag"]))
+    return node_
+
+
+def init_nodes_state(accounts):
+    timings = []
+    started = time.time()
+    nodes_num_ = Config.fleet_size
+    with ThreadPoolExecutor(max_workers=init_concurrency()) as executor:
+        for sonm_api in accounts.apis:
+            # get deals
+            phase_start = time.time()
+            deals_ = sonm_api.deal_list(nodes_num_)
+            timings.append((sonm_api.account, "deal list", time.time() - phase_start))
+
+            phase_start = time.time()
+            fetched = [f.result() for f in [executor.submit(fetch_deal, sonm_api, deal["id"])
+                                            for deal in deals_ or []]]
+            timings.append((sonm_api.account, "deal and order status ({} deals)".format(len(fetched)),
+                            time.time() - phase_start))
+
+            phase_start = time.time()
+            restore = [item for item in fetched if item and item[2]["tag"] in Config.node_configs
+                       and not Nodes.has_node(item[2]["tag"])]
+            for node_ in executor.map(lambda item: restore_deal(sonm_api, *item), restore):
+                Nodes.add_node(node_)
+            timings.append((sonm_api.account, "deal nodes ({} nodes)".format(len(restore)), time.time() - phase_start))
+
+            # get orders
+            phase_start = time.time()
+            orders_ = sonm_api.order_list(nodes_num_)
+            timings.append((sonm_api.account, "order list", time.time() - phase_start))
+
+            phase_start = time.time()
+            restore = [order_ for order_ in orders_["orders"] or [] if order_["tag"] in Config.node_configs
+                       and not Nodes.has_node(order_["tag"])]
+            for node_ in executor.map(lambda order_: WorkNode(State.AWAITING_DEAL, sonm_api, order_["tag"], "", "",
+                                                              order_["id"], order_["price"]), restore):
+                logger.info("Found order, id {} (Node {})".format(node_.bid_id, node_.node_tag))
+                Nodes.add_node(node_)
+            timings.append((sonm_api.account, "order nodes ({} nodes)".format(len(restore)),
+                            time.time() - phase_start))
+
+        phase_start = time.time()
+        append_missed_nodes(accounts, Config.node_configs)
+        timings.append(("", "missed nodes", time.time() - phase_start))
+    logger.info("Nodes state initialized in {:.2f} sec:\n".format(time.time() - started) +
+                tabulate([[account, phase, "{:.2f}".format(duration)] for account, phase, duration in timings],
+                         ["Account", "Phase", "Time, sec"], tablefmt="grid"))
+
+
+def restore_nodes_state(accounts, journal):
+    started = time.time()
+    records = journal.load()
+    if not records:
+        return False
+    for node_tag in Config.node_configs:
+        record = records.get(node_tag)
+        # Node keeps account it had orders and deals with, new nodes go to their shard.
+        # Journal written before accounts were sharded has no account, that was the first one.
+        sonm_api = None
+        if record:
+            sonm_api = accounts.get(record["account"]) if record["account"] else accounts.primary
+        if record and sonm_api and record["status"] in State.__members__:
+            node_ = WorkNode(State[record["status"]], sonm_api, node_tag, record["deal_id"] or "",
+                             record["task_id"] or "", record["bid_id"] or "", "")
+            node_.price = record["price"] or ""
+            node_.task_uptime = record["task_uptime"] or 0
+        else:
+            node_ = WorkNode.create_empty(accounts.for_node(node_tag), node_tag)
+        node_.verified = False
+        Nodes.add_node(node_)
+    logger.info("Restored {} nodes from journal in {:.2f} sec, verifying against sonm node in background"
+                .format(len(Config.node_configs), time.time() - started))
+    return True
+
+
+def list_deals_and_orders(sonm_api, retry_interval):
+    nodes_num_ = Config.fleet_size
+    while True:
+        deals_ = sonm_api.deal_list(nodes_num_)
+        orders_ = sonm_api.order_list(nodes_num_)
+        if deals_ is not None and orders_["orders"] is not None:
+            return deals_, orders_["orders"]
+        logger.error("Cannot verify restored nodes state of account {}, retry in {} sec"
+                     .format(sonm_api.account, retry_interval))
+        time.sleep(retry_interval)
+
+
+def verify_nodes_state(accounts, retry_interval=30):
+    started = time.time()
+    unverified = [node_ for node_ in Nodes.get_nodes_arr() if not node_.verified]
+    listed = [(sonm_api,) + list_deals_and_orders(sonm_api, retry_interval) for sonm_api in accounts.apis]
+    referenced = set()
+    for sonm_api, deals_, orders_ in listed:
+        deals = {deal["id"]: deal for deal in deals_}
+        deals_by_bid = {deal["bid_id"]: deal for deal in deals_}
+        orders = {order_["id"]: order_ for order_ in orders_}
+        for node_ in [node_ for node_ in unverified if node_.sonm_api is sonm_api]:
+            if node_.deal_id and node_.deal_id in deals:
+                referenced.add(node_.deal_id)
+                if node_.status == State.STARTING_TASK:
+                    deal_status = sonm_api.deal_status(node_.deal_id)
+                    if deal_status:
+                        node_.status, node_.task_id = deal_state(deal_status)
+            elif node_.deal_id:
+                logger.info("Deal {} (Node {}) was closed while monitor was down"
+                            .format(node_.deal_id, node_.node_tag))
+                forget_deal(node_, State.DEAL_DISAPPEARED)
+            elif node_.bid_id in orders:
+                referenced.add(node_.bid_id)
+            elif node_.bid_id in deals_by_bid:
+                node_.deal_id = deals_by_bid[node_.bid_id]["id"]
+                node_.status = State.DEAL_OPENED
+                referenced.add(node_.deal_id)
+            elif node_.status != State.WORK_COMPLETED:
+                forget_deal(node_, State.CREATE_ORDER if node_.status != State.START else State.START)
+
+    # Deals and orders unknown to journal are adopted by free nodes with the same tag, node moves to their account
+    free = {node_.node_tag: node_ for node_ in unverified
+            if not node_.deal_id and not node_.bid_id and node_.status != State.WORK_COMPLETED}
+    with ThreadPoolExecutor(max_workers=init_concurrency()) as executor:
+        for sonm_api, deals_, orders_ in listed:
+            orphans = [executor.submit(fetch_deal, sonm_api, deal["id"]) for deal in deals_
+                       if deal["id"] not in referenced]
+            for item in [f.result() for f in orphans]:
+                if item and item[2]["tag"] in free:
+                    deal_id, deal_status, order_ = item
+                    node_ = free.pop(order_["tag"])
+                    node_.sonm_api = sonm_api
+                    node_.supplier_id = deal_status["supplier_id"]
+                    node_.bid_id = deal_status["bid_id"]
+                    node_.deal_id = deal_id
+                    node_.price = "{0:.4f} USD/h".format(convert_price(deal_status["price"]))
+                    node_.status, node_.task_id = deal_state(deal_status)
+                    logger.info("Found deal, id {} (Node {})".format(deal_id, node_.node_tag))
+            for order_ in orders_:
+                if order_["id"] not in referenced and order_["tag"] in free:
+                    node_ = free.pop(order_["tag"])
+                    node_.sonm_api = sonm_api
+                    node_.bid_id = order_["id"]
+                    node_.price = "{0:.4f} USD/h".format(convert_price(order_["price"]))
+                    node_.status = State.AWAITING_DEAL
+                    logger.info("Found order, id {} (Node {})".format(order_["id"], node_.node_tag))
+    for node_ in unverified:
+        node_.verified = True
+    logger.info("Verified {} restored nodes in {:.2f} sec".format(len(unverified), time.time() - started))
+
+
+def forget_deal(node_, status):
+    node_.deal_id = ""
+    node_.bid_id = ""
+    node_.task_id = ""
+    node_.task_uptime = 0
+    node_.status = status
+
+
+def account_keys(limit=None):
+    ethereum = Config.base_config["ethereum"]
+    key_file_path = ethereum["key_path"]
+    keys = sorted(f for f in listdir(key_file_path) if isfile(join(key_file_path, f)))
     if len(keys) == 0:
         raise Exception("Key storage doesn't contain any files")
-    key_password = Config.base_config["ethereum"]["password"]
-    node_addr = Config.base_config["node_address"]
-    sonm_api = SonmApi(join(key_file_path, keys[0]), key_password, node_addr, timeout)
-    return sonm_api
+    accounts = ethereum.get("accounts", 1)
+    if accounts != "all":
+        keys = keys[:int(accounts)]
+    passwords = ethereum.get("passwords") or {}
+    return [(join(key_file_path, key), passwords.get(key, ethereum["password"])) for key in keys[:limit]]
+
+
+def init_accounts(limit=None):
+    # limit: number of accounts to set up, e.g. 1 for tools working on the primary account only
+    timeout = int(Config.base_config["timeout"]) if "timeout" in Config.base_config else 60
+
+    node_addrs = Config.base_config["node_address"]
+    if isinstance(node_addrs, str):
+        node_addrs = [node_addrs]
+    # Accounts working through the same sonm node share its request budget and circuit breakers
+    transports = {node_addr: Transport.from_config(Config.base_config.get("transport")) for node_addr in node_addrs}
+    breakers = {node_addr: CircuitBreakers.from_config(Config.base_config.get("retry")) for node_addr in node_addrs}
+    apis = []
+    if node_addrs[0].startswith("fake://"):
+        # Local stand-in for sonm node, see ./loadtest.py; test code isn't loaded by production runs
+        from source.fakenode import FakeNode, FakeLogFetcher
+        for num, node_addr in enumerate(node_addrs[:limit]):
+            node = FakeNode.from_config(Config.base_config.get("fake_node"), num)
+            if apis:
+                node.share_market(apis[0].get_node())
+            apis.append(SonmApi("", "", node_addr, timeout, transports[node_addr], breakers[node_addr],
+                                TTLCache.from_config(Config.base_config.get("api_cache")), FakeLogFetcher(node), node))
+    else:
+        log_fetcher = LogFetcher.from_config(Config.base_config.get("task_logs"))
+        for num, (key_file, password) in enumerate(account_keys(limit)):
+            node_addr = node_addrs[num % len(node_addrs)]
+            apis.append(SonmApi(key_file, password, node_addr, timeout, transports[node_addr], breakers[node_addr],
+                                TTLCache.from_config(Config.base_config.get("api_cache")), log_fetcher))
+    for sonm_api in apis:
+        sonm_api.poller.max_age = 2 * poll_interval()
+        Metrics.add_api(sonm_api)
+    return Accounts(apis)
@@ -0,0 +1,74 @@
+import logging
+import time
+
+from source.sqlitewriter import SQLiteWriter
+
+logger = logging.getLogger("monitor")
+
+FIELDS = ["status", "bid_id", "deal_id", "task_id", "price", "task_uptime", "account"]
+INSERT = "INSERT INTO journal (ts, node, {}) VALUES (?, ?, {})".format(", ".join(FIELDS), ", ".join("?" * len(FIELDS)))
+
+
+class Journal(object):
+    # Append-only SQLite journal of node state changes. A single writer thread owns the connection,
+    # compaction keeps only the latest record of every node.
+    def __init__(self, path="out/journal.db", compact_interval=600):
+        self.path = path
+        self.writer = SQLiteWriter(path, "journal", maintenance=self.compact, maintenance_interval=compact_interval)
+        with self.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS journal ("
+                               "id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, node TEXT NOT NULL, "
+                               "status TEXT, bid_id TEXT, deal_id TEXT, task_id TEXT, price TEXT, task_uptime TEXT, "
+                               "account TEXT)")
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(journal)")]
+            if "account" not in columns:
+                connection.execute("ALTER TABLE journal ADD COLUMN account TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS journal_node ON journal (node, id)")
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        if not config.get("enabled", True):
+            return None
+        return cls(path=config.get("path", "out/journal.db"),
+                   compact_interval=int(config.get("compact_interval", 600)))
+
+    def connect(self):
+        return self.writer.connect()
+
+    def start(self):
+        self.writer.start()
+
+    def stop(self):
+        self.writer.stop()
+
+    def node_changed(self, node, field, old, new):
+        if field != "node" and field not in FIELDS:
+            return
+        if field == "node" and not new:
+            self.writer.execute(INSERT, (time.time(), old) + (None,) * len(FIELDS))
+        else:
+            self.record(node)
+
+    def record(self, node):
+        self.writer.execute(INSERT, (time.time(), node.node_tag, node.status.name, node.bid_id, node.deal_id,
+                                     node.task_id, node.price, str(node.task_uptime), node.sonm_api.account))
+
+    def record_nodes(self, nodes):
+        # Nodes as they are after startup, those that never change afterwards are in the journal too
+        for node in nodes:
+            self.record(node)
+
+    @staticmethod
+    def compact(connection):
+        with connection:
+            deleted = connection.execute("DELETE FROM journal WHERE id NOT IN "
+                                         "(SELECT MAX(id) FROM journal GROUP BY node)").rowcount
+            connection.execute("DELETE FROM journal WHERE status IS NULL")
+        logger.debug("Journal compacted, {} records removed".format(deleted))
+
+    def load(self):
+        with self.connect() as connection:
+            rows = connection.execute("SELECT node, {} FROM journal WHERE id IN "
+                                      "(SELECT MAX(id) FROM journal GROUP BY node)".format(", ".join(FIELDS)))
+            return {row[0]: dict(zip(FIELDS, row[1:])) for row in rows if row[1]}
@@ -0,0 +1,72 @@
+import gzip
+import logging
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from source.utils import get_sonmcli
+
+logger = logging.getLogger("monitor")
+
+
+class LogFetcher(object):
+    # Streams task logs from sonmcli into gzip files on background threads
+    def __init__(self, workers=2, max_bytes=100 * 1024 * 1024, tail="1000000", timeout=600):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="task-logs")
+        self.max_bytes = max_bytes
+        self.tail = tail
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(workers=int(config.get("workers", 2)),
+                   max_bytes=int(float(config.get("max_size_mb", 100)) * 1024 * 1024),
+                   tail=str(config.get("tail", "1000000")),
+                   timeout=int(config.get("timeout", 600)))
+
+    def fetch(self, deal_id, task_id, filename):
+        def log_failure(future_):
+            if future_.exception():
+                logger.error("Failed to save logs of deal {} task {}: {}"
+                             .format(deal_id, task_id, future_.exception()))
+
+        future = self.executor.submit(self.stream, deal_id, task_id, filename)
+        future.add_done_callback(log_failure)
+        return future
+
+    def stream(self, deal_id, task_id, filename):
+        # Log is downloaded from scratch into a temporary file which replaces the previous one when done:
+        # --tail output moves with the task, so a partial download can't be continued by position
+        path = filename + ".gz"
+        partial = path + ".part"
+        command = [get_sonmcli(), "task", "logs", deal_id, task_id, "--tail", self.tail]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        timer = threading.Timer(self.timeout, process.kill)
+        timer.start()
+        lines = 0
+        size = 0
+        try:
+            with gzip.open(partial, "wb") as outfile:
+                for line in process.stdout:
+                    if size + len(line) > self.max_bytes:
+                        logger.info("Log {} truncated at {} bytes".format(path, size))
+                        break
+                    outfile.write(line)
+                    lines += 1
+                    size += len(line)
+            os.replace(partial, path)
+        finally:
+            timer.cancel()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+            if os.path.exists(partial):
+                os.remove(partial)
+        logger.info("Saved logs of deal {} task {} to {} ({} lines)".format(deal_id, task_id, path, lines))
+        return path
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
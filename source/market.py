@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from source.config import Config
+
+logger = logging.getLogger("monitor")
+
+# Order of benchmarks in market orders
+BENCHMARKS = ["cpu-sysbench-multi", "cpu-sysbench-single", "cpu-cores", "ram-size", "storage-size", "net-download",
+              "net-upload", "gpu-count", "gpu-mem", "gpu-eth-hashrate", "gpu-cash-hashrate", "gpu-redshift"]
+NETFLAGS = {"overlay": 1, "outbound": 2, "incoming": 4}
+
+
+def requirements(resources):
+    benchmarks = resources.get("benchmarks", {})
+    netflags = sum(flag for name, flag in NETFLAGS.items() if resources.get("network", {}).get(name))
+    return tuple(int(benchmarks.get(name, 0)) for name in BENCHMARKS), netflags
+
+
+class AskIndex(object):
+    # Ask orders sorted by every benchmark. A query starts from the most selective benchmark and checks
+    # the rest only for asks that pass it.
+    def __init__(self, asks):
+        self.asks = sorted(asks, key=lambda ask: ask["price"])
+        self.columns = []
+        for num in range(len(BENCHMARKS)):
+            order = sorted(range(len(self.asks)), key=lambda i: self.asks[i]["benchmarks"][num])
+            self.columns.append(([self.asks[i]["benchmarks"][num] for i in order], order))
+
+    def __len__(self):
+        return len(self.asks)
+
+    def cheapest(self, benchmarks, netflags=0, counterparty=None, limit=1):
+        candidates = range(len(self.asks))
+        for num, required in enumerate(benchmarks):
+            if not required:
+                continue
+            values, order = self.columns[num]
+            matched = order[bisect_left(values, required):]
+            if len(matched) < len(candidates):
+                candidates = matched
+        result = []
+        for i in sorted(candidates):
+            ask = self.asks[i]
+            if counterparty and ask["author"].lower() != counterparty.lower():
+                continue
+            if ask["netflags"] & netflags != netflags:
+                continue
+            if all(value >= required for value, required in zip(ask["benchmarks"], benchmarks)):
+                result.append(ask)
+                if len(result) == limit:
+                    break
+        return result
+
+
+class MarketScanner(object):
+    # Snapshot of ask orders on market and the cheapest matching ask price per tag, refreshed by scheduler
+    index = AskIndex([])
+    prices = {}
+    depth = 1
+    max_age = 600
+    updated = 0
+    lock = threading.Lock()
+
+    @staticmethod
+    def refresh(sonm_api, limit=10000):
+        started = time.time()
+        asks = sonm_api.ask_orders(limit)
+        if asks is None:
+            logger.error("Failed to retrieve ask orders, keeping previous market snapshot")
+            return
+        index = AskIndex(asks)
+        configs = {task["config"]["tag"]: task["config"] for task in Config.tasks.values()}
+        prices = {}
+        for tag, bid in Config.bids.items():
+            benchmarks, netflags = requirements(bid["resources"])
+            counterparty = configs[tag]["counterparty"] if tag in configs else None
+            matched = index.cheapest(benchmarks, netflags, counterparty, MarketScanner.depth)
+            prices[tag] = {"perHourUSD": matched[-1]["price"], "asks": len(matched)} \
+                if len(matched) == MarketScanner.depth else None
+        with MarketScanner.lock:
+            MarketScanner.index = index
+            MarketScanner.prices = prices
+            MarketScanner.updated = time.time()
+        logger.debug("Market scanned: {} asks, {} tags priced in {:.2f} sec"
+                     .format(len(index), len([price for price in prices.values() if price]), time.time() - started))
+
+    @staticmethod
+    def price_for_tag(tag):
+        if time.time() - MarketScanner.updated > MarketScanner.max_age:
+            return None
+        price = MarketScanner.prices.get(tag)
+        return price["perHourUSD"] if price else None
+
+    @staticmethod
+    def cheapest(resources, counterparty=None, limit=10):
+        benchmarks, netflags = requirements(resources)
+        return MarketScanner.index.cheapest(benchmarks, netflags, counterparty, limit)
@@ -0,0 +1,200 @@
+import threading
+import time
+from bisect import bisect_left
+
+from source.config import Config
+from source.market import MarketScanner
+from source.utils import Nodes, parse_readable_price
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in labels) + "}"
+
+
+class Metric(object):
+    type_ = None
+
+    def __init__(self, name, help_):
+        self.name = name
+        self.help_ = help_
+        self.values = {}
+        self.lock = threading.Lock()
+        Metrics.register(self)
+
+    def header(self):
+        return ["# HELP {} {}".format(self.name, self.help_), "# TYPE {} {}".format(self.name, self.type_)]
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def expose(self):
+        with self.lock:
+            return self.header() + ["{}{} {}".format(self.name, format_labels(key), value)
+                                    for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    type_ = "gauge"
+
+    def __init__(self, name, help_, collect):
+        # Gauges are collected on scrape, collect returns list of (labels dict, value)
+        super().__init__(name, help_)
+        self.collect = collect
+
+    def expose(self):
+        return self.header() + ["{}{} {}".format(self.name, format_labels(sorted(labels.items())), value)
+                                for labels, value in self.collect()]
+
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(self, name, help_, buckets):
+        super().__init__(name, help_)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            entry = self.values[key]
+            entry["counts"][bisect_left(self.buckets, value)] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def expose(self):
+        lines = self.header()
+        with self.lock:
+            for key, entry in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + [float("inf")], entry["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append("{}_bucket{} {}".format(self.name, format_labels(key + (("le", le),)), cumulative))
+                lines.append("{}_sum{} {}".format(self.name, format_labels(key), entry["sum"]))
+                lines.append("{}_count{} {}".format(self.name, format_labels(key), entry["count"]))
+        return lines
+
+
+class Metrics(object):
+    registry = []
+    apis = []
+    state_since = {}
+
+    @staticmethod
+    def register(metric):
+        Metrics.registry.append(metric)
+
+    @staticmethod
+    def add_api(sonm_api):
+        Metrics.apis.append(sonm_api)
+
+    @staticmethod
+    def expose():
+        lines = []
+        for metric in Metrics.registry:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def node_changed(node, field, old, new):
+        now = time.time()
+        if field == "node":
+            if new:
+                Metrics.state_since[node.node_tag] = (node.status, now)
+            else:
+                Metrics.state_since.pop(node.node_tag, None)
+            return
+        if field != "status":
+            return
+        node_transitions.inc(tag=node.tag, from_state=old.name, to_state=new.name)
+        previous, since = Metrics.state_since.get(node.node_tag, (old, now))
+        state_duration.observe(now - since, tag=node.tag, state=previous.name)
+        if previous.name == "AWAITING_DEAL" and new.name == "DEAL_OPENED":
+            order_to_deal.observe(now - since, tag=node.tag)
+        Metrics.state_since[node.node_tag] = (new, now)
+
+
+def collect_nodes_by_state():
+    counts = {}
+    for node in Nodes.get_nodes_arr():
+        counts[(node.tag, node.status.name)] = counts.get((node.tag, node.status.name), 0) + 1
+    return [({"tag": tag, "state": state}, count) for (tag, state), count in sorted(counts.items())]
+
+
+def collect_task_uptime():
+    return [({"node": node.node_tag, "tag": node.tag}, int(node.task_uptime or 0)) for node in Nodes.get_nodes_arr()]
+
+
+def collect_order_price():
+    prices = [({"node": node.node_tag, "tag": node.tag}, parse_readable_price(node.price))
+              for node in Nodes.get_nodes_arr()]
+    return [(labels, price) for labels, price in prices if price is not None]
+
+
+def collect_predicted_price():
+    return [({"tag": tag}, price["perHourUSD"]) for tag, price in sorted(Config.prices.items())
+            if price and "perHourUSD" in price]
+
+
+def collect_market_price():
+    return [({"tag": tag}, price["perHourUSD"]) for tag, price in sorted(MarketScanner.prices.items()) if price]
+
+
+def collect_breakers():
+    breakers = {sonm_api.endpoint: sonm_api.breakers for sonm_api in Metrics.apis}
+    return [({"node": node_addr, "endpoint": breaker["endpoint"], "state": breaker["state"]}, 1)
+            for node_addr, breakers_ in sorted(breakers.items()) for breaker in breakers_.metrics()]
+
+
+def collect_cache():
+    return [({"account": sonm_api.account, "counter": key}, value)
+            for sonm_api in Metrics.apis for key, value in sorted(sonm_api.cache.metrics().items())]
+
+
+def collect_balance():
+    return [({"account": account, "currency": key}, float(value))
+            for account, balance in sorted(Config.balances.items()) for key, value in sorted(balance.items())
+            if value != "n/a"]
+
+
+def collect_nodes_by_account():
+    counts = {}
+    for node in Nodes.get_nodes_arr():
+        counts[node.sonm_api.account] = counts.get(node.sonm_api.account, 0) + 1
+    return [({"account": account}, count) for account, count in sorted(counts.items())]
+
+
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+STATE_BUCKETS = [1, 10, 60, 300, 900, 1800, 3600, 4 * 3600, 12 * 3600, 24 * 3600, 7 * 24 * 3600]
+
+api_latency = Histogram("sonm_api_request_duration_seconds", "Latency of a single sonm node request by endpoint",
+                        LATENCY_BUCKETS)
+api_requests = Counter("sonm_api_requests_total", "Sonm node requests by endpoint and result")
+api_retries = Counter("sonm_api_retries_total", "Retried sonm node requests by endpoint")
+node_transitions = Counter("node_state_transitions_total", "Node state transitions by tag")
+state_duration = Histogram("node_state_duration_seconds", "Time spent by nodes in a state before leaving it",
+                           STATE_BUCKETS)
+reprices = Counter("node_reprices_total", "Orders replaced at new price by tag and reason")
+order_to_deal = Histogram("node_order_to_deal_seconds", "Time from placed order to opened deal", STATE_BUCKETS)
+Gauge("nodes", "Nodes by tag and state", collect_nodes_by_state)
+Gauge("node_task_uptime_seconds", "Uptime of task running on node", collect_task_uptime)
+Gauge("node_order_price_usd_per_hour", "Price of node's current order", collect_order_price)
+Gauge("predicted_price_usd_per_hour", "Predicted price for tag", collect_predicted_price)
+Gauge("market_ask_price_usd_per_hour", "Price of cheapest ask matching tag's order", collect_market_price)
+Gauge("sonm_api_circuit_breaker", "Circuit breaker state by endpoint", collect_breakers)
+Gauge("sonm_api_cache", "Sonm api status cache size and counters", collect_cache)
+Gauge("account_balance", "Token and ether balance by account", collect_balance)
+Gauge("account_nodes", "Nodes by account", collect_nodes_by_account)
+
+Nodes.add_listener(Metrics.node_changed)
@@ -0,0 +1,57 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("monitor")
+
+
+class Poller(object):
+    # Bulk snapshot of our active orders and open deals, refreshed with one order_list and
+    # one deal_list call per tick. It's used to skip requests for unchanged entities only:
+    # anything missing from the snapshot or about to change state falls back to per-id REST calls.
+    def __init__(self, sonm_api, max_age=120):
+        self.sonm_api = sonm_api
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.deals = {}
+        self.deals_by_bid = {}
+        self.updated = 0
+
+    def refresh(self, limit):
+        orders_ = self.sonm_api.order_list(limit)
+        deals_ = self.sonm_api.deal_list(limit)
+        if orders_["orders"] is None or deals_ is None:
+            logger.error("Failed to refresh orders and deals snapshot, falling back to per-node requests")
+            with self.lock:
+                self.updated = 0
+            return
+        orders = {order_["id"]: order_ for order_ in orders_["orders"]}
+        deals = {deal["id"]: deal for deal in deals_}
+        deals_by_bid = {deal["bid_id"]: deal for deal in deals_}
+        with self.lock:
+            self.orders = orders
+            self.deals = deals
+            self.deals_by_bid = deals_by_bid
+            self.updated = time.time()
+        logger.debug("Snapshot refreshed: {} orders, {} deals".format(len(orders), len(deals)))
+
+    @property
+    def is_fresh(self):
+        return time.time() - self.updated < self.max_age
+
+    def order_status(self, order_id):
+        # Snapshot only tells that order is still waiting for deal, anything else is confirmed by REST call
+        with self.lock:
+            if self.is_fresh and order_id in self.orders and order_id not in self.deals_by_bid:
+                return {"orderStatus": 2, "tag": self.orders[order_id]["tag"], "dealID": "0"}
+        return self.sonm_api.order_status(order_id)
+
+    def deal_status(self, deal_id):
+        # Open deal in snapshot may be closed since, callers confirm with REST call before changing state
+        with self.lock:
+            if self.is_fresh and deal_id in self.deals:
+                deal = self.deals[deal_id]
+                return {"status": 1, "bid_id": deal["bid_id"], "price": deal["price"],
+                        "supplier_id": deal["supplier_id"]}
+        return self.sonm_api.deal_status(deal_id)
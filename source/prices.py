@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from source.config import Config
+
+logger = logging.getLogger("monitor")
+
+
+def spec_hash(resources):
+    return hashlib.sha1(json.dumps(resources, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class PriceService(object):
+    # Predicted prices per unique resources spec. Tags with identical resources share one prediction,
+    # readers get an immutable snapshot that is swapped atomically after every refresh.
+    # Spec whose prediction failed isn't asked for again until its backoff, doubled on every failure, is over.
+    specs = {}
+    tags = {}
+    snapshot = {}
+    history = {}
+    history_size = 1440
+    workers = 4
+    failed = {}
+    retry_delay = 60
+    max_retry_delay = 3600
+    lock = threading.Lock()
+    background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="predict")
+    pending = None
+
+    @staticmethod
+    def update_specs(bids):
+        specs = {}
+        tags = {}
+        for tag, bid in bids.items():
+            hash_ = spec_hash(bid["resources"])
+            specs[hash_] = bid["resources"]
+            tags[tag] = hash_
+        PriceService.specs = specs
+        PriceService.tags = tags
+
+    @staticmethod
+    def refresh(sonm_api, missing_only=False):
+        # With missing_only only specs without prediction are predicted, e.g. ones added by config reload.
+        # Specs no longer used by any tag are dropped.
+        PriceService.update_specs(Config.bids)
+        started = time.time()
+        specs = {hash_: resources for hash_, resources in PriceService.specs.items()
+                 if (not missing_only or hash_ not in PriceService.snapshot) and
+                 PriceService.failed.get(hash_, (0, 0))[1] <= started}
+        with ThreadPoolExecutor(max_workers=PriceService.workers) as executor:
+            predicted = dict(zip(specs.keys(), executor.map(sonm_api.predict_bid, specs.values())))
+        now = time.time()
+        with PriceService.lock:
+            snapshot = {hash_: price for hash_, price in PriceService.snapshot.items() if hash_ in PriceService.specs}
+            for hash_ in [hash_ for hash_ in PriceService.history if hash_ not in PriceService.specs]:
+                del PriceService.history[hash_]
+            PriceService.failed = {hash_: item for hash_, item in PriceService.failed.items()
+                                   if hash_ in PriceService.specs}
+            for hash_, price in predicted.items():
+                if not price:
+                    failures = PriceService.failed.get(hash_, (0, 0))[0] + 1
+                    delay = min(PriceService.retry_delay * 2 ** (failures - 1), PriceService.max_retry_delay)
+                    PriceService.failed[hash_] = (failures, now + delay)
+                    logger.error("Failed to predict price for spec {}, keeping previous value, retry in {} sec"
+                                 .format(hash_, delay))
+                    continue
+                PriceService.failed.pop(hash_, None)
+                snapshot[hash_] = price
+                PriceService.history.setdefault(hash_, deque(maxlen=PriceService.history_size)) \
+                    .append((now, price["perHourUSD"]))
+            PriceService.snapshot = snapshot
+        Config.set_prices({tag: snapshot.get(hash_) for tag, hash_ in PriceService.tags.items()})
+        logger.debug("Predicted prices for {} specs ({} tags) in {:.2f} sec"
+                     .format(len(specs), len(PriceService.tags), time.time() - started))
+
+    @staticmethod
+    def refresh_missing(sonm_api):
+        # Specs added by config reload are predicted in background, their nodes order at max_price meanwhile
+        with PriceService.lock:
+            if PriceService.pending is None or PriceService.pending.done():
+                PriceService.pending = PriceService.background.submit(PriceService.refresh_logged, sonm_api)
+            return PriceService.pending
+
+    @staticmethod
+    def refresh_logged(sonm_api):
+        try:
+            PriceService.refresh(sonm_api, missing_only=True)
+        except Exception as e:
+            logger.exception("Failed to predict prices of new specs: {}".format(e))
+
+    @staticmethod
+    def price_history(tag):
+        hash_ = PriceService.tags.get(tag)
+        return list(PriceService.history.get(hash_, []))
@@ -0,0 +1,70 @@
+import logging
+import time
+
+from source.config import Config
+from source.metrics import reprices
+from source.utils import Nodes, parse_readable_price
+from source.worknode import State, order_price
+
+logger = logging.getLogger("monitor")
+
+
+class Repricer(object):
+    # Periodically picks orders awaiting deal whose price drifted from current prediction or which wait
+    # too long, and asks their nodes to place them again. At most batch_size orders per run, oldest first.
+    def __init__(self, wake, interval=60, threshold=5, max_wait=1800, raise_step=10, batch_size=20):
+        self.wake = wake
+        self.interval = interval
+        self.threshold = threshold
+        self.max_wait = max_wait
+        self.raise_step = raise_step
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_config(cls, config, wake):
+        config = config or {}
+        if not config.get("enabled", True):
+            return None
+        return cls(wake,
+                   interval=int(config.get("interval", 60)),
+                   threshold=float(config.get("threshold", 5)),
+                   max_wait=int(config.get("max_wait", 1800)),
+                   raise_step=float(config.get("raise_step", 10)),
+                   batch_size=int(config.get("batch_size", 20)))
+
+    def candidate(self, node, now):
+        current = parse_readable_price(node.price)
+        if node.reprice_requested or not node.config or not current:
+            return None
+        # Without prediction order_price falls back to max_price, orders are kept until tag is predicted again
+        if Config.price_for_tag(node.tag) is None:
+            return None
+        max_price = float(node.config["max_price"])
+        base_price, _, _ = order_price(node.config, node.tag)
+        if now - node.order_created > self.max_wait:
+            price_raise = node.price_raise * (1 + self.raise_step / 100)
+            price_ = min(float(base_price) * price_raise, max_price)
+            if price_ > current:
+                return "wait", price_raise, price_
+        price_ = min(float(base_price) * node.price_raise, max_price)
+        if abs(price_ - current) / current * 100 > self.threshold:
+            return "stale", node.price_raise, price_
+        return None
+
+    def run(self):
+        now = time.time()
+        candidates = []
+        for node in Nodes.get_nodes_by_state(State.AWAITING_DEAL):
+            candidate = self.candidate(node, now)
+            if candidate:
+                candidates.append((node.order_created, node, candidate))
+        candidates.sort(key=lambda item: item[0])
+        for _, node, (reason, price_raise, price_) in candidates[:self.batch_size]:
+            logger.info("Reprice order {} (Node {}): {}, {} -> {:.4f} USD/h"
+                        .format(node.bid_id, node.node_tag, reason, node.price, price_))
+            node.price_raise = price_raise
+            node.reprice_requested = True
+            reprices.inc(tag=node.tag, reason=reason)
+            self.wake(node.node_tag)
+        if candidates:
+            logger.info("Repricing {} of {} orders".format(min(len(candidates), self.batch_size), len(candidates)))
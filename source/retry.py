@@ -0,0 +1,175 @@
+import logging
+import random
+import threading
+import time
+from enum import Enum
+
+logger = logging.getLogger("monitor")
+
+
+class RetryPolicy(object):
+    def __init__(self, retries=3, base_delay=1.0, max_delay=30.0, multiplier=2.0, jitter=0.5):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        delay_ = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return random.uniform(delay_ * (1 - self.jitter), delay_)
+
+
+class CircuitOpen(object):
+    # Result of a request not made, or given up, because the endpoint's circuit breaker is open or its retry is
+    # deferred to the next node step. It tells nothing about the order, deal or task asked for: callers keep their
+    # state and retry later. Falsy like a failed request.
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "CIRCUIT_OPEN"
+
+
+CIRCUIT_OPEN = CircuitOpen()
+
+
+class DeferredRetries(object):
+    # Node steps share a small thread pool, so requests made on step threads don't sleep between retries.
+    # A failed request returns CIRCUIT_OPEN at once, its backoff delay becomes the node's next due time
+    # and the same request made by the next step goes on with the next attempt.
+    local = threading.local()
+
+    def __init__(self, max_age=600, max_size=10000):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def enable():
+        # Initializer of step threads
+        DeferredRetries.local.enabled = True
+
+    @staticmethod
+    def enabled():
+        return getattr(DeferredRetries.local, "enabled", False)
+
+    @staticmethod
+    def defer(delay):
+        current = getattr(DeferredRetries.local, "delay", None)
+        DeferredRetries.local.delay = delay if current is None else min(current, delay)
+
+    @staticmethod
+    def take_delay():
+        delay = getattr(DeferredRetries.local, "delay", None)
+        DeferredRetries.local.delay = None
+        return delay
+
+    def attempt(self, key):
+        # Attempt to make now, requests not repeated within max_age start over
+        with self.lock:
+            attempt, saved = self.attempts.pop(key, (1, 0))
+        return attempt if time.time() - saved < self.max_age else 1
+
+    def save(self, key, attempt):
+        with self.lock:
+            now = time.time()
+            if len(self.attempts) >= self.max_size:
+                self.attempts = {key_: item for key_, item in self.attempts.items() if now - item[1] < self.max_age}
+            self.attempts[key] = (attempt, now)
+
+
+class BreakerState(Enum):
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+class CircuitBreaker(object):
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "successes": 0, "errors": 0, "failures": 0, "retries": 0, "rejected": 0,
+                      "opened": 0}
+
+    def allow(self):
+        with self.lock:
+            if self.state == BreakerState.OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.stats["rejected"] += 1
+                    return False
+                # Let a single probe through, the rest keep failing fast until it succeeds
+                self.state = BreakerState.HALF_OPEN
+            elif self.state == BreakerState.HALF_OPEN:
+                self.stats["rejected"] += 1
+                return False
+            self.stats["calls"] += 1
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.stats["successes"] += 1
+            self.failures = 0
+            if self.state != BreakerState.CLOSED:
+                logger.info("Circuit breaker for {} closed".format(self.endpoint))
+            self.state = BreakerState.CLOSED
+
+    def record_error(self):
+        # Node answered with an error about the request itself (e.g. worker offline), the endpoint is healthy
+        with self.lock:
+            self.stats["errors"] += 1
+            self.failures = 0
+            if self.state != BreakerState.CLOSED:
+                logger.info("Circuit breaker for {} closed".format(self.endpoint))
+            self.state = BreakerState.CLOSED
+
+    def record_failure(self):
+        with self.lock:
+            self.stats["failures"] += 1
+            self.failures += 1
+            if self.state == BreakerState.HALF_OPEN or \
+                    (self.state == BreakerState.CLOSED and self.failures >= self.failure_threshold):
+                logger.error("Circuit breaker for {} opened for {} sec after {} failures"
+                             .format(self.endpoint, self.reset_timeout, self.failures))
+                self.stats["opened"] += 1
+                self.state = BreakerState.OPEN
+                self.opened_at = time.time()
+
+    def record_retry(self):
+        with self.lock:
+            self.stats["retries"] += 1
+
+    @property
+    def is_open(self):
+        return self.state == BreakerState.OPEN
+
+
+class CircuitBreakers(object):
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(failure_threshold=int(config.get("failure_threshold", 5)),
+                   reset_timeout=float(config.get("reset_timeout", 30)))
+
+    def get(self, endpoint):
+        with self.lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout)
+            return self.breakers[endpoint]
+
+    def metrics(self):
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return [dict(endpoint=b.endpoint, state=b.state.name, **b.stats) for b in breakers]
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from source.retry import DeferredRetries
+
+logger = logging.getLogger("monitor")
+
+
+class NodeScheduler(object):
+    # Each node is a coroutine: one blocking WorkNode.step runs on a small thread pool,
+    # then the coroutine parks on the loop until the next-due time returned by the step.
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="node-step",
+                                           initializer=DeferredRetries.enable)
+        self.wakeups = {}
+        self.thread = threading.Thread(target=self._run_loop, name="node-scheduler")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        logger.info("Node scheduler started with {} step workers".format(self.workers))
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, node, delay=0):
+        node.RUNNING = True
+        return asyncio.run_coroutine_threadsafe(self._watch(node, delay), self.loop)
+
+    def wake(self, node_tag):
+        event = self.wakeups.get(node_tag)
+        if event:
+            self.loop.call_soon_threadsafe(event.set)
+
+    def stop_all(self, nodes):
+        for node in nodes:
+            node.stop_work()
+            self.wake(node.node_tag)
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def step(node):
+        # Runs on step thread: a request whose retry was deferred is made again after its backoff delay
+        try:
+            sleep_time = node.step()
+        finally:
+            delay = DeferredRetries.take_delay()
+        return sleep_time if delay is None else delay
+
+    async def _watch(self, node, delay=0):
+        event = asyncio.Event()
+        self.wakeups[node.node_tag] = event
+        node.RUNNING = True
+        try:
+            if delay:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            while node.KEEP_WORK and not node.is_completed:
+                sleep_time = await self.loop.run_in_executor(self.executor, self.step, node)
+                event.clear()
+                if node.KEEP_WORK:
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout=sleep_time if sleep_time else 60)
+                    except asyncio.TimeoutError:
+                        pass
+            node.log_stopped()
+        finally:
+            if self.wakeups.get(node.node_tag) is event:
+                del self.wakeups[node.node_tag]
@@ -1,29 +1,70 @@
 import logging
-import subprocess
 import time
 from functools import wraps
 
 from pytimeparse.timeparse import timeparse
-from sonm_pynode.main import Node
 
-from source.utils import convert_price, parse_tag, parse_price, Identity, get_sonmcli
+from source.cache import TTLCache
+from source.logfetcher import LogFetcher
+from source.metrics import api_latency, api_requests, api_retries
+from source.poller import Poller
+from source.retry import RetryPolicy, CircuitBreakers, DeferredRetries, CIRCUIT_OPEN
+from source.transport import Transport
+from source.utils import convert_price, parse_tag, parse_price, Identity, execute_cli_command
 
 logger = logging.getLogger("monitor")
 
+ORDER_ASK = 2
+ORDER_ACTIVE = 2
 
-def retry_on_status(_func=None, *, attempts=3, sleep_time=3):
+
+def is_transport_error(response):
+    return "status_code" not in response or response["status_code"] >= 500
+
+
+def retry_on_status(_func=None, *, policy=RetryPolicy()):
     def decorator(fn):
         @wraps(fn)
         def wrapper(*args, **kwargs):
-            attempt = 1
+            api, endpoint = args[0], fn.__name__[:-len("_rest")]
+            breaker = api.breakers.get(endpoint)
+            deferred = DeferredRetries.enabled()
+            key = (endpoint, repr(args[1:]), repr(kwargs))
+            attempt = api.deferred_retries.attempt(key) if deferred else 1
             while True:
-                r = fn(*args, **kwargs)
+                if not breaker.allow():
+                    logger.debug("Circuit breaker for {} is open, skip request".format(endpoint))
+                    return CIRCUIT_OPEN
+                started = time.time()
+                try:
+                    r = api.transport.call(endpoint, fn, *args, **kwargs)
+                except Exception as e:
+                    r = {"error": str(e)}
+                api_latency.observe(time.time() - started, endpoint=endpoint)
                 if "status_code" in r and r["status_code"] == 200:
+                    api_requests.inc(endpoint=endpoint, result="success")
+                    breaker.record_success()
                     return r
-                if attempt > attempts:
+                api_requests.inc(endpoint=endpoint, result="failure")
+                # Only transport errors count against the breaker, an error answer is about this request only
+                if is_transport_error(r):
+                    breaker.record_failure()
+                else:
+                    breaker.record_error()
+                if breaker.is_open:
+                    logger.error("Failed to execute {}, circuit breaker is open: {}".format(fn.__name__, r))
+                    return CIRCUIT_OPEN
+                if attempt > policy.retries:
                     break
                 attempt += 1
-                time.sleep(sleep_time)
+                api_retries.inc(endpoint=endpoint)
+                breaker.record_retry()
+                if deferred:
+                    api.deferred_retries.save(key, attempt)
+                    DeferredRetries.defer(policy.delay(attempt - 1))
+                    logger.warning("Failed to execute {}, attempt {} on next step: {}".format(fn.__name__, attempt, r))
+                    return CIRCUIT_OPEN
+                time.sleep(policy.delay(attempt - 1))
             logger.error("Failed to execute {}: {}".format(fn.__name__, r))
             return None
 
@@ -36,16 +77,30 @@ def retry_on_status(_func=None, *, attempts=3, sleep_time=3):
 
 
 class SonmApi:
-    def __init__(self, key_file: str, password: str, endpoint: str, timeout: int):
-        self.node = Node(key_file, password, endpoint)
+    def __init__(self, key_file: str, password: str, endpoint: str, timeout: int, transport: Transport = None,
+                 breakers: CircuitBreakers = None, cache: TTLCache = None, log_fetcher: LogFetcher = None, node=None):
+        if node is None:
+            # Imported here so fake nodes run without sonm_pynode installed
+            from sonm_pynode.main import Node
+            node = Node(key_file, password, endpoint)
+        self.node = node
+        self.account = self.node.eth_addr
+        self.endpoint = endpoint
         self.logger = logging.getLogger("monitor")
         self.timeout = timeout
+        self.transport = transport if transport else Transport()
+        self.breakers = breakers if breakers else CircuitBreakers()
+        self.cache = cache if cache else TTLCache()
+        self.deferred_retries = DeferredRetries()
+        self.log_fetcher = log_fetcher if log_fetcher else LogFetcher()
+        self.poller = Poller(self)
         self.logger.info("Sonm api instance created:\n"
                          "\tEth key location: {}\n"
                          "\tEth address: {}\n"
                          "\tSonm node endpoint: {}\n"
-                         "\tDefault timeout: {} sec"
-                         .format(key_file, self.node.eth_addr, endpoint, timeout))
+                         "\tDefault timeout: {} sec\n"
+                         "\tRequests in flight: {}"
+                         .format(key_file, self.node.eth_addr, endpoint, timeout, self.transport.pool_size))
 
     def get_node(self):
         if self.node:
@@ -61,6 +116,8 @@ class SonmApi:
         order["price"] = {"perSecond": str(parse_price(order["price"]))}
         order["identity"] = Identity[order["identity"]].value
         create_order = self.order_create_rest(order)
+        if create_order is CIRCUIT_OPEN:
+            return CIRCUIT_OPEN
         if create_order:
             result = {"id": create_order["id"]}
         return result
@@ -75,68 +132,115 @@ class SonmApi:
                        for order in list(order_list_["orders"])]
         return {"orders": orders_}
 
+    def ask_orders(self, limit):
+        market_orders_ = self.market_orders_rest(limit)
+        if not market_orders_:
+            return None
+        asks = []
+        for order in [order_["order"] for order_ in market_orders_.get("orders", [])]:
+            if order.get("orderType") != ORDER_ASK or order.get("orderStatus", ORDER_ACTIVE) != ORDER_ACTIVE:
+                continue
+            asks.append({"id": order["id"],
+                         "author": order.get("authorID", ""),
+                         "price": convert_price(order["price"]),
+                         "netflags": int(order.get("netflags", {}).get("flags", 0)),
+                         "benchmarks": tuple(int(value) for value in order["benchmarks"]["values"])})
+        return asks
+
     def order_status(self, order_id):
-        result = None
+        result = self.cache.get(("order_status", order_id))
+        if result:
+            return result
         order_status_ = self.order_status_rest(order_id)
+        if order_status_ is CIRCUIT_OPEN:
+            return CIRCUIT_OPEN
         if order_status_:
             result = {"orderStatus": order_status_["orderStatus"],
                       "tag": parse_tag(order_status_["tag"]),
                       "dealID": order_status_["dealID"]}
+            self.cache.put(("order_status", order_id), result)
         return result
 
     def order_cancel(self, order_id):
         result = None
         order_cancel_ = self.order_cancel_rest([order_id])
+        self.cache.invalidate("order_status", order_id)
+        if order_cancel_ is CIRCUIT_OPEN:
+            return CIRCUIT_OPEN
         if order_cancel_:
             result = {}
         return result
 
     def deal_list(self, limit):
-        result = []
+        result = None
         deal_list_ = self.deal_list_rest(limit)
-        if deal_list_ and "deals" in deal_list_:
-            for d in [d_["deal"] for d_ in deal_list_['deals']]:
-                result.append({"id": d["id"]})
+        if deal_list_:
+            result = []
+            if "deals" in deal_list_:
+                for d in [d_["deal"] for d_ in deal_list_['deals']]:
+                    result.append({"id": d["id"], "bid_id": d["bidID"], "price": d["price"],
+                                   "supplier_id": d["supplierID"]})
         return result
 
     def deal_status(self, deal_id):
-        result = None
+        result = self.cache.get(("deal_status", deal_id))
+        if result:
+            return result
         deal_status = self.deal_status_rest(deal_id)
+        if deal_status is CIRCUIT_OPEN:
+            return CIRCUIT_OPEN
         if deal_status and "deal" in deal_status:
             deal_status_ = deal_status["deal"]
             result = {"status": deal_status_["status"],
                       "bid_id": deal_status_["bidID"],
                       "running": None,
                       "worker_offline": True,
-                      "price": deal_status_["price"]}
+                      "price": deal_status_["price"],
+                      "supplier_id": deal_status_["supplierID"]}
             if "running" in deal_status:
                 result["running"] = list(deal_status["running"])
             if "resources" in deal_status:
                 result["worker_offline"] = False
+            self.cache.put(("deal_status", deal_id), result)
         return result
 
     def deal_close(self, deal_id, bl_worker=False):
         result = None
         close_deal = self.deal_close_rest(deal_id, bl_worker)
+        self.invalidate_deal(deal_id)
+        if close_deal is CIRCUIT_OPEN:
+            return CIRCUIT_OPEN
         if close_deal:
             result = {}
         return result
 
     def task_status(self, deal_id, task_id):
-        result = None
+        result = self.cache.get(("task_status", deal_id, task_id))
+        if result:
+            return result
         task_status_ = self.task_status_rest(deal_id, task_id)
+        if task_status_ is CIRCUIT_OPEN:
+            return CIRCUIT_OPEN
         if task_status_ and "status" in task_status_:
             result = {"status": task_status_["status"],
                       "uptime": str(int(float(int(task_status_["uptime"]) / 1e9)))}
+            self.cache.put(("task_status", deal_id, task_id), result)
         return result
 
     def task_start(self, deal_id, task, timeout):
         result = None
         task_start = self.task_start_rest(deal_id, task, timeout)
+        self.invalidate_deal(deal_id)
+        if task_start is CIRCUIT_OPEN:
+            return CIRCUIT_OPEN
         if task_start:
             result = {"id": task_start["id"]}
         return result
 
+    def invalidate_deal(self, deal_id):
+        self.cache.invalidate("deal_status", deal_id)
+        self.cache.invalidate("task_status", deal_id)
+
     def predict_bid(self, bid_):
         result = None
         predict_ = self.predict_bid_rest(bid_)
@@ -157,7 +261,7 @@ class SonmApi:
     def token_balance_rest(self):
         return self.get_node().token.balance(timeout=self.timeout)
 
-    @retry_on_status
+    @retry_on_status(policy=RetryPolicy(retries=2, base_delay=2, max_delay=10))
     def predict_bid_rest(self, bid_):
         return self.get_node().predictor.predict(bid_, timeout=self.timeout)
 
@@ -184,6 +288,11 @@ class SonmApi:
     def order_list_rest(self, limit):
         return self.get_node().order.list(self.get_node().eth_addr, limit, timeout=self.timeout)
 
+    @retry_on_status
+    def market_orders_rest(self, limit):
+        # Orders of any author
+        return self.get_node().order.list("", limit, timeout=self.timeout)
+
     @retry_on_status
     def order_status_rest(self, order_id):
         return self.get_node().order.status(order_id, timeout=self.timeout)
@@ -192,16 +301,22 @@ class SonmApi:
     def order_cancel_rest(self, order_id):
         return self.get_node().order.cancel(order_id, timeout=self.timeout)
 
-    @retry_on_status(attempts=10, sleep_time=10)
+    @retry_on_status(policy=RetryPolicy(retries=5, base_delay=2, max_delay=10))
     def task_status_rest(self, deal_id, task_id):
         return self.get_node().task.status(deal_id, task_id, timeout=self.timeout)
 
-    @retry_on_status(attempts=1)
+    @retry_on_status(policy=RetryPolicy(retries=1, base_delay=3))
     def task_start_rest(self, deal_id, task, timeout):
         return self.get_node().task.start(deal_id, task, timeout=timeout)
 
-    @staticmethod
-    def task_logs(deal_id, task_id, rownum, filename):
-        command = [get_sonmcli(), "task", "logs", deal_id, task_id, "--tail", rownum]
-        with open(filename, "w") as outfile:
-            subprocess.call(command, stdout=outfile)
+    def blacklist_list(self):
+        # Blacklist isn't exposed by node api, it's managed with sonmcli
+        blacklist_ = self.transport.call("blacklist_list", execute_cli_command, ["blacklist", "list"], self.timeout)
+        return blacklist_.get("addresses") or []
+
+    def blacklist_remove(self, address):
+        self.transport.call("blacklist_remove", execute_cli_command, ["blacklist", "remove", address], self.timeout)
+        return {}
+
+    def task_logs(self, deal_id, task_id, filename):
+        return self.log_fetcher.fetch(deal_id, task_id, filename)
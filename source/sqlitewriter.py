@@ -0,0 +1,76 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("monitor")
+
+
+class SQLiteWriter(object):
+    # Background thread owning one SQLite connection. Queued statements are written in batches, one
+    # transaction per batch. A batch failing with a database error (e.g. locked by another process) is retried
+    # and then dropped, the thread keeps running. maintenance runs on the same connection every interval.
+    def __init__(self, path, name, retries=3, retry_delay=1, maintenance=None, maintenance_interval=600):
+        self.path = path
+        self.name = name
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.maintenance = maintenance
+        self.maintenance_interval = maintenance_interval
+        self.queue = queue.Queue()
+        self.running = False
+        self.thread = threading.Thread(target=self.write_loop, name=name)
+        self.thread.daemon = True
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.queue.put(None)
+        if self.thread.is_alive():
+            self.thread.join(timeout=5)
+
+    def execute(self, statement, params):
+        self.queue.put((statement, params))
+
+    def write_loop(self):
+        connection = self.connect()
+        maintained = time.time()
+        while self.running or not self.queue.empty():
+            batch = []
+            try:
+                item = self.queue.get(timeout=1)
+                while item is not None:
+                    batch.append(item)
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            if batch:
+                self.write(connection, batch)
+            if self.maintenance and time.time() - maintained > self.maintenance_interval:
+                try:
+                    self.maintenance(connection)
+                except sqlite3.Error as e:
+                    logger.error("Failed to maintain {}: {}".format(self.name, e))
+                maintained = time.time()
+        connection.close()
+
+    def write(self, connection, batch):
+        for attempt in range(1, self.retries + 1):
+            try:
+                with connection:
+                    for statement, params in batch:
+                        connection.execute(statement, params)
+                return
+            except sqlite3.Error as e:
+                if attempt == self.retries:
+                    logger.error("Failed to write {} records to {}, dropping them: {}".format(len(batch), self.name, e))
+                else:
+                    logger.warning("Failed to write {}, retry in {} sec: {}".format(self.name, self.retry_delay, e))
+                    time.sleep(self.retry_delay)
@@ -0,0 +1,80 @@
+import logging
+import queue
+
+from source.config import Config
+from source.utils import Nodes
+
+logger = logging.getLogger("monitor")
+
+
+class Supervisor(object):
+    # Starts node watchers and reacts to their completion, to nodes appearing in the registry
+    # and to config changes. All events go through one queue, nothing is polled.
+    def __init__(self, node_scheduler, startup_rate=10, restart_delay=10):
+        self.node_scheduler = node_scheduler
+        self.startup_rate = startup_rate
+        self.restart_delay = restart_delay
+        self.events = queue.Queue()
+        self.futures = {}
+        Nodes.add_listener(self.node_changed)
+        Config.add_listener(self.config_changed)
+
+    def node_changed(self, node, field, old, new):
+        if field == "node" and new:
+            self.events.put(("added", node.node_tag, None))
+
+    def config_changed(self, node_diff):
+        self.events.put(("config", None, node_diff))
+
+    def submit(self, node, delay=0):
+        future = self.node_scheduler.submit(node, delay)
+        self.futures[node.node_tag] = future
+        future.add_done_callback(lambda f: self.events.put(("done", node.node_tag, f)))
+
+    def start_nodes(self):
+        # Ramp up: start times are staggered by startup_rate instead of sleeping between submits
+        nodes = Nodes.get_not_running()
+        for num, node in enumerate(nodes):
+            self.submit(node, num / float(self.startup_rate))
+        logger.info("Starting {} nodes over {:.0f} sec".format(len(nodes), len(nodes) / float(self.startup_rate)))
+
+    def run(self):
+        self.start_nodes()
+        while self.futures:
+            try:
+                event, node_tag, payload = self.events.get(timeout=5)
+            except queue.Empty:
+                continue
+            if event == "done":
+                self.node_done(node_tag, payload)
+            elif event == "added":
+                if Nodes.has_node(node_tag) and not Nodes.get_node(node_tag).is_running:
+                    logger.info("Adding Node {} to executor".format(node_tag))
+                    self.submit(Nodes.get_node(node_tag))
+            elif event == "config":
+                self.remove_nodes(payload["removed"])
+
+    def node_done(self, node_tag, future):
+        if self.futures.get(node_tag) is not future:
+            return
+        logger.info("Removing Node {} from execution list.".format(node_tag))
+        del self.futures[node_tag]
+        exception_ = future.exception()
+        if exception_ and Nodes.has_node(node_tag):
+            logger.error("Node {} failed with exception: {}".format(node_tag, exception_), exc_info=exception_)
+            node = Nodes.get_node(node_tag)
+            node.RUNNING = False
+            if node.KEEP_WORK:
+                logger.info("Restarting Node {} in {} sec".format(node_tag, self.restart_delay))
+                self.submit(node, self.restart_delay)
+
+    def remove_nodes(self, node_tags):
+        # Destroy nodes, if they aren't exist in reloaded config
+        for node_tag in node_tags:
+            if not Nodes.has_node(node_tag) or node_tag in Config.node_configs:
+                continue
+            logger.info("Stopping Node {}. It doesn't exist in configuration".format(node_tag))
+            Nodes.get_node(node_tag).finish_work()
+            self.node_scheduler.wake(node_tag)
+            logger.info("Removing Node {} from active nodes list.".format(node_tag))
+            Nodes.remove_node(node_tag)
@@ -0,0 +1,61 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("monitor")
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity else rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Transport(object):
+    # Request budget shared by all node workers talking to one sonm node: at most pool_size
+    # requests in flight, at most endpoint_concurrency per endpoint and a global token-bucket rate.
+    # Connections aren't managed here: sonm_pynode opens them and doesn't expose its HTTP session.
+    def __init__(self, pool_size=10, rate=20, burst=None, endpoint_concurrency=None, default_concurrency=None):
+        self.pool_size = pool_size
+        self.pool = threading.BoundedSemaphore(pool_size)
+        self.bucket = TokenBucket(rate, burst)
+        self.endpoint_concurrency = endpoint_concurrency or {}
+        self.default_concurrency = default_concurrency if default_concurrency else pool_size
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(pool_size=int(config.get("pool_size", 10)),
+                   rate=float(config.get("rate", 20)),
+                   burst=config.get("burst"),
+                   endpoint_concurrency=config.get("endpoint_concurrency"),
+                   default_concurrency=config.get("default_concurrency"))
+
+    def endpoint_semaphore(self, endpoint):
+        with self.lock:
+            if endpoint not in self.endpoints:
+                limit = int(self.endpoint_concurrency.get(endpoint, self.default_concurrency))
+                self.endpoints[endpoint] = threading.BoundedSemaphore(limit)
+            return self.endpoints[endpoint]
+
+    def call(self, endpoint, fn, *args, **kwargs):
+        with self.endpoint_semaphore(endpoint), self.pool:
+            self.bucket.acquire()
+            return fn(*args, **kwargs)
@@ -1,12 +1,20 @@
 import base64
+import bisect
+import copy
 import errno
+import heapq
+import json
 import logging
 import os
 import platform
 import re
+import subprocess
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
-import ruamel.yaml
+import yaml as pyyaml
 from jinja2 import Template
 
 from ruamel import yaml
@@ -33,29 +41,147 @@ class TaskStatus(Enum):
 
 
 class Nodes(object):
+    # Registry of work nodes shared by watchers, scheduler jobs and http threads. Keeps node tags presorted
+    # and indexed by tag, state and running flag; readers get an immutable snapshot rebuilt only on add/remove.
+    # Index lists hold (natural key, node tag) pairs kept in order with bisect.
+    # Version goes up only on changes the dashboard shows; uptime and heartbeat are refreshed by its cache_ttl.
+    VERSIONED_FIELDS = {"node", "status", "bid_id", "deal_id", "task_id", "price"}
     nodes_ = dict()
+    sorted_keys = []
+    sort_keys = []
+    by_tag = defaultdict(list)
+    by_state = defaultdict(list)
+    not_running = []
+    snapshot_ = ()
+    version = 0
+    listeners = []
+    lock = threading.RLock()
 
     @staticmethod
     def add_node(node):
-        Nodes.nodes_[node.node_tag] = node
+        with Nodes.lock:
+            if node.node_tag in Nodes.nodes_:
+                Nodes.unindex(Nodes.nodes_[node.node_tag])
+            else:
+                key = natural_keys(node.node_tag)
+                pos = bisect.bisect(Nodes.sort_keys, key)
+                Nodes.sort_keys.insert(pos, key)
+                Nodes.sorted_keys.insert(pos, node.node_tag)
+            Nodes.nodes_[node.node_tag] = node
+            index_add(Nodes.by_tag[node.tag], node.node_tag)
+            index_add(Nodes.by_state[node.status], node.node_tag)
+            if not node.is_running:
+                index_add(Nodes.not_running, node.node_tag)
+            Nodes.snapshot_ = None
+        Nodes.node_changed(node, "node", None, node.node_tag)
 
     @staticmethod
     def get_node(node_tag):
         return Nodes.nodes_[node_tag]
 
+    @staticmethod
+    def has_node(node_tag):
+        return node_tag in Nodes.nodes_
+
     @staticmethod
     def remove_node(node_tag):
-        del Nodes.nodes_[node_tag]
+        with Nodes.lock:
+            node = Nodes.nodes_.pop(node_tag)
+            pos = Nodes.sorted_keys.index(node_tag, bisect.bisect_left(Nodes.sort_keys, natural_keys(node_tag)))
+            del Nodes.sorted_keys[pos]
+            del Nodes.sort_keys[pos]
+            Nodes.unindex(node)
+            Nodes.snapshot_ = None
+        Nodes.node_changed(node, "node", node_tag, None)
+
+    @staticmethod
+    def unindex(node):
+        index_remove(Nodes.by_tag[node.tag], node.node_tag)
+        if not Nodes.by_tag[node.tag]:
+            del Nodes.by_tag[node.tag]
+        for index in Nodes.by_state.values():
+            index_remove(index, node.node_tag)
+        index_remove(Nodes.not_running, node.node_tag)
 
     @staticmethod
     def get_nodes_keys():
-        return list(Nodes.nodes_.keys())
+        return list(Nodes.snapshot())
+
+    @staticmethod
+    def snapshot():
+        with Nodes.lock:
+            if Nodes.snapshot_ is None:
+                Nodes.snapshot_ = tuple(Nodes.sorted_keys)
+            return Nodes.snapshot_
 
     @staticmethod
     def get_nodes_arr():
-        temp = list(Nodes.nodes_.values())
-        temp.sort(key=lambda x: natural_keys(x.node_tag))
-        return temp
+        nodes_ = Nodes.nodes_
+        return [nodes_[tag] for tag in Nodes.snapshot() if tag in nodes_]
+
+    @staticmethod
+    def get_nodes_by_tag(tag):
+        with Nodes.lock:
+            return [Nodes.nodes_[node_tag] for _, node_tag in Nodes.by_tag.get(tag, ())]
+
+    @staticmethod
+    def get_nodes_by_state(*states):
+        with Nodes.lock:
+            if len(states) == 1:
+                entries = Nodes.by_state.get(states[0], ())
+            else:
+                entries = heapq.merge(*[Nodes.by_state.get(state, ()) for state in states])
+            return [Nodes.nodes_[node_tag] for _, node_tag in entries]
+
+    @staticmethod
+    def count_by_state():
+        with Nodes.lock:
+            return {state: len(tags) for state, tags in Nodes.by_state.items() if tags}
+
+    @staticmethod
+    def get_not_running():
+        with Nodes.lock:
+            return [Nodes.nodes_[node_tag] for _, node_tag in Nodes.not_running]
+
+    @staticmethod
+    def add_listener(listener):
+        Nodes.listeners.append(listener)
+
+    @staticmethod
+    def node_changed(node, field, old, new):
+        with Nodes.lock:
+            if field in Nodes.VERSIONED_FIELDS:
+                Nodes.version += 1
+            if field in ("status", "RUNNING") and Nodes.nodes_.get(node.node_tag) is node:
+                if field == "status":
+                    index_remove(Nodes.by_state[old], node.node_tag)
+                    index_add(Nodes.by_state[new], node.node_tag)
+                elif new:
+                    index_remove(Nodes.not_running, node.node_tag)
+                else:
+                    index_add(Nodes.not_running, node.node_tag)
+        # Running flag only feeds the index, it isn't a node update for listeners and event streams
+        if field == "RUNNING":
+            return
+        for listener in Nodes.listeners:
+            listener(node, field, old, new)
+
+
+def index_add(index, node_tag):
+    entry = (natural_keys(node_tag), node_tag)
+    pos = bisect.bisect_left(index, entry)
+    if pos == len(index) or index[pos] != entry:
+        index.insert(pos, entry)
+
+
+def index_remove(index, node_tag):
+    entry = (natural_keys(node_tag), node_tag)
+    pos = bisect.bisect_left(index, entry)
+    if pos < len(index) and index[pos] == entry:
+        del index[pos]
+
+
+DIGITS = re.compile(r"(\d+)")
 
 
 def atoi(text):
@@ -63,7 +189,12 @@ def atoi(text):
 
 
 def natural_keys(text):
-    return [atoi(c) for c in re.split("(\d+)", text)]
+    return [atoi(c) for c in DIGITS.split(text)]
+
+
+def task_tag(node_tag):
+    # Node tags are "<task tag>_<num>", task tag itself may contain "_"
+    return node_tag.rsplit("_", 1)[0]
 
 
 def parse_tag(order_):
@@ -84,6 +215,13 @@ def convert_price(price_):
     return int(price_) / 1e18 * 3600
 
 
+def parse_readable_price(price):
+    try:
+        return float(price.split()[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
 def parse_price(price_: str):
     if price_.endswith("USD/h") or price_.endswith("USD/s"):
         return int(float(price_[:-5]) * 1e18 / 3600)
@@ -98,6 +236,17 @@ def get_sonmcli():
         return "sonmcli"
 
 
+def execute_cli_command(command, timeout=180):
+    result = subprocess.run([get_sonmcli()] + command + ["--timeout={}s".format(timeout), "--json"],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout + 30)
+    output = result.stdout.decode("utf-8")
+    if result.returncode != 0:
+        raise Exception("Failed to execute command {}: {}".format(" ".join(command), output.strip()))
+    if output.strip() == "null":
+        return {}
+    return json.loads(output)
+
+
 def validate_eth_addr(eth_addr):
     pattern = re.compile("^0x[a-fA-F0-9]{40}$")
     if eth_addr and pattern.match(eth_addr):
@@ -153,15 +302,41 @@ def template_bid(config, tag="", counterparty=None):
     return bid_template
 
 
+class Templates(object):
+    compiled = {}
+    dumper = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-dump")
+
+    @staticmethod
+    def get(file_):
+        # Compile template once, recompile only when template file was modified
+        mtime = os.stat(file_).st_mtime_ns
+        cached = Templates.compiled.get(file_)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(file_, 'r') as fp:
+            t = Template(fp.read())
+        Templates.compiled[file_] = (mtime, t)
+        return t
+
+
 def dump_file(data, filename):
     with open(filename, 'w+') as file:
         yaml.dump(data, file, Dumper=yaml.RoundTripDumper)
 
 
+def dump_file_async(data, filename):
+    def log_failure(future_):
+        if future_.exception():
+            logger.error("Failed to write {}: {}".format(filename, future_.exception()))
+
+    future = Templates.dumper.submit(dump_file, copy.deepcopy(data), filename)
+    future.add_done_callback(log_failure)
+    return future
+
+
 def template_task(file_, kwargs=None):
     if not kwargs:
         kwargs = {}
-    with open(file_, 'r') as fp:
-        t = Template(fp.read())
-        data = t.render(**kwargs)
-        return ruamel.yaml.round_trip_load(data, preserve_quotes=True)
+    data = Templates.get(file_).render(**kwargs)
+    # Task files are parsed by PyYAML as before (YAML 1.1: yes/no/on are booleans, 0755 is octal)
+    return pyyaml.safe_load(data)
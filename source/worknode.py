@@ -1,12 +1,14 @@
+import copy
 import logging
+import math
 import time
 from enum import Enum
 from os.path import join
 
-import yaml
-
-from source.utils import template_bid, template_task, convert_price, TaskStatus, dump_file
+from source.utils import template_bid, template_task, convert_price, TaskStatus, dump_file_async, Nodes, task_tag
 from source.config import Config
+from source.market import MarketScanner
+from source.retry import CIRCUIT_OPEN
 
 
 class State(Enum):
@@ -29,13 +31,25 @@ def restart_timeout():
     return Config.base_config["restart_timeout"] if "restart_timeout" in Config.base_config else 600
 
 
+def dump_files():
+    return Config.base_config["dump_files"] if "dump_files" in Config.base_config else True
+
+
 class WorkNode:
+    TRACKED_FIELDS = {"status", "bid_id", "deal_id", "task_id", "price", "task_uptime", "supplier_id", "RUNNING"}
+
+    def __setattr__(self, name, value):
+        old = self.__dict__.get(name, value)
+        object.__setattr__(self, name, value)
+        if name in WorkNode.TRACKED_FIELDS and old != value:
+            Nodes.node_changed(self, name, old, value)
+
     def __init__(self, status, sonm_api, node_tag, deal_id, task_id, bid_id, price):
         self.RUNNING = False
         self.KEEP_WORK = True
         self.logger = logging.getLogger("monitor")
         self.node_tag = node_tag
-        self.tag = self.node_tag.split('_')[0]
+        self.tag = task_tag(self.node_tag)
         self.config = Config.get_node_config(self.node_tag)
         self.status = status
         self.sonm_api = sonm_api
@@ -48,8 +62,14 @@ class WorkNode:
         self.bid_id = bid_id
         self.price = "{0:.4f} USD/h".format(convert_price(price)) if price != "" else ""
         self.task_uptime = 0
+        self.supplier_id = ""
+        self.verified = True
+        self.order_created = time.time()
+        self.price_raise = 1
+        self.reprice_requested = False
         self.create_task_yaml()
         self.last_heartbeat = time.time()
+        self.step_duration = 0
 
     @classmethod
     def create_empty(cls, sonm_api, node_tag):
@@ -60,21 +80,27 @@ class WorkNode:
         return self.RUNNING
 
     def reload_config(self):
-        Config.reload_node_config(self.node_tag)
-        self.config = Config.get_node_config(self.node_tag)
+        config = Config.get_node_config(self.node_tag)
+        if config:
+            self.config = config
 
     def create_task_yaml(self):
         self.logger.info("Creating task file for Node {}".format(self.node_tag))
         file_ = join(Config.config_folder, self.config["template_file"])
         kwargs = {'node_tag': self.node_tag}
-        data = template_task(file_, kwargs)
-        dump_file(data, self.task_file)
-        with open(self.task_file) as f:
-            self.task_ = yaml.safe_load(f)
+        self.task_ = template_task(file_, kwargs)
+        if dump_files():
+            dump_file_async(self.task_, self.task_file)
 
     def create_bid_yaml(self):
         self.logger.info("Creating order file for Node {}".format(self.node_tag))
-        self.bid_ = template_bid(self.config, self.node_tag, self.config["counterparty"])
+        if self.tag in Config.bids:
+            self.bid_ = copy.deepcopy(Config.bids[self.tag])
+            self.bid_["tag"] = self.node_tag
+            if self.config["counterparty"]:
+                self.bid_["counterparty"] = self.config["counterparty"]
+        else:
+            self.bid_ = template_bid(self.config, self.node_tag, self.config["counterparty"])
 
         price_, predicted_, predicted_w_coeff_ = self.get_price()
         self.price = self.format_price(price_, readable=True)
@@ -82,19 +108,13 @@ class WorkNode:
 
         self.logger.info("Predicted price for Node {} is {:.4f} USD/h, with coefficient {:.4f} USD/h, order price is {}"
                          .format(self.node_tag, predicted_, predicted_w_coeff_, self.price))
-        dump_file(self.bid_, self.bid_file)
+        if dump_files():
+            dump_file_async(self.bid_, self.bid_file)
 
     def get_price(self):
-        predicted_price = Config.price_for_tag(self.tag)
-        price_ = self.config["max_price"]
-        predicted_w_coeff_ = 0
-        predicted_ = 0
-        if predicted_price:
-            predicted_ = predicted_price["perHourUSD"]
-            predicted_w_coeff_ = predicted_ * (1 + int(self.config["price_coefficient"]) / 100)
-            if predicted_w_coeff_ < float(self.config["max_price"]):
-                price_ = predicted_w_coeff_
-        return price_, predicted_, predicted_w_coeff_
+        # Price of long waiting order is raised by repricer, but never above max_price
+        price_, predicted_, predicted_w_coeff_ = order_price(self.config, self.tag)
+        return min(float(price_) * self.price_raise, float(self.config["max_price"])), predicted_, predicted_w_coeff_
 
     def create_order(self):
         self.reload_config()
@@ -102,16 +122,28 @@ class WorkNode:
         self.status = State.PLACING_ORDER
         self.logger.info("Create order for Node {}".format(self.node_tag))
         create_order = self.sonm_api.order_create(self.bid_)
+        if create_order is CIRCUIT_OPEN:
+            self.logger.error("Cannot create order for Node {}, sonm node api is unavailable. Will retry"
+                              .format(self.node_tag))
+            self.status = State.CREATE_ORDER
+            return
         if not create_order:
             raise Exception("Cannot create order. Check sonm-node status or your balance")
         self.bid_id = create_order["id"]
+        self.order_created = time.time()
         self.status = State.AWAITING_DEAL
         self.logger.info("Order for Node {} is {}".format(self.node_tag, self.bid_id))
 
     def check_order(self):
-        order_status = self.sonm_api.order_status(self.bid_id)
+        order_status = self.sonm_api.poller.order_status(self.bid_id)
         self.logger.info("Checking order {} (Node {}) for new deal".format(self.bid_id, self.node_tag))
+        return self.update_order(order_status)
+
+    def update_order(self, order_status):
         if order_status and order_status["orderStatus"] == 1 and order_status["dealID"] != "0":
+            deal_status = self.sonm_api.poller.deal_status(order_status["dealID"])
+            self.supplier_id = deal_status["supplier_id"] if deal_status else ""
+            self.price_raise = 1
             self.deal_id = order_status["dealID"]
             self.status = State.DEAL_OPENED
             self.logger.info("For order {} (Node {}) opened new deal {}"
@@ -127,12 +159,38 @@ class WorkNode:
     def cancel_order(self):
         self.sonm_api.order_cancel(self.bid_id)
 
+    def reprice_order(self):
+        # Replace order with a new one at current price, unless deal was opened meanwhile
+        self.reprice_requested = False
+        # Poller snapshot may be a couple of poll intervals old, order is confirmed by REST call before cancelling
+        order_status = self.sonm_api.order_status(self.bid_id)
+        if order_status is CIRCUIT_OPEN:
+            self.logger.error("Cannot reprice order {} (Node {}), sonm node api is unavailable"
+                              .format(self.bid_id, self.node_tag))
+            return 60
+        sleep_time = self.update_order(order_status)
+        if self.status != State.AWAITING_DEAL:
+            return sleep_time
+        self.logger.info("Repricing order {} (Node {}), price was {}".format(self.bid_id, self.node_tag, self.price))
+        order_cancel = self.sonm_api.order_cancel(self.bid_id)
+        # Cancelled order is an empty dict, check for failure explicitly
+        if order_cancel is None or order_cancel is CIRCUIT_OPEN:
+            self.logger.error("Failed to cancel order {} (Node {}) for repricing".format(self.bid_id, self.node_tag))
+            return sleep_time
+        self.bid_id = ""
+        self.status = State.CREATE_ORDER
+        return 1
+
     def start_task(self):
         # Start task on node
         self.status = State.STARTING_TASK
         self.logger.info("Starting task on node {} ...".format(self.node_tag))
         task = self.sonm_api.task_start(self.deal_id, self.task_, self.config["task_start_timeout"])
-        if not task:
+        if task is CIRCUIT_OPEN:
+            self.logger.error("Cannot start task (Node {}) on deal {}, sonm node api is unavailable. Will retry"
+                              .format(self.node_tag, self.deal_id))
+            self.status = State.DEAL_OPENED
+        elif not task:
             self.logger.error("Failed to start task (Node {}) on deal {}. Closing deal and blacklisting counterparty "
                               "worker's address...".format(self.node_tag, self.deal_id))
             self.status = State.TASK_FAILED_TO_START
@@ -143,7 +201,7 @@ class WorkNode:
             self.status = State.TASK_RUNNING
 
     def close_deal(self, state_after, blacklist=False):
-        # Close deal on node
+        # Close deal on node, logs are streamed in background
         self.logger.info("Saving logs deal_id {} task_id {}".format(self.deal_id, self.task_id))
         if self.status == State.TASK_FAILED or self.status == State.TASK_BROKEN:
             self.save_task_logs("out/fail_")
@@ -155,29 +213,41 @@ class WorkNode:
         if deal_status and deal_status["status"] == 2:
             self.logger.error("Deal {} (Node {}) already closed".format(self.deal_id, self.node_tag))
         else:
-            self.sonm_api.deal_close(self.deal_id, blacklist)
+            # Closed deal is an empty dict, check for failure explicitly
+            deal_close = self.sonm_api.deal_close(self.deal_id, blacklist)
+            if deal_close is None or deal_close is CIRCUIT_OPEN:
+                # Deal is still paid for, keep it and try again
+                self.logger.error("Failed to close deal {} (Node {}), will retry".format(self.deal_id, self.node_tag))
+                return False
             self.logger.info("Deal {} was closed".format(self.deal_id))
+            if blacklist:
+                # Event only, the worker address isn't a field of node
+                Nodes.node_changed(self, "blacklisted", None, self.supplier_id)
         self.deal_id = ""
         self.bid_id = ""
         self.task_uptime = 0
         self.task_id = ""
         self.status = state_after
+        return True
 
     def check_task_status(self):
-        deal_status = self.sonm_api.deal_status(self.deal_id)
+        deal_status = self.sonm_api.poller.deal_status(self.deal_id)
         if deal_status and deal_status["status"] == 2:
-            self.logger.info("Deal {} was closed".format(self.deal_id))
-            self.status = State.DEAL_DISAPPEARED
-            self.deal_id = ""
-            self.bid_id = ""
-            self.task_uptime = 0
-            self.task_id = ""
-            return 1
+            return self.deal_disappeared()
         elif deal_status and "error" in deal_status:
             self.logger.error("Cannot retrieve status deal {}".format(self.deal_id))
             return 60
 
         task_status = self.sonm_api.task_status(self.deal_id, self.task_id)
+        if task_status is CIRCUIT_OPEN:
+            self.logger.error("Cannot retrieve task status of deal {}, sonm node api is unavailable"
+                              .format(self.deal_id))
+            return 60
+        if not task_status or task_status["status"] != TaskStatus.running.value:
+            # Deal may be closed by supplier since the snapshot was taken, check it before changing state
+            deal_status = self.sonm_api.deal_status(self.deal_id)
+            if deal_status and deal_status["status"] == 2:
+                return self.deal_disappeared()
         if not task_status:
             self.logger.error("Cannot retrieve task status of deal {},"
                               " task_id {} worker is offline?".format(self.deal_id, self.task_id))
@@ -216,49 +286,66 @@ class WorkNode:
             return 1
         return 60
 
-    def watch_node(self):
-        self.RUNNING = True
-        sleep_time = 1
-        while self.KEEP_WORK and self.status != State.WORK_COMPLETED:
-            if int(time.time() - self.last_heartbeat) > restart_timeout():
-                self.reset_to_start()
-            if self.status == State.START or self.status == State.CREATE_ORDER:
-                self.create_order()
-                sleep_time = 60
-            elif self.status == State.AWAITING_DEAL:
-                sleep_time = self.check_order()
-            elif self.status == State.DEAL_OPENED:
-                self.start_task()
-                sleep_time = 60
-            elif self.status == State.DEAL_DISAPPEARED:
-                self.status = State.CREATE_ORDER
-                sleep_time = 1
-            elif self.status == State.TASK_RUNNING:
-                sleep_time = self.check_task_status()
-            elif self.status == State.TASK_FAILED_TO_START:
-                self.close_deal(State.CREATE_ORDER, blacklist=True)
-                sleep_time = 1
-            elif self.status == State.TASK_FAILED:
-                self.close_deal(State.CREATE_ORDER)
-                sleep_time = 1
-            elif self.status == State.TASK_BROKEN:
-                self.close_deal(State.CREATE_ORDER)
-                sleep_time = 1
-            elif self.status == State.TASK_FINISHED:
-                self.close_deal(State.WORK_COMPLETED)
-                sleep_time = 1
-            self.wait_sleep(sleep_time)
+    def deal_disappeared(self):
+        self.logger.info("Deal {} was closed".format(self.deal_id))
+        self.status = State.DEAL_DISAPPEARED
+        self.deal_id = ""
+        self.bid_id = ""
+        self.task_uptime = 0
+        self.task_id = ""
+        return 1
+
+    @property
+    def is_completed(self):
+        return self.status == State.WORK_COMPLETED
+
+    def step(self):
+        # Execute one transition of the node state machine and return seconds until the next one is due.
+        # Heartbeat is taken when the step actually runs and when it's done, time the step waited for a free
+        # step worker doesn't count as a hang.
+        started = time.time()
+        self.last_heartbeat = started
+        try:
+            return self.transition()
+        finally:
             self.last_heartbeat = time.time()
+            self.step_duration = self.last_heartbeat - started
+
+    def transition(self):
+        if not self.verified:
+            # Restored from journal, wait until state is verified against sonm node
+            return 5
+        if int(self.step_duration) > restart_timeout():
+            # Previous step hung on sonm node longer than restart_timeout, node state can't be trusted
+            self.reset_to_start()
+        sleep_time = 1
+        if self.status == State.START or self.status == State.CREATE_ORDER:
+            self.create_order()
+            sleep_time = 60
+        elif self.status == State.AWAITING_DEAL:
+            sleep_time = self.reprice_order() if self.reprice_requested else self.check_order()
+        elif self.status == State.DEAL_OPENED:
+            self.start_task()
+            sleep_time = 60
+        elif self.status == State.DEAL_DISAPPEARED:
+            self.status = State.CREATE_ORDER
+            sleep_time = 1
+        elif self.status == State.TASK_RUNNING:
+            sleep_time = self.check_task_status()
+        elif self.status == State.TASK_FAILED_TO_START:
+            sleep_time = 1 if self.close_deal(State.CREATE_ORDER, blacklist=True) else 60
+        elif self.status == State.TASK_FAILED:
+            sleep_time = 1 if self.close_deal(State.CREATE_ORDER) else 60
+        elif self.status == State.TASK_BROKEN:
+            sleep_time = 1 if self.close_deal(State.CREATE_ORDER) else 60
+        elif self.status == State.TASK_FINISHED:
+            sleep_time = 1 if self.close_deal(State.WORK_COMPLETED) else 60
+        return sleep_time
+
+    def log_stopped(self):
         self.logger.info("Node {} stopped, {}"
                          .format(self.node_tag, "work completed." if self.KEEP_WORK else "received stop signal."))
 
-    def wait_sleep(self, sleep_time):
-        for n in range(0, sleep_time if sleep_time else 60):
-            if self.KEEP_WORK:
-                time.sleep(1)
-            else:
-                return
-
     def finish_work(self):
         self.logger.info("Destroying Node {}".format(self.node_tag))
         self.KEEP_WORK = False
@@ -285,7 +372,7 @@ class WorkNode:
         self.logger.debug("Stopping Node {}...".format(self.node_tag))
 
     def save_task_logs(self, prefix):
-        self.sonm_api.task_logs(self.deal_id, self.task_id, "1000000",
+        self.sonm_api.task_logs(self.deal_id, self.task_id,
                                 "{}{}-deal-{}.log".format(prefix, self.node_tag, self.deal_id))
 
     @property
@@ -299,11 +386,41 @@ class WorkNode:
                          node_status=self.status,
                          since_hb=int(time.time() - self.last_heartbeat))
 
+    @property
+    def as_dict(self):
+        return {"node": self.node_tag,
+                "tag": self.tag,
+                "order_id": self.bid_id,
+                "order_price": self.price,
+                "deal_id": self.deal_id,
+                "task_id": self.task_id,
+                "task_uptime": self.task_uptime,
+                "status": self.status.name,
+                "since_hb": int(time.time() - self.last_heartbeat)}
+
     @staticmethod
     def format_price(price_, readable=False):
         return "{0:.4f}{1}USD/h".format(float(price_), " " if readable else "")
 
 
+def order_price(config, tag):
+    predicted_price = Config.price_for_tag(tag)
+    price_ = config["max_price"]
+    predicted_w_coeff_ = 0
+    predicted_ = 0
+    if predicted_price:
+        predicted_ = predicted_price["perHourUSD"]
+        predicted_w_coeff_ = predicted_ * (1 + int(config["price_coefficient"]) / 100)
+        if predicted_w_coeff_ < float(config["max_price"]):
+            price_ = predicted_w_coeff_
+    # Cheapest ask on market that satisfies the order, if it's affordable
+    market_price = MarketScanner.price_for_tag(tag)
+    if market_price is not None and market_price < float(config["max_price"]):
+        # Order price is written with 4 decimals, rounding it down would leave the order below the ask
+        price_ = min(math.ceil(market_price * 10000) / 10000, float(config["max_price"]))
+    return price_, predicted_, predicted_w_coeff_
+
+
 def get_css_class(node_state: State, since_hb: int):
     if since_hb > restart_timeout() or node_state in [State.TASK_FAILED, State.TASK_FAILED_TO_START, State.TASK_BROKEN]:
         return "table-danger"
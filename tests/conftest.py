@@ -0,0 +1,64 @@
+import os
+import shutil
+
+import pytest
+from ruamel.yaml import YAML
+
+from source.cache import TTLCache
+from source.config import Config
+from source.fakenode import FakeNode, FakeLogFetcher
+from source.market import MarketScanner
+from source.retry import CircuitBreakers
+from source.sonmapi import SonmApi
+from source.utils import Nodes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TASK = {"tag": "TEST", "numberofnodes": 2, "price_coefficient": 10, "max_price": "0.05", "ets": 180,
+        "task_start_timeout": 600, "template_file": "task_template.yaml", "duration": "0h", "counterparty": "",
+        "identity": "anonymous", "ramsize": 2000, "storagesize": 1, "cpucores": 1, "sysbenchsingle": 500,
+        "sysbenchmulti": 1000, "netdownload": 10, "netupload": 10, "overlay": False, "incoming": False,
+        "gpucount": 0, "gpumem": 0, "ethhashrate": 0}
+
+PREDICTED = {"TEST": {"perHourUSD": 0.01}}
+
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    # Config of one task with two nodes, loaded from a temporary conf folder
+    folder = tmp_path / "conf"
+    folder.mkdir()
+    yaml_ = YAML()
+    with open(str(folder / "config.yaml"), "w") as f:
+        yaml_.dump({"node_address": "fake://0", "ethereum": {"key_path": "", "password": ""},
+                    "tasks": ["task.yaml"], "restart_timeout": 600, "dump_files": False}, f)
+    with open(str(folder / "task.yaml"), "w") as f:
+        yaml_.dump(TASK, f)
+    shutil.copy(os.path.join(ROOT, "conf", "claymore.yaml"), str(folder / "task_template.yaml"))
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.setattr(Config, "config_folder", str(folder) + "/")
+    monkeypatch.setattr(Config, "base_config", {})
+    monkeypatch.setattr(Config, "node_configs", {})
+    monkeypatch.setattr(Config, "tasks", {})
+    monkeypatch.setattr(Config, "bids", {})
+    monkeypatch.setattr(Config, "files", {})
+    monkeypatch.setattr(Config, "listeners", [])
+    monkeypatch.setattr(MarketScanner, "prices", {})
+    Config.load_config()
+    Config.set_prices(dict(PREDICTED))
+    yield Config
+    for node_tag in Nodes.get_nodes_keys():
+        Nodes.remove_node(node_tag)
+    Config.set_prices({})
+
+
+@pytest.fixture
+def fake_node():
+    # Orders priced above the floor are matched on the next request, no latency or errors
+    return FakeNode(latency=0, deal_delay=(0, 0), asks=0, seed=1)
+
+
+@pytest.fixture
+def sonm_api(conf, fake_node):
+    return SonmApi("", "", "fake://0", 5, breakers=CircuitBreakers(failure_threshold=1), cache=TTLCache(ttl=0),
+                   log_fetcher=FakeLogFetcher(fake_node), node=fake_node)
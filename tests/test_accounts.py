@@ -0,0 +1,38 @@
+import pytest
+
+from source.accounts import Accounts, HashRing
+
+NODE_TAGS = ["TASK_{}".format(num) for num in range(1000)]
+
+
+def test_ring_spreads_nodes_evenly():
+    ring = HashRing(["0x1", "0x2", "0x3", "0x4"])
+    counts = {}
+    for node_tag in NODE_TAGS:
+        counts[ring.get(node_tag)] = counts.get(ring.get(node_tag), 0) + 1
+    assert sorted(counts) == ["0x1", "0x2", "0x3", "0x4"]
+    assert all(150 < count < 350 for count in counts.values())
+
+
+def test_ring_doesnt_depend_on_key_order():
+    assert [HashRing(["0x1", "0x2"]).get(tag) for tag in NODE_TAGS] == \
+        [HashRing(["0x2", "0x1"]).get(tag) for tag in NODE_TAGS]
+
+
+def test_added_account_takes_nodes_only_from_others():
+    before = HashRing(["0x1", "0x2", "0x3"])
+    after = HashRing(["0x1", "0x2", "0x3", "0x4"])
+    moved = [tag for tag in NODE_TAGS if before.get(tag) != after.get(tag)]
+    assert all(after.get(tag) == "0x4" for tag in moved)
+    assert 150 < len(moved) < 350
+
+
+def test_accounts_need_different_keys(sonm_api):
+    accounts = Accounts([sonm_api])
+    assert accounts.primary is sonm_api
+    assert accounts.for_node("TEST_1") is sonm_api
+    assert accounts.get(sonm_api.account) is sonm_api
+    with pytest.raises(Exception):
+        Accounts([sonm_api, sonm_api])
+    with pytest.raises(Exception):
+        Accounts([])
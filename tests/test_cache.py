@@ -0,0 +1,51 @@
+import time
+
+from source.cache import TTLCache
+
+
+def test_entry_expires_after_ttl():
+    cache = TTLCache(ttl=0.05)
+    cache.put(("order_status", "1"), {"id": "1"})
+    assert cache.get(("order_status", "1")) == {"id": "1"}
+    time.sleep(0.1)
+    assert cache.get(("order_status", "1")) is None
+    assert cache.metrics() == {"size": 0, "hits": 1, "misses": 1, "evictions": 0, "invalidations": 0}
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(max_size=2)
+    cache.put(("deal_status", "1"), 1)
+    cache.put(("deal_status", "2"), 2)
+    cache.get(("deal_status", "1"))
+    cache.put(("deal_status", "3"), 3)
+    assert cache.get(("deal_status", "2")) is None
+    assert cache.get(("deal_status", "1")) == 1 and cache.get(("deal_status", "3")) == 3
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_failed_results_and_zero_ttl_arent_stored():
+    cache = TTLCache()
+    cache.put(("order_status", "1"), None)
+    assert cache.metrics()["size"] == 0
+    cache = TTLCache(ttl=0)
+    cache.put(("order_status", "1"), {"id": "1"})
+    assert cache.get(("order_status", "1")) is None
+
+
+def test_invalidate_drops_entries_of_id():
+    cache = TTLCache()
+    cache.put(("task_status", "1", "task_a"), 1)
+    cache.put(("task_status", "1", "task_b"), 2)
+    cache.put(("task_status", "2", "task_a"), 3)
+    cache.put(("deal_status", "1"), 4)
+    cache.invalidate("task_status", "1")
+    assert cache.get(("task_status", "1", "task_a")) is None and cache.get(("task_status", "1", "task_b")) is None
+    assert cache.get(("task_status", "2", "task_a")) == 3 and cache.get(("deal_status", "1")) == 4
+    assert cache.metrics()["invalidations"] == 2
+
+
+def test_from_config():
+    cache = TTLCache.from_config({"ttl": 2, "size": 10})
+    assert (cache.ttl, cache.max_size) == (2, 10)
+    cache = TTLCache.from_config(None)
+    assert (cache.ttl, cache.max_size) == (5, 10000)
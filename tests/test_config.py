@@ -0,0 +1,70 @@
+import os
+
+import pytest
+from ruamel.yaml import YAML
+
+from source.config import Config
+
+from tests.conftest import TASK
+
+
+def write_task(conf, **changes):
+    path = os.path.join(conf.config_folder, "task.yaml")
+    with open(path, "w") as f:
+        YAML().dump(dict(TASK, **changes), f)
+    # Same second mtime on fast file systems, size or hash tells the change
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+
+@pytest.fixture
+def diffs(conf):
+    diffs_ = []
+    Config.add_listener(diffs_.append)
+    return diffs_
+
+
+def test_unchanged_task_keeps_configs(conf, diffs):
+    node_config = Config.get_node_config("TEST_1")
+    Config.load_config()
+    assert Config.get_node_config("TEST_1") is node_config
+    assert Config.node_diff == {"added": [], "removed": [], "changed": []}
+    # Rewritten with the same content
+    write_task(conf)
+    Config.load_config()
+    assert Config.get_node_config("TEST_1") is node_config
+    assert not diffs
+
+
+def test_node_diff(conf, diffs):
+    write_task(conf, numberofnodes=3)
+    Config.load_config()
+    # numberofnodes is part of the config every node of the task gets
+    assert diffs == [{"added": ["TEST_3"], "removed": [], "changed": ["TEST_1", "TEST_2"]}]
+    write_task(conf, numberofnodes=3, max_price="0.06")
+    Config.load_config()
+    assert diffs[-1] == {"added": [], "removed": [], "changed": ["TEST_1", "TEST_2", "TEST_3"]}
+    assert Config.get_node_config("TEST_1")["max_price"] == "0.06"
+    write_task(conf, numberofnodes=1, max_price="0.06")
+    Config.load_config()
+    assert diffs[-1] == {"added": [], "removed": ["TEST_2", "TEST_3"], "changed": ["TEST_1"]}
+    assert Config.fleet_size == 1
+
+
+def test_partition_keeps_fleet_size(conf, monkeypatch):
+    monkeypatch.setattr(Config, "partition", None)
+    monkeypatch.setattr(Config, "partition_ring", None)
+    write_task(conf, numberofnodes=100)
+    tags = set()
+    for index in range(3):
+        Config.set_partition(index, 3)
+        Config.load_config()
+        assert Config.fleet_size == 100
+        assert not tags & set(Config.node_configs)
+        tags |= set(Config.node_configs)
+    assert len(tags) == 100
+
+
+def test_missing_file(conf):
+    with pytest.raises(Exception):
+        Config.load_cfg("missing.yaml", conf.config_folder)
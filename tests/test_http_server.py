@@ -0,0 +1,145 @@
+import base64
+import json
+import socket
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from source import http_server
+from source.config import Config
+from source.http_server import create_app, run_http_server, Dashboard, NodeEvents, SonmHttpServer
+from source.utils import Nodes
+from source.worknode import WorkNode, State
+
+AUTH = {"Authorization": "Basic " + base64.b64encode(b"sonm:sonm").decode()}
+
+
+@pytest.fixture
+def client(conf, monkeypatch):
+    monkeypatch.setitem(Config.base_config, "http_server", {"user": "sonm", "password": "sonm", "cache_ttl": 600})
+    monkeypatch.setattr(Dashboard, "key", None)
+    return create_app().test_client()
+
+
+def add_nodes(sonm_api, count):
+    for num in range(1, count + 1):
+        Config.node_configs.setdefault("TEST_{}".format(num), Config.node_configs["TEST_1"])
+        Nodes.add_node(WorkNode.create_empty(sonm_api, "TEST_{}".format(num)))
+    return Nodes.get_nodes_arr()
+
+
+def get_json(client, url, status=200):
+    response = client.get(url, headers=AUTH)
+    assert response.status_code == status
+    return json.loads(response.get_data(as_text=True))
+
+
+def get_etag(client):
+    response = client.get("/", headers=AUTH)
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+def test_uptime_change_keeps_dashboard(client, sonm_api):
+    node, = add_nodes(sonm_api, 1)
+    etag = get_etag(client)
+    node.task_uptime = 120
+    assert client.get("/", headers=dict(AUTH, **{"If-None-Match": etag})).status_code == 304
+    node.status = State.AWAITING_DEAL
+    assert get_etag(client) != etag
+
+
+def test_api_requires_auth(client):
+    assert client.get("/api/nodes").status_code == 401
+    assert client.get("/", headers={"Authorization": "Basic " + base64.b64encode(b"sonm:x").decode()}) \
+        .status_code == 401
+
+
+def test_api_nodes_pages(client, sonm_api):
+    add_nodes(sonm_api, 12)
+    result = get_json(client, "/api/nodes?page=2&per_page=5")
+    assert (result["total"], result["page"], result["per_page"]) == (12, 2, 5)
+    assert [node["node"] for node in result["nodes"]] == ["TEST_{}".format(num) for num in range(6, 11)]
+    assert get_json(client, "/api/nodes?per_page=0")["per_page"] == 1
+
+
+def test_api_nodes_by_status_and_tag(client, sonm_api):
+    nodes = add_nodes(sonm_api, 3)
+    nodes[0].status = State.AWAITING_DEAL
+    nodes[2].status = State.TASK_RUNNING
+    result = get_json(client, "/api/nodes?status=awaiting_deal,task_running,unknown&tag=TEST")
+    assert [node["node"] for node in result["nodes"]] == ["TEST_1", "TEST_3"]
+    assert get_json(client, "/api/nodes?tag=OTHER")["total"] == 0
+    assert get_json(client, "/api/nodes/TEST_2")["node"] == "TEST_2"
+    assert "error" in get_json(client, "/api/nodes/TEST_9", 404)
+
+
+def test_api_prices(client):
+    Config.set_prices({"TEST": {"perHourUSD": 0.01}, "OTHER": None})
+    assert get_json(client, "/api/prices") == {"TEST": {"perHourUSD": 0.01, "marketUSD": None},
+                                               "OTHER": {"perHourUSD": None, "marketUSD": None}}
+
+
+def test_dashboard_etag_follows_prices(client, sonm_api):
+    add_nodes(sonm_api, 1)
+    etag = get_etag(client)
+    assert client.get("/", headers=dict(AUTH, **{"If-None-Match": etag})).status_code == 304
+    Config.set_prices({"TEST": {"perHourUSD": 0.02}})
+    assert get_etag(client) != etag
+
+
+def test_node_events_are_published(sonm_api, monkeypatch):
+    monkeypatch.setattr(NodeEvents, "subscribers", set())
+    subscriber = NodeEvents.subscribe()
+    node, = add_nodes(sonm_api, 1)
+    node.status = State.AWAITING_DEAL
+    Nodes.remove_node("TEST_1")
+    events = [subscriber.get_nowait() for _ in range(3)]
+    assert [event[0] for event in events] == ["node", "update", "removed"]
+    assert events[1][1] == {"node": "TEST_1", "status": "AWAITING_DEAL"}
+    assert events[2][1] == {"node": "TEST_1"}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.1)
+
+
+def test_dead_server_thread_is_replaced(conf, monkeypatch):
+    port = free_port()
+    monkeypatch.setitem(Config.base_config, "http_server", {"user": "sonm", "password": "sonm", "run": True,
+                                                            "host": "127.0.0.1", "port": port, "workers": 2})
+    servers = []
+    get_http_thread = http_server.get_http_thread
+
+    def record_server(server):
+        servers.append(server)
+        return get_http_thread(server)
+
+    monkeypatch.setattr(http_server, "get_http_thread", record_server)
+    monkeypatch.setattr(SonmHttpServer, "KEEP_RUNNING", True)
+    runner = threading.Thread(target=run_http_server)
+    runner.start()
+    try:
+        wait_for(lambda: servers)
+        # Serving loop stops and leaves its socket closed
+        servers[0].shutdown()
+        servers[0].socket.close()
+        wait_for(lambda: len(servers) == 2)
+        assert servers[1].socket is not servers[0].socket
+        request = urllib.request.Request("http://127.0.0.1:{}/".format(port), headers=AUTH)
+        with urllib.request.urlopen(request, timeout=5) as response:
+            assert response.status == 200
+    finally:
+        SonmHttpServer.KEEP_RUNNING = False
+        runner.join()
@@ -0,0 +1,56 @@
+import random
+
+from source.market import AskIndex, BENCHMARKS, requirements
+
+
+def ask(id_, price, author="0xa", netflags=0, **benchmarks):
+    return {"id": id_, "price": price, "author": author, "netflags": netflags,
+            "benchmarks": [benchmarks.get(name.replace("-", "_"), 0) for name in BENCHMARKS]}
+
+
+def bench(**values):
+    return tuple(values.get(name.replace("-", "_"), 0) for name in BENCHMARKS)
+
+
+def ids(asks):
+    return [ask_["id"] for ask_ in asks]
+
+
+def test_cheapest_matching_ask():
+    index = AskIndex([ask("1", 0.03, ram_size=4000, cpu_cores=4), ask("2", 0.01, ram_size=1000, cpu_cores=8),
+                      ask("3", 0.02, ram_size=8000, cpu_cores=2)])
+    assert ids(index.cheapest(bench(ram_size=2000))) == ["3"]
+    assert ids(index.cheapest(bench(ram_size=2000, cpu_cores=4))) == ["1"]
+    assert ids(index.cheapest(bench(), limit=3)) == ["2", "3", "1"]
+    assert index.cheapest(bench(ram_size=16000)) == []
+
+
+def test_netflags_and_counterparty():
+    index = AskIndex([ask("1", 0.01, author="0xA"), ask("2", 0.02, netflags=5),
+                      ask("3", 0.03, author="0xb", netflags=7)])
+    assert ids(index.cheapest(bench(), netflags=4, limit=2)) == ["2", "3"]
+    assert ids(index.cheapest(bench(), netflags=2)) == ["3"]
+    assert ids(index.cheapest(bench(), counterparty="0xa")) == ["1"]
+
+
+def test_index_matches_full_scan():
+    rnd = random.Random(1)
+    names = ["ram_size", "cpu_cores", "gpu_count", "net_download"]
+    asks = [ask(str(num), rnd.randint(1, 100) / 1000, netflags=rnd.randint(0, 7),
+                **{name: rnd.randint(0, 10) for name in names}) for num in range(300)]
+    index = AskIndex(asks)
+    for _ in range(100):
+        required = bench(**{name: rnd.randint(0, 10) for name in rnd.sample(names, 2)})
+        netflags = rnd.choice([0, 1, 4])
+        expected = sorted((ask_ for ask_ in asks if ask_["netflags"] & netflags == netflags and
+                           all(value >= min_ for value, min_ in zip(ask_["benchmarks"], required))),
+                          key=lambda ask_: ask_["price"])[:5]
+        assert [ask_["price"] for ask_ in index.cheapest(required, netflags, limit=5)] == \
+            [ask_["price"] for ask_ in expected]
+
+
+def test_requirements_of_bid_resources():
+    benchmarks, netflags = requirements({"benchmarks": {"ram-size": 2000, "gpu-count": 1},
+                                         "network": {"overlay": True, "incoming": True}})
+    assert benchmarks == bench(ram_size=2000, gpu_count=1)
+    assert netflags == 5
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from source.accounts import Accounts
+from source.config import Config
+from source.init import reload_config
+from source.prices import PriceService, spec_hash
+from source.utils import Nodes
+
+
+@pytest.fixture
+def prices(conf, monkeypatch):
+    for name, value in [("specs", {}), ("tags", {}), ("snapshot", {}), ("history", {}), ("failed", {})]:
+        monkeypatch.setattr(PriceService, name, value)
+    return PriceService
+
+
+def test_refresh_predicts_every_spec(prices, sonm_api):
+    prices.refresh(sonm_api)
+    assert Config.price_for_tag("TEST")["perHourUSD"] == pytest.approx(0.01, rel=0.1)
+    assert len(prices.price_history("TEST")) == 1
+
+
+def test_failed_spec_waits_for_backoff(prices, sonm_api, fake_node):
+    fake_node.error_rate = 1
+    prices.refresh(sonm_api)
+    hash_ = spec_hash(Config.bids["TEST"]["resources"])
+    failures, retry_at = prices.failed[hash_]
+    assert failures == 1 and retry_at > time.time() + prices.retry_delay - 5
+    assert Config.price_for_tag("TEST") is None
+
+    fake_node.error_rate = 0
+    sonm_api.breakers.get("predict_bid").record_success()
+    calls = fake_node.calls
+    prices.refresh(sonm_api, missing_only=True)
+    assert fake_node.calls == calls
+    prices.failed[hash_] = (failures, time.time())
+    prices.refresh(sonm_api, missing_only=True)
+    assert fake_node.calls == calls + 1
+    assert hash_ not in prices.failed and Config.price_for_tag("TEST")
+
+
+def test_backoff_doubles_up_to_max(prices, sonm_api, fake_node):
+    fake_node.error_rate = 1
+    hash_ = spec_hash(Config.bids["TEST"]["resources"])
+    delays = []
+    for _ in range(8):
+        if hash_ in prices.failed:
+            prices.failed[hash_] = (prices.failed[hash_][0], 0)
+        sonm_api.breakers.get("predict_bid").record_success()
+        started = time.time()
+        prices.refresh(sonm_api)
+        delays.append(round(prices.failed[hash_][1] - started, -1))
+    assert delays == [60, 120, 240, 480, 960, 1920, 3600, 3600]
+
+
+def test_reload_doesnt_wait_for_prediction(prices, sonm_api, fake_node):
+    Config.set_prices({})
+    fake_node.latency = 1
+    started = time.time()
+    reload_config(Accounts([sonm_api]))
+    assert time.time() - started < 1
+    assert Nodes.has_node("TEST_1") and Nodes.has_node("TEST_2")
+    prices.pending.result(timeout=10)
+    assert Config.price_for_tag("TEST")
@@ -0,0 +1,81 @@
+import time
+
+from source.retry import RetryPolicy, CircuitBreakers, BreakerState, DeferredRetries, CIRCUIT_OPEN
+
+
+def test_delay_grows_up_to_max():
+    policy = RetryPolicy(base_delay=1, max_delay=5, multiplier=2, jitter=0)
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == [1, 2, 4, 5, 5]
+
+
+def test_delay_jitter_stays_below_delay():
+    policy = RetryPolicy(base_delay=4, jitter=0.5)
+    for _ in range(100):
+        assert 2 <= policy.delay(1) <= 4
+
+
+def test_circuit_open_is_falsy():
+    assert not CIRCUIT_OPEN
+    assert CIRCUIT_OPEN is not None
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreakers(failure_threshold=3).get("order_status")
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == BreakerState.CLOSED
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+    assert breaker.stats["rejected"] == 1 and breaker.stats["opened"] == 1
+
+
+def test_request_errors_dont_open_breaker():
+    breaker = CircuitBreakers(failure_threshold=2).get("task_status")
+    breaker.record_failure()
+    breaker.record_error()
+    breaker.record_failure()
+    assert breaker.state == BreakerState.CLOSED
+
+
+def test_half_open_breaker_lets_single_probe():
+    breaker = CircuitBreakers(failure_threshold=1, reset_timeout=0.05).get("deal_status")
+    breaker.record_failure()
+    time.sleep(0.1)
+    assert breaker.allow()
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == BreakerState.CLOSED and breaker.allow()
+
+
+def test_failed_probe_opens_breaker_again():
+    breaker = CircuitBreakers(failure_threshold=5, reset_timeout=0.05).get("deal_status")
+    for _ in range(5):
+        breaker.record_failure()
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open and breaker.stats["opened"] == 2
+
+
+def test_breakers_are_kept_per_endpoint():
+    breakers = CircuitBreakers.from_config({"failure_threshold": 1, "reset_timeout": 10})
+    assert breakers.get("order_status") is breakers.get("order_status")
+    breakers.get("order_status").record_failure()
+    assert not breakers.get("deal_status").is_open
+    assert {m["endpoint"]: m["state"] for m in breakers.metrics()} == {"order_status": "OPEN",
+                                                                      "deal_status": "CLOSED"}
+
+
+def test_deferred_attempts_start_over_when_stale():
+    retries = DeferredRetries(max_age=0.05)
+    assert retries.attempt("key") == 1
+    retries.save("key", 3)
+    assert retries.attempt("key") == 3
+    # Attempt is taken by the request made
+    assert retries.attempt("key") == 1
+    retries.save("key", 3)
+    time.sleep(0.1)
+    assert retries.attempt("key") == 1
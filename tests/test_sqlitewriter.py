@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from source.sqlitewriter import SQLiteWriter
+
+
+@pytest.fixture
+def path(tmp_path):
+    path_ = str(tmp_path / "test.db")
+    connection = sqlite3.connect(path_)
+    connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    connection.close()
+    return path_
+
+
+def rows(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT id, name FROM items ORDER BY id").fetchall()
+    finally:
+        connection.close()
+
+
+def test_queued_statements_are_written_on_stop(path):
+    writer = SQLiteWriter(path, "test")
+    writer.start()
+    for num in range(100):
+        writer.execute("INSERT INTO items VALUES (?, ?)", (num, "item {}".format(num)))
+    writer.stop()
+    assert not writer.thread.is_alive()
+    assert len(rows(path)) == 100
+
+
+def test_failed_batch_is_dropped(path):
+    writer = SQLiteWriter(path, "test", retries=2, retry_delay=0)
+    writer.start()
+    writer.execute("INSERT INTO missing VALUES (?)", (1,))
+    writer.stop()
+    # Next writer on the same file isn't affected
+    writer = SQLiteWriter(path, "test")
+    writer.start()
+    writer.execute("INSERT INTO items VALUES (?, ?)", (1, "item"))
+    writer.stop()
+    assert rows(path) == [(1, "item")]
+
+
+def test_locked_database_is_retried(path):
+    lock = sqlite3.connect(path, isolation_level=None)
+    lock.execute("BEGIN EXCLUSIVE")
+    writer = SQLiteWriter(path, "test", retries=10, retry_delay=0.1)
+    writer.connect = lambda: sqlite3.connect(path, timeout=0)
+    writer.start()
+    writer.execute("INSERT INTO items VALUES (?, ?)", (1, "item"))
+    time.sleep(0.3)
+    lock.execute("COMMIT")
+    lock.close()
+    writer.stop()
+    assert rows(path) == [(1, "item")]
+
+
+def test_maintenance_runs_on_writer_connection(path):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.executemany("INSERT INTO items VALUES (?, ?)", [(num, "item") for num in range(10)])
+    connection.close()
+    done = threading.Event()
+
+    def maintenance(connection_):
+        with connection_:
+            connection_.execute("DELETE FROM items WHERE id < 5")
+        done.set()
+
+    writer = SQLiteWriter(path, "test", maintenance=maintenance, maintenance_interval=0)
+    writer.start()
+    assert done.wait(5)
+    writer.stop()
+    assert [id_ for id_, _ in rows(path)] == [5, 6, 7, 8, 9]
@@ -0,0 +1,76 @@
+from source.config import Config
+from source.utils import Nodes, natural_keys, task_tag
+from source.worknode import WorkNode, State
+
+
+def add_nodes(sonm_api, *node_tags):
+    # Nodes beyond the two of test config reuse its config
+    for node_tag in node_tags:
+        Config.node_configs.setdefault(node_tag, Config.node_configs["TEST_1"])
+    nodes = [WorkNode.create_empty(sonm_api, node_tag) for node_tag in node_tags]
+    for node in nodes:
+        Nodes.add_node(node)
+    return nodes
+
+
+def tags(nodes):
+    return [node.node_tag for node in nodes]
+
+
+def test_natural_order():
+    assert sorted(["TEST_10", "TEST_2", "TEST_1"], key=natural_keys) == ["TEST_1", "TEST_2", "TEST_10"]
+    assert task_tag("GPU_TASK_12") == "GPU_TASK"
+
+
+def test_nodes_are_kept_sorted(sonm_api):
+    add_nodes(sonm_api, "TEST_10", "TEST_2", "OTHER_1", "TEST_1")
+    assert Nodes.get_nodes_keys() == ["OTHER_1", "TEST_1", "TEST_2", "TEST_10"]
+    Nodes.remove_node("TEST_2")
+    assert Nodes.get_nodes_keys() == ["OTHER_1", "TEST_1", "TEST_10"]
+    assert tags(Nodes.get_nodes_arr()) == ["OTHER_1", "TEST_1", "TEST_10"]
+
+
+def test_nodes_by_tag(sonm_api):
+    add_nodes(sonm_api, "TEST_10", "OTHER_1", "TEST_2")
+    assert tags(Nodes.get_nodes_by_tag("TEST")) == ["TEST_2", "TEST_10"]
+    Nodes.remove_node("OTHER_1")
+    assert Nodes.get_nodes_by_tag("OTHER") == []
+    assert "OTHER" not in Nodes.by_tag
+
+
+def test_state_index_follows_status(sonm_api):
+    first, second, third = add_nodes(sonm_api, "TEST_3", "TEST_1", "TEST_2")
+    first.status = State.AWAITING_DEAL
+    third.status = State.TASK_RUNNING
+    assert tags(Nodes.get_nodes_by_state(State.START)) == ["TEST_1"]
+    assert tags(Nodes.get_nodes_by_state(State.AWAITING_DEAL, State.TASK_RUNNING)) == ["TEST_2", "TEST_3"]
+    assert Nodes.count_by_state() == {State.START: 1, State.AWAITING_DEAL: 1, State.TASK_RUNNING: 1}
+
+
+def test_replaced_node_is_reindexed(sonm_api):
+    old, = add_nodes(sonm_api, "TEST_1")
+    old.status = State.TASK_RUNNING
+    new, = add_nodes(sonm_api, "TEST_1")
+    assert Nodes.get_node("TEST_1") is new
+    assert tags(Nodes.get_nodes_by_state(State.START)) == ["TEST_1"]
+    assert Nodes.get_nodes_by_state(State.TASK_RUNNING) == []
+    # Replaced node no longer updates the index
+    old.status = State.DEAL_OPENED
+    assert Nodes.get_nodes_by_state(State.DEAL_OPENED) == []
+
+
+def test_not_running_index(sonm_api):
+    first, second = add_nodes(sonm_api, "TEST_1", "TEST_2")
+    first.RUNNING = True
+    assert tags(Nodes.get_not_running()) == ["TEST_2"]
+    first.RUNNING = False
+    assert tags(Nodes.get_not_running()) == ["TEST_1", "TEST_2"]
+
+
+def test_listeners_dont_get_running_flag(sonm_api, monkeypatch):
+    events = []
+    monkeypatch.setattr(Nodes, "listeners", [lambda *event: events.append(event[1:])])
+    node, = add_nodes(sonm_api, "TEST_1")
+    node.RUNNING = True
+    node.status = State.AWAITING_DEAL
+    assert events == [("node", None, "TEST_1"), ("status", State.START, State.AWAITING_DEAL)]
@@ -0,0 +1,248 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from source.accounts import Accounts
+from source.config import Config
+from source.history import HistoryStore, query
+from source.init import restore_nodes_state, verify_nodes_state
+from source.journal import Journal
+from source.repricer import Repricer
+from source.retry import CircuitBreakers, DeferredRetries
+from source.scheduler import NodeScheduler
+from source.utils import Nodes
+from source.worknode import WorkNode, State, restart_timeout
+
+
+def add_node(sonm_api, node_tag="TEST_1"):
+    node = WorkNode.create_empty(sonm_api, node_tag)
+    Nodes.add_node(node)
+    return node
+
+
+def run_until(node, status, steps=10):
+    for _ in range(steps):
+        if node.status == status:
+            return
+        node.step()
+    assert node.status == status
+
+
+def open_breaker(sonm_api, endpoint):
+    sonm_api.breakers.get(endpoint).record_failure()
+    assert sonm_api.breakers.get(endpoint).is_open
+
+
+def test_task_runs_on_matched_order(sonm_api):
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    assert node.deal_id and node.task_id
+    assert node.price == "0.0110 USD/h"
+
+
+def test_open_breaker_keeps_deal_opened(sonm_api):
+    node = add_node(sonm_api)
+    run_until(node, State.DEAL_OPENED)
+    open_breaker(sonm_api, "task_start")
+    node.step()
+    assert node.status == State.DEAL_OPENED
+    assert node.deal_id
+
+
+def test_open_breaker_keeps_running_task(sonm_api):
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    open_breaker(sonm_api, "task_status")
+    assert node.step() == 60
+    assert node.status == State.TASK_RUNNING
+
+
+def test_open_breaker_keeps_deal_to_close(sonm_api, fake_node):
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    node.status = State.TASK_FAILED
+    open_breaker(sonm_api, "deal_close")
+    assert node.step() == 60
+    assert node.status == State.TASK_FAILED
+    assert fake_node.deals[node.deal_id]["status"] == 1
+
+
+def test_order_at_max_price_without_prediction(sonm_api, fake_node):
+    Config.set_prices({})
+    node = add_node(sonm_api)
+    node.step()
+    assert node.status == State.AWAITING_DEAL
+    assert node.price == "0.0500 USD/h"
+
+
+def test_repricer_skips_tag_without_prediction(sonm_api):
+    # Deals are never matched, orders keep waiting
+    sonm_api.node.deal_probability = 0
+    node = add_node(sonm_api)
+    run_until(node, State.AWAITING_DEAL)
+    woken = []
+    repricer = Repricer(woken.append, threshold=5)
+    Config.set_prices({})
+    repricer.run()
+    assert not woken and not node.reprice_requested
+    Config.set_prices({"TEST": {"perHourUSD": 0.02}})
+    repricer.run()
+    assert woken == ["TEST_1"] and node.reprice_requested
+
+
+def test_reprice_confirms_order_with_node(sonm_api):
+    node = add_node(sonm_api)
+    run_until(node, State.AWAITING_DEAL)
+    bid_id = node.bid_id
+    # Snapshot still shows the order waiting, while sonm node has matched it already
+    with sonm_api.poller.lock:
+        sonm_api.poller.orders = {bid_id: {"id": bid_id, "tag": "TEST_1"}}
+        sonm_api.poller.updated = time.time()
+    node.reprice_requested = True
+    node.step()
+    assert node.status == State.DEAL_OPENED
+    assert node.bid_id == bid_id
+    assert node.deal_id == sonm_api.node.orders[bid_id]["dealID"]
+
+
+def test_restore_from_journal(sonm_api, fake_node, tmp_path):
+    running, waiting = add_node(sonm_api, "TEST_1"), add_node(sonm_api, "TEST_2")
+    run_until(running, State.TASK_RUNNING)
+    fake_node.deal_probability = 0
+    run_until(waiting, State.AWAITING_DEAL)
+    deal_id, task_id, bid_id = running.deal_id, running.task_id, waiting.bid_id
+    journal = Journal(str(tmp_path / "journal.db"))
+    journal.start()
+    journal.record_nodes(Nodes.get_nodes_arr())
+    journal.stop()
+    for node_tag in Nodes.get_nodes_keys():
+        Nodes.remove_node(node_tag)
+    # Order of the second node was cancelled while monitor was down
+    fake_node.orders[bid_id]["orderStatus"] = 1
+
+    accounts = Accounts([sonm_api])
+    assert restore_nodes_state(accounts, journal)
+    running, waiting = Nodes.get_node("TEST_1"), Nodes.get_node("TEST_2")
+    assert not running.verified and not waiting.verified
+    assert running.step() == 5
+    verify_nodes_state(accounts)
+    assert running.verified and waiting.verified
+    assert (running.status, running.deal_id, running.task_id) == (State.TASK_RUNNING, deal_id, task_id)
+    assert (waiting.status, waiting.bid_id) == (State.CREATE_ORDER, "")
+
+
+def test_step_waiting_for_worker_keeps_running_task(sonm_api, fake_node):
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    # Heartbeat of a node whose step waited long for a free step worker
+    node.last_heartbeat = time.time() - 2 * restart_timeout()
+    assert node.step() == 60
+    assert node.status == State.TASK_RUNNING
+    assert fake_node.deals[node.deal_id]["status"] == 1
+    assert time.time() - node.last_heartbeat < 1
+
+
+def test_hung_step_resets_node(sonm_api, monkeypatch):
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    resets = []
+    monkeypatch.setattr(node, "reset_to_start", lambda: resets.append(node.node_tag))
+    node.step_duration = restart_timeout() + 1
+    node.step()
+    assert resets == ["TEST_1"]
+    assert node.step_duration < 1
+
+
+def test_closed_deal_moves_node_on(sonm_api, fake_node):
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    deal_id = node.deal_id
+    node.status = State.TASK_FAILED
+    # Closed deal is an empty dict, same as a cancelled order below
+    assert node.step() == 1
+    assert (node.status, node.deal_id, node.task_id) == (State.CREATE_ORDER, "", "")
+    assert fake_node.deals[deal_id]["status"] == 2
+
+
+def test_finished_task_completes_work(sonm_api, fake_node):
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    deal_id = node.deal_id
+    node.status = State.TASK_FINISHED
+    assert node.step() == 1
+    assert node.status == State.WORK_COMPLETED and node.is_completed
+    assert fake_node.deals[deal_id]["status"] == 2
+
+
+def test_reprice_replaces_cancelled_order(sonm_api, fake_node):
+    fake_node.deal_probability = 0
+    node = add_node(sonm_api)
+    run_until(node, State.AWAITING_DEAL)
+    bid_id = node.bid_id
+    node.reprice_requested = True
+    assert node.step() == 1
+    assert (node.status, node.bid_id) == (State.CREATE_ORDER, "")
+    assert fake_node.orders[bid_id]["orderStatus"] == 1
+    node.step()
+    assert node.status == State.AWAITING_DEAL and node.bid_id != bid_id
+
+
+def test_blacklisted_worker_is_recorded(sonm_api, fake_node, tmp_path, monkeypatch):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    events = []
+    monkeypatch.setattr(Nodes, "listeners", Nodes.listeners + [history.node_changed,
+                                                               lambda *event: events.append(event[1:])])
+    history.start()
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    supplier_id = node.supplier_id
+    assert supplier_id
+    node.status = State.TASK_FAILED_TO_START
+    assert node.step() == 1
+    history.stop()
+    assert node.status == State.CREATE_ORDER
+    assert ("blacklisted", None, supplier_id) in events
+    _, _, rows = query(history.path, "blacklist", 0)
+    assert [row[:2] for row in rows] == [(supplier_id, 1)]
+
+
+def test_closed_deal_without_blacklist_isnt_recorded(sonm_api, tmp_path, monkeypatch):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    monkeypatch.setattr(Nodes, "listeners", Nodes.listeners + [history.node_changed])
+    history.start()
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    node.status = State.TASK_BROKEN
+    assert node.step() == 1
+    history.stop()
+    assert query(history.path, "blacklist", 0)[2] == []
+
+
+def test_step_thread_defers_retries(sonm_api, fake_node):
+    sonm_api.breakers = CircuitBreakers(failure_threshold=100)
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    fake_node.error_rate = 1
+    with ThreadPoolExecutor(max_workers=1, initializer=DeferredRetries.enable) as executor:
+        started = time.time()
+        delay = executor.submit(NodeScheduler.step, node).result()
+        # Backoff is the next due time instead of a sleep on step thread
+        assert time.time() - started < 1
+        assert 0 < delay <= 2
+        assert node.status == State.TASK_RUNNING
+        fake_node.error_rate = 0
+        assert executor.submit(NodeScheduler.step, node).result() == 60
+        assert node.status == State.TASK_RUNNING
+
+
+def test_deferred_retries_give_up_after_policy_retries(sonm_api, fake_node):
+    sonm_api.breakers = CircuitBreakers(failure_threshold=100)
+    node = add_node(sonm_api)
+    run_until(node, State.TASK_RUNNING)
+    fake_node.error_rate = 1
+    with ThreadPoolExecutor(max_workers=1, initializer=DeferredRetries.enable) as executor:
+        for _ in range(10):
+            if node.status != State.TASK_RUNNING:
+                break
+            executor.submit(NodeScheduler.step, node).result()
+    # task_status is retried 5 times, then the worker is taken for offline
+    assert node.status == State.TASK_FAILED